@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Benchmark of the dh/dt pipeline (DemPile) on synthetic DEM stacks with a known dh/dt
+# Oct 19 2026
+#
+# usage: python dhdt_benchmark.py [--sizes 100 200] [--dems 10 20] [--workdir DIR] [--output results.json]
+#
+# For each grid size (N x N pixels) and number of DEMs, a synthetic DEM stack is generated by
+# carst.libsynth.synthetic_dem_stack, and pileup, do_evmd, polyfit, form_mosaic and fitdata2file are
+# run in a new process (so that the peak memory of each case is measured separately). The script reports
+#    - time and throughput (pixels per second; pixels x DEMs per second for pileup) of each step
+#    - peak memory (RSS) of the case
+#    - accuracy: RMSE and bias of dh/dt against the truth, the fraction of pixels with a dh/dt,
+#      and RMSE of the mosaic against the true surface at the mosaic date (large if EVMD misses outliers)
+#
+# With --baseline (the --output of an earlier run), each case is compared with the baseline, and the script
+# exits with 1 if a case is slower than --tolerance times the baseline or its dh/dt RMSE is worse.
+#
+# try:
+#    python dhdt_benchmark.py --sizes 50 100 --dems 10
+# for a quick run.
+
+from argparse import ArgumentParser, SUPPRESS
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+STEPS = ['pileup', 'do_evmd', 'polyfit', 'form_mosaic', 'fitdata2file']
+
+
+def run_case(ini, truth_dhdt, truth_z0):
+
+    """
+    Run the pipeline on one synthetic stack (in this process) and return the timings and the accuracy.
+    """
+
+    from carst import libperf
+    from carst.libraster import SingleRaster
+    from carst.libdhdt import DemPile
+
+    recorder = libperf.enable()
+    a = DemPile()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        a.read_config(ini)
+        a.init_ts()
+        for step in STEPS:
+            with libperf.stage('bench.' + step):
+                getattr(a, step)()
+    report = recorder.report()
+
+    npix = int(np.sum(a.refgeomask))
+    ndems = len(a.dems)
+    result = {'pixels': npix, 'dems': ndems, 'peak_rss_mb': report['peak_rss_mb'], 'steps': {}}
+    for step in STEPS:
+        wall = report['stages']['bench.' + step]['wall_s']
+        items = npix * ndems if step == 'pileup' else npix
+        result['steps'][step] = {'wall_s': wall, 'items_per_s': items / wall if wall > 0 else None}
+    result['total_s'] = sum([i['wall_s'] for i in result['steps'].values()])
+
+    # ==== accuracy ====
+    nodata = a.refgeo.get_nodata()
+    dhdt_true = SingleRaster(truth_dhdt).ReadAsArray()
+    z0_true = SingleRaster(truth_z0).ReadAsArray()
+    slope = np.asarray(a.fitdata['slope'], dtype=float)
+    valid = a.refgeomask & (slope != nodata) & ~np.isnan(slope)
+    err = slope[valid] - dhdt_true[valid]
+    result['dhdt_coverage'] = float(valid.sum()) / npix
+    result['dhdt_rmse'] = float(np.sqrt(np.mean(err ** 2))) if err.size else None
+    result['dhdt_bias'] = float(np.mean(err)) if err.size else None
+    mosaic_value = np.asarray(a.mosaic['value'], dtype=float)
+    mosaic_date = np.asarray(a.mosaic['date'], dtype=float)
+    valid = a.refgeomask & (mosaic_value != nodata) & ~np.isnan(mosaic_value)
+    err = mosaic_value[valid] - (z0_true[valid] + dhdt_true[valid] * mosaic_date[valid] / 365.25)
+    result['mosaic_coverage'] = float(valid.sum()) / npix
+    result['mosaic_rmse'] = float(np.sqrt(np.mean(err ** 2))) if err.size else None
+    return result
+
+
+def print_table(results):
+    header = '{:>6} {:>5} {:>9}'.format('size', 'dems', 'rss(MB)')
+    header += ''.join([' {:>14}'.format(step + '(s)') for step in STEPS])
+    header += ' {:>9} {:>9} {:>9} {:>11}'.format('total(s)', 'rmse', 'bias', 'mosaic_rmse')
+    print(header)
+    for r in results:
+        line = '{:>6} {:>5} {:>9.1f}'.format(r['size'], r['dems'], r['peak_rss_mb'] or 0)
+        line += ''.join([' {:>14.3f}'.format(r['steps'][step]['wall_s']) for step in STEPS])
+        line += ' {:>9.3f} {:>9.4f} {:>9.4f} {:>11.4f}'.format(r['total_s'], r['dhdt_rmse'] or np.nan,
+                                                                r['dhdt_bias'] or np.nan, r['mosaic_rmse'] or np.nan)
+        print(line)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the dh/dt pipeline on synthetic DEM stacks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200], help='Grid sizes (N for N x N pixels)')
+    parser.add_argument('--dems', type=int, nargs='+', default=[10, 20], help='Numbers of DEMs')
+    parser.add_argument('--oversample', type=int, default=1, help='DEMs are this many times finer than the reference geometry')
+    parser.add_argument('--outlier-fraction', type=float, default=0.02, dest='outlier_fraction')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default='dhdt_benchmark_data', help='Where the synthetic data are written')
+    parser.add_argument('--output', help='Save the results as a JSON file')
+    parser.add_argument('--baseline', help='Compare with the results (JSON) of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='Allowed slowdown w.r.t. the baseline (default: 1.2)')
+    parser.add_argument('--run-case', nargs=3, metavar=('INI', 'TRUTH_DHDT', 'TRUTH_Z0'), dest='run_case',
+                        help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        # Child process: run one case and print the result as JSON
+        print(json.dumps(run_case(*args.run_case)))
+        return
+
+    from carst.libsynth import synthetic_dem_stack
+    results = []
+    for size in args.sizes:
+        for n_dems in args.dems:
+            outdir = os.path.join(args.workdir, '{}x{}_{}dems'.format(size, size, n_dems))
+            stack = synthetic_dem_stack(outdir, shape=(size, size), n_dems=n_dems, oversample=args.oversample,
+                                        outlier_fraction=args.outlier_fraction, seed=args.seed)
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case',
+                                   stack['ini'], stack['truth_dhdt'], stack['truth_z0']],
+                                  stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            result['size'] = size
+            results.append(result)
+            print('{}x{} pixels, {} DEMs: {:.2f} s'.format(size, size, n_dems, result['total_s']))
+
+    print_table(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare_with_baseline(results, baseline, tolerance=args.tolerance):
+            sys.exit(1)
+
+
+def compare_with_baseline(results, baseline, tolerance=1.2, rmse_margin=1e-3):
+
+    """
+    Print the speedup of each case w.r.t. the baseline. Return False if a case is slower than tolerance x baseline
+    or its dh/dt RMSE is worse than the baseline (+ rmse_margin).
+    """
+
+    passed = True
+    baseline = {(r['size'], r['dems']): r for r in baseline}
+    for r in results:
+        b = baseline.get((r['size'], r['dems']))
+        if b is None:
+            continue
+        ratio = r['total_s'] / b['total_s']
+        status = 'ok'
+        if ratio > tolerance:
+            status = 'SLOWER'
+            passed = False
+        if r['dhdt_rmse'] is not None and b['dhdt_rmse'] is not None and r['dhdt_rmse'] > b['dhdt_rmse'] + rmse_margin:
+            status = 'LESS ACCURATE'
+            passed = False
+        print('{}x{} pixels, {} DEMs: {:.2f}x speedup, {}'.format(r['size'], r['size'], r['dems'], 1 / ratio, status))
+    return passed
+
+
+if __name__ == '__main__':
+    main()
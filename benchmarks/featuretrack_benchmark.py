@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Benchmark of feature tracking (bin/featuretrack.py) on synthetic image pairs with a known displacement
+# Oct 19 2026
+#
+# usage: python featuretrack_benchmark.py [--sizes 400 800] [--flows channel shear rotation]
+#                                         [--backend auto|isce|numpy] [--workdir DIR] [--output results.json]
+#
+# For each image size (N x N pixels) and flow field, an image pair is generated by
+# carst.libsynth.synthetic_image_pair, and each step of bin/featuretrack.py (ampcor, rawvelo,
+# correctvelo, rmnoise) is run in a new process with --perf-report. The script reports
+#    - time and peak memory (RSS) of each step
+#    - chips per second of ampcor
+#    - RMSE of the ampcor offsets (in pixels) against the truth, for the chips with SNR >= the ini threshold,
+#      and the fraction of chips that pass the threshold
+# It works without ISCE, using the native numpy backend (backend = auto or numpy).
+#
+# try:
+#    python featuretrack_benchmark.py --sizes 300 --flows channel
+# for a quick run.
+
+from argparse import ArgumentParser
+import json
+import os
+import pickle
+import subprocess
+import sys
+import numpy as np
+
+STEPS = ['ampcor', 'rawvelo', 'correctvelo', 'rmnoise']
+FEATURETRACK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'featuretrack.py')
+
+
+def run_step(ini, step, report_path):
+    env = dict(os.environ, MPLBACKEND='Agg')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.run([sys.executable, FEATURETRACK, ini, '-s', step, '--perf-report', report_path],
+                       stdout=devnull, check=True, env=env)
+    with open(report_path) as f:
+        return json.load(f)
+
+
+def offset_accuracy(ampoff_path, truth_dx, truth_dy, snr_threshold):
+
+    """
+    RMSE of the ampcor offsets against the true displacement at the chip centers.
+    """
+
+    data = pickle.load(open(ampoff_path, 'rb'))
+    cols = data[:, 0].astype(int) - 1
+    rows = data[:, 2].astype(int) - 1
+    good = data[:, 4] >= snr_threshold
+    ex = data[good, 1] - truth_dx[rows[good], cols[good]]
+    ey = data[good, 3] - truth_dy[rows[good], cols[good]]
+    return {'chips': int(data.shape[0]),
+            'snr_pass_fraction': float(good.mean()) if data.shape[0] else None,
+            'rmse_x': float(np.sqrt(np.mean(ex ** 2))) if ex.size else None,
+            'rmse_y': float(np.sqrt(np.mean(ey ** 2))) if ey.size else None}
+
+
+def print_table(results):
+    header = '{:>6} {:>9} {:>9}'.format('size', 'flow', 'rss(MB)')
+    header += ''.join([' {:>15}'.format(step + '(s)') for step in STEPS])
+    header += ' {:>8} {:>9} {:>8} {:>8} {:>8}'.format('chips', 'chips/s', 'snr_ok', 'rmse_x', 'rmse_y')
+    print(header)
+    for r in results:
+        line = '{:>6} {:>9} {:>9.1f}'.format(r['size'], r['flow'], max([r['steps'][s]['peak_rss_mb'] or 0 for s in STEPS]))
+        line += ''.join([' {:>15.3f}'.format(r['steps'][step]['wall_s']) for step in STEPS])
+        line += ' {:>8d} {:>9.1f} {:>8.3f} {:>8.4f} {:>8.4f}'.format(r['chips'], r['chips_per_s'] or np.nan,
+                                                                   r['snr_pass_fraction'] or np.nan,
+                                                                   r['rmse_x'] or np.nan, r['rmse_y'] or np.nan)
+        print(line)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of feature tracking on synthetic image pairs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[400, 800], help='Image sizes (N for N x N pixels)')
+    parser.add_argument('--flows', nargs='+', default=['channel', 'shear', 'rotation'], help='Flow fields')
+    parser.add_argument('--max-displacement', type=float, default=5.0, dest='max_displacement', help='In pixels')
+    parser.add_argument('--noise', type=float, default=0.05, help='Noise level (x the image std)')
+    parser.add_argument('--image', help='Warp this image instead of a random texture')
+    parser.add_argument('--backend', default='auto', help='auto, isce, or numpy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default='featuretrack_benchmark_data', help='Where the synthetic data are written')
+    parser.add_argument('--output', help='Save the results as a JSON file')
+    args = parser.parse_args()
+
+    from carst import ConfParams
+    from carst.libraster import SingleRaster
+    from carst.libsynth import synthetic_image_pair
+
+    results = []
+    for size in args.sizes:
+        for flow in args.flows:
+            outdir = os.path.join(args.workdir, '{}x{}_{}'.format(size, size, flow))
+            pair = synthetic_image_pair(outdir, shape=(size, size), flow=flow, max_displacement=args.max_displacement,
+                                        image=args.image, noise=args.noise, backend=args.backend, seed=args.seed)
+            result = {'size': size, 'flow': flow, 'steps': {}}
+            for step in STEPS:
+                report = run_step(pair['ini'], step, os.path.join(outdir, 'perf_{}.json'.format(step)))
+                result['steps'][step] = {'wall_s': report['wall_s'], 'peak_rss_mb': report['peak_rss_mb'],
+                                         'stages': report['stages']}
+            ini = ConfParams(pair['ini'])
+            ini.ReadParam()
+            ini.VerifyParam()
+            accuracy = offset_accuracy(ini.rawoutput['label_ampcor'] + '.p', SingleRaster(pair['truth_dx']).ReadAsArray(),
+                                       SingleRaster(pair['truth_dy']).ReadAsArray(), ini.noiseremoval['snr'])
+            result.update(accuracy)
+            ampcor_stage = result['steps']['ampcor']['stages'].get('ampcor')
+            result['chips_per_s'] = result['chips'] / ampcor_stage['wall_s'] if ampcor_stage else None
+            results.append(result)
+            print('{}x{} pixels, {}: {:.2f} s'.format(size, size, flow, sum([result['steps'][s]['wall_s'] for s in STEPS])))
+
+    print_table(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@
 # Major rehaul: May 7, 2018
 # modified from the workflow of the FJL paper (Zheng et al, 2018)
 #
-# usage: python dhdt.py config_file
+# usage: python dhdt.py config_file [--perf-report report.json] [--perf-trace trace.json]
 #
 # try: 
 #    python dhdt.py defaults.ini 
@@ -17,15 +17,18 @@
 from argparse import ArgumentParser
 import sys
 import os
+from carst import libperf
 from carst import ConfParams
 from carst.libdhdt import DemPile, onclick_wrapper
-import matplotlib.pyplot as plt
 import numpy as np
 
 parser = ArgumentParser()
 parser.add_argument('config_file', help='Configuration file')
 parser.add_argument('-s', '--step', help='Do a single step', dest='step')
+libperf.add_arguments(parser)
 args = parser.parse_args()
+libperf.enable_from_args(args)
+libperf.log_to_console()
 
 # ==== Read ini file ====
 
@@ -42,17 +45,36 @@ if args.step is None:
     a.init_ts()
     a.pileup()
     a.dump_pickle()
+    if a.windows:
+        # label once, so that polyfit and polyfit_windows both use the stored EVMD labels
+        a.do_evmd()
     a.polyfit()
     a.fitdata2file()
+    if a.windows:
+        a.polyfit_windows()
 elif args.step == 'stack':
     a.init_ts()
     a.pileup()
     a.dump_pickle()
 elif args.step == 'dhdt':
     a.load_pickle()
+    if a.windows:
+        # label once, so that polyfit and polyfit_windows both use the stored EVMD labels
+        a.do_evmd()
     a.polyfit()
     a.fitdata2file()
+    if a.windows:
+        a.polyfit_windows()
+elif args.step == 'sweep':
+    # ==== dh/dt summary for each combination of the [sweep] parameters ====
+    a.load_pickle()
+    a.sweep()
+elif args.step == 'quicklook':
+    # ==== dh/dt with O(pixels) memory and a gate instead of EVMD, set by [quicklook] (no pickle file) ====
+    a.pileup_streaming()
+    a.fitdata2file()
 elif args.step == 'viewts':
+    import matplotlib.pyplot as plt
     a.load_pickle()
     a.viz()
     plt.show()
@@ -6,9 +6,10 @@
 
 # The code uses the ampcor module, which was developed as part of 
 # ROI_PAC and was inherited by ISCE.
-# To use this script, ISCE must be installed first.
+# To use this script, ISCE must be installed first, or set backend = numpy in [pxsettings]
+# to use the native NCC backend instead.
 #
-# usage: python pixeltrack.py config_file [-s STAGE]
+# usage: python pixeltrack.py config_file [-s STAGE] [--perf-report report.json] [--perf-trace trace.json]
 #
 # availabe STAGE name: 
 #    ampcor        ---> perform ampcor (amplitude correlator) using NCC
@@ -23,25 +24,21 @@
 #
 # complete readme is at CARST/Doc/pixeltrack/README.rst
 
-# === dealing with issues described at https://github.com/isce-framework/isce2/issues/258 ===
-import logging
-import isce
-root_logger = logging.getLogger()
-root_logger.setLevel('WARNING')
-# ===========================================================================================
-
 from argparse import ArgumentParser
 import sys
 import os
+from carst import libperf
 from carst import SingleRaster, RasterVelos, ConfParams
-from carst.libft import ampcor_task, writeout_ampcor_task
 from carst.libxyz import ZArray, DuoZArray, AmpcoroffFile, points_in_polygon
 import numpy as np
 
 parser = ArgumentParser()
 parser.add_argument('config_file', help='Configuration file')
 parser.add_argument('-s', '--step', help='Do a single step', dest='step')
+libperf.add_arguments(parser)
 args = parser.parse_args()
+libperf.enable_from_args(args)
+libperf.log_to_console()
 
 # ==== Read ini file ====
 
@@ -54,13 +51,25 @@ ini.VerifyParam()
 
 if args.step == 'ampcor' or args.step is None:
 
+	# ISCE is only needed here, so it is not imported for the other steps.
+	# Without ISCE, the native numpy backend is used (backend = numpy in [pxsettings]).
+	from carst.libft import ampcor_backend, ampcor_task, writeout_ampcor_task
+	backend = ampcor_backend(ini.pxsettings['backend'])
+	if backend == 'isce':
+		# === dealing with issues described at https://github.com/isce-framework/isce2/issues/258 ===
+		import logging
+		root_logger = logging.getLogger()
+		root_logger.setLevel('WARNING')
+		# ===========================================================================================
+
 	a = SingleRaster(ini.imagepair['image1'], date=ini.imagepair['image1_date'])
 	b = SingleRaster(ini.imagepair['image2'], date=ini.imagepair['image2_date'])
 	if ini.pxsettings['gaussian_hp']:
 		a.GaussianHighPass(sigma=ini.pxsettings['gaussian_hp_sigma'])
 		b.GaussianHighPass(sigma=ini.pxsettings['gaussian_hp_sigma'])
-	a.AmpcorPrep()
-	b.AmpcorPrep()
+	if backend == 'isce':
+		a.AmpcorPrep()
+		b.AmpcorPrep()
 
 	# ==== Run main processes ====
 
@@ -0,0 +1,372 @@
+# Class: BlockCache
+# Func: get_cache, set_cache, configure_cache, is_remote, cached_read, materialize, local_copy
+# used for reading remote (http/https) rasters, e.g., COGs of DEM strips or satellite images
+# Oct 19 2026
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+from carst.liblazy import lazy_import
+
+rasterio = lazy_import('rasterio')
+
+# The default cache used by SingleRaster and resample_array. None means no caching.
+_default_cache = None
+_default_cache_checked = False
+
+
+class BlockCache:
+
+    """
+    Persistent on-disk cache of raster blocks, shared by different runs.
+    Each block is saved as a .npy file whose name is sha256(url|etag|band|block index), so that a changed
+    remote file (with a new ETag) never returns stale data. The raster metadata (size, block size,
+    transform, CRS, nodata, ...) is cached in the same way.
+    cache_dir: where the blocks are saved.
+    max_bytes: size cap. The least recently used blocks are removed when the cache is larger than this.
+    etag_ttl: how long (in seconds) a known ETag is trusted before asking the server again.
+              Within this period, a fully cached raster is read without any network access.
+    timeout: timeout (in seconds) of the HEAD request for the ETag.
+    stats: number of hits, misses, and evictions in this session.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3, etag_ttl=7 * 86400, timeout=30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.etag_ttl = etag_ttl
+        self.timeout = timeout
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return 'BlockCache({}, max_bytes={}, stats={})'.format(self.cache_dir, self.max_bytes, self.stats)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256('|'.join([str(i) for i in parts]).encode('utf-8')).hexdigest()
+
+    def path(self, key, suffix='.npy'):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    # ==== ETag ====
+
+    def etag(self, url):
+
+        """
+        ETag of a remote file (or Last-Modified + Content-Length if the server does not give an ETag),
+        saved in the cache for etag_ttl seconds.
+        A failed request (e.g., HTTP 404/403, a refused connection, or no response within self.timeout seconds)
+        raises RasterioIOError, the same error as reading a bad URL without the cache, so that the callers
+        (e.g., DemPile.iter_resampled_dems) can retry or skip it.
+        """
+
+        index_path = self.path(self.key('etag', url), suffix='.json')
+        if os.path.isfile(index_path):
+            with open(index_path) as f:
+                record = json.load(f)
+            if time.time() - record['time'] < self.etag_ttl:
+                return record['etag']
+        request = urllib.request.Request(url, method='HEAD')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                headers = response.headers
+        except (urllib.error.URLError, OSError) as err:     # HTTPError is a URLError; timeouts are OSErrors
+            from rasterio.errors import RasterioIOError
+            raise RasterioIOError('Cannot get the ETag of {}: {}'.format(url, err)) from err
+        etag = headers.get('ETag')
+        if etag is None:
+            etag = '{}-{}'.format(headers.get('Last-Modified'), headers.get('Content-Length'))
+        self._write_json(index_path, {'etag': etag, 'time': time.time()})
+        return etag
+
+    # ==== metadata ====
+
+    def metadata(self, url):
+
+        """
+        Size, data type, block size, transform, CRS and nodata of a remote raster.
+        """
+
+        meta_path = self.path(self.key('meta', url, self.etag(url)), suffix='.json')
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                return json.load(f)
+        with rasterio.open(url) as src:
+            meta = {'width': src.width, 'height': src.height, 'count': src.count,
+                    'dtypes': list(src.dtypes), 'block_shapes': [list(i) for i in src.block_shapes],
+                    'transform': list(src.transform.to_gdal()), 'crs': src.crs.to_wkt() if src.crs else None,
+                    'nodata': src.nodata}
+        self._write_json(meta_path, meta)
+        return meta
+
+    # ==== blocks ====
+
+    def get(self, key):
+        fpath = self.path(key)
+        try:
+            array = np.load(fpath)
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        try:
+            os.utime(fpath)      # mtime is used as the last access time for LRU eviction
+        except OSError:
+            pass
+        with self._lock:
+            self.stats['hits'] += 1
+        return array
+
+    def put(self, key, array):
+        fpath = self.path(key)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(fpath), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmppath, fpath)      # atomic, so concurrent readers never see a partial block
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(fpath)
+        if self.size() > self.max_bytes:
+            self.evict()
+
+    def get_block(self, url, band, block_index, loader):
+
+        """
+        Return the block (block_index = (block row, block col)) of a band of a remote raster.
+        loader() is called to read the block if it is not in the cache.
+        """
+
+        key = self.key(url, self.etag(url), band, *block_index)
+        array = self.get(key)
+        if array is None:
+            array = loader()
+            self.put(key, array)
+        return array
+
+    # ==== size and eviction ====
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    yield os.path.join(root, name)
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum([os.path.getsize(i) for i in self._files()])
+            return self._size
+
+    def evict(self, target=0.9):
+
+        """
+        Remove the least recently used blocks until the cache is smaller than target * max_bytes.
+        """
+
+        with self._lock:
+            records = []
+            for fpath in self._files():
+                try:
+                    stat = os.stat(fpath)
+                except FileNotFoundError:
+                    continue
+                records.append((stat.st_mtime, stat.st_size, fpath))
+            records.sort()
+            size = sum([i[1] for i in records])
+            for mtime, fsize, fpath in records:
+                if size <= target * self.max_bytes:
+                    break
+                try:
+                    os.remove(fpath)
+                except FileNotFoundError:
+                    continue
+                size -= fsize
+                self.stats['evictions'] += 1
+            self._size = size
+
+    def clear(self):
+        with self._lock:
+            for fpath in list(self._files()):
+                os.remove(fpath)
+            self._size = 0
+
+    @staticmethod
+    def _write_json(fpath, obj):
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(fpath), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmppath, fpath)
+
+
+def set_cache(cache):
+
+    """
+    Set the default BlockCache (or None to turn the caching off).
+    """
+
+    global _default_cache, _default_cache_checked
+    _default_cache = cache
+    _default_cache_checked = True
+
+
+def get_cache():
+
+    """
+    Return the default BlockCache, or None if the caching is off.
+    If set_cache has not been called, the cache is set by the environment variables
+    CARST_CACHE_DIR and CARST_CACHE_SIZE_GB (default: 10).
+    """
+
+    global _default_cache, _default_cache_checked
+    if not _default_cache_checked:
+        _default_cache_checked = True
+        if os.environ.get('CARST_CACHE_DIR'):
+            max_bytes = float(os.environ.get('CARST_CACHE_SIZE_GB', 10)) * 1024 ** 3
+            _default_cache = BlockCache(os.environ['CARST_CACHE_DIR'], max_bytes=max_bytes)
+    return _default_cache
+
+
+def configure_cache(params):
+
+    """
+    Set the default BlockCache from the [cache] section of an ini file, e.g.,
+    [cache]
+    dir        = ~/.cache/carst
+    size_gb    = 10
+    etag_ttl_h = 168
+    timeout_s  = 30
+    """
+
+    if 'dir' not in params:
+        return
+    kwargs = {}
+    if 'size_gb' in params:
+        kwargs['max_bytes'] = float(params['size_gb']) * 1024 ** 3
+    if 'etag_ttl_h' in params:
+        kwargs['etag_ttl'] = float(params['etag_ttl_h']) * 3600
+    if 'timeout_s' in params:
+        kwargs['timeout'] = float(params['timeout_s'])
+    set_cache(BlockCache(os.path.expanduser(params['dir']), **kwargs))
+
+
+def is_remote(fpath):
+    return fpath.startswith('http://') or fpath.startswith('https://')
+
+
+def cached_read(url, band=1, window=None, cache=None):
+
+    """
+    Read a window (col_off, row_off, width, height) of a band of a remote raster through the block cache.
+    The whole band is read if window is None. Only the blocks that are not in the cache are downloaded.
+    """
+
+    from rasterio.windows import Window
+
+    if cache is None:
+        cache = get_cache()
+    meta = cache.metadata(url)
+    if window is None:
+        window = (0, 0, meta['width'], meta['height'])
+    col_off, row_off, width, height = [int(i) for i in window]
+    bh, bw = meta['block_shapes'][band - 1]
+    out = np.empty((height, width), dtype=meta['dtypes'][band - 1])
+    src = None
+    try:
+        for bi in range(row_off // bh, (row_off + height - 1) // bh + 1):
+            for bj in range(col_off // bw, (col_off + width - 1) // bw + 1):
+                r0, c0 = bi * bh, bj * bw
+                block_window = Window(c0, r0, min(bw, meta['width'] - c0), min(bh, meta['height'] - r0))
+
+                def loader():
+                    nonlocal src
+                    if src is None:
+                        src = rasterio.open(url)
+                    return src.read(band, window=block_window)
+
+                block = cache.get_block(url, band, (bi, bj), loader)
+                # overlap between this block and the window
+                rr0, rr1 = max(r0, row_off), min(r0 + block.shape[0], row_off + height)
+                cc0, cc1 = max(c0, col_off), min(c0 + block.shape[1], col_off + width)
+                out[rr0 - row_off:rr1 - row_off, cc0 - col_off:cc1 - col_off] = block[rr0 - r0:rr1 - r0, cc0 - c0:cc1 - c0]
+    finally:
+        if src is not None:
+            src.close()
+    return out
+
+
+def materialize(url, dst_path=None, bounds=None, margin=2, cache=None):
+
+    """
+    Write a local GeoTiff copy of (part of) a remote raster using the block cache.
+    bounds: (left, bottom, right, top) in the CRS of the raster. The window covering bounds plus
+            margin pixels is copied. The whole raster is copied if bounds is None.
+    dst_path: output path. Default: a temporary file in the cache folder, which the caller should remove.
+    Returns dst_path, or None if bounds does not intersect the raster.
+    """
+
+    from rasterio.transform import Affine
+    from rasterio.windows import from_bounds
+
+    if cache is None:
+        cache = get_cache()
+    meta = cache.metadata(url)
+    transform = Affine.from_gdal(*meta['transform'])
+    if bounds is None:
+        window = (0, 0, meta['width'], meta['height'])
+    else:
+        win = from_bounds(*bounds, transform=transform)
+        col0 = max(int(np.floor(win.col_off)) - margin, 0)
+        row0 = max(int(np.floor(win.row_off)) - margin, 0)
+        col1 = min(int(np.ceil(win.col_off + win.width)) + margin, meta['width'])
+        row1 = min(int(np.ceil(win.row_off + win.height)) + margin, meta['height'])
+        if col1 <= col0 or row1 <= row0:
+            return None
+        window = (col0, row0, col1 - col0, row1 - row0)
+    if dst_path is None:
+        fd, dst_path = tempfile.mkstemp(dir=cache.cache_dir, prefix='materialized_', suffix='.tif')
+        os.close(fd)
+    profile = {'driver': 'GTiff', 'width': window[2], 'height': window[3], 'count': meta['count'],
+               'dtype': meta['dtypes'][0], 'crs': meta['crs'], 'nodata': meta['nodata'],
+               'transform': transform * Affine.translation(window[0], window[1]),
+               'tiled': True, 'compress': 'deflate'}
+    with rasterio.open(dst_path, 'w', **profile) as dst:
+        for band in range(1, meta['count'] + 1):
+            dst.write(cached_read(url, band=band, window=window, cache=cache), band)
+    return dst_path
+
+
+def local_copy(url, cache=None):
+
+    """
+    A local GeoTiff copy of a whole remote raster (via materialize), for tools that cannot read URLs (e.g., ampcor).
+    The copy is saved in the cache folder and named by the URL and its ETag, so it is reused only for the same
+    remote file: a changed remote file (new ETag) or another URL with the same file name gets a new copy.
+    Returns the path of the copy.
+    """
+
+    if cache is None:
+        cache = get_cache()
+    key = cache.key('local', url, cache.etag(url))
+    fpath = os.path.join(cache.cache_dir, 'local', key[:2], key + '_' + os.path.basename(url))
+    if not os.path.isfile(fpath):
+        print('Copying {} to {} via the block cache...'.format(url, fpath))
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(fpath), suffix='.tif')
+        os.close(fd)
+        try:
+            materialize(url, dst_path=tmppath, cache=cache)
+            os.replace(tmppath, fpath)      # a partial copy is never reused
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+    return fpath
@@ -2,6 +2,7 @@
 # used for dhdt
 # by Whyjay Zheng, Jul 28 2016
 # last edit: Aug 17 2016
+# last edit: Oct 19 2026 (ampcor backend option in [pxsettings])
 
 import sys
 import csv
@@ -148,10 +149,11 @@ class ConfParams:
         Paths that need to be verified:
         demlist['csvfile']
         refgeometry['gtiff']
+        quicklook['reference']
         xxxx -- result['picklefile']
         """
-        path_categories = ['demlist', 'refgeometry'] # , 'result']
-        path_arguments = ['csvfile', 'gtiff'] # , 'picklefile']
+        path_categories = ['demlist', 'refgeometry', 'quicklook'] # , 'result']
+        path_arguments = ['csvfile', 'gtiff', 'reference'] # , 'picklefile']
         for category, argument in zip(path_categories, path_arguments):
             if hasattr(self, category):
                 category_dict = getattr(self, category)
@@ -167,6 +169,9 @@ class ConfParams:
             if 'output_dir' in self.gdalwarp:
                 if not os.path.exists(self.gdalwarp['output_dir']):
                     os.makedirs(self.gdalwarp['output_dir'])    # create gdalwarp output folder
+        if hasattr(self, 'cache'):
+            from carst.libcache import configure_cache
+            configure_cache(self.cache)     # block cache for remote files
         if hasattr(self, 'splitampcor'):
             for key in self.splitampcor:
                 self.splitampcor[key] = int(self.splitampcor[key])
@@ -175,6 +180,7 @@ class ConfParams:
                 s = self.parallel['gnu_parallel'].lower()
                 self.parallel['gnu_parallel'] = s in ['true', 't', 'yes', 'y', '1']
         if hasattr(self, 'pxsettings'):
+            backend = self.pxsettings.pop('backend', '') or 'auto'
             for key in self.pxsettings:
                 if not self.pxsettings[key]:
                     # empty string
@@ -193,6 +199,7 @@ class ConfParams:
                 self.pxsettings['gaussian_hp_sigma'] = float(self.pxsettings['gaussian_hp_sigma'])
             else:
                 self.pxsettings['gaussian_hp_sigma'] = 3.0
+            self.pxsettings['backend'] = backend.lower()     # auto, isce, or numpy (see carst.libft.ampcor_backend)
 
         if hasattr(self, 'outputcontrol'):
             if 'datepair_prefix' in self.outputcontrol:
@@ -2,44 +2,50 @@
 # Func: timeit, resample_array, EVMD group, wlr_corefun, onclick_ipynb
 # by Whyjay Zheng, Jul 27 2016
 # last edit: Apr 23 2023
+# last edit: Oct 19 2026 (skip warping for grid-aligned DEMs in resample_array)
+# last edit: Oct 19 2026 (overview-aware resampling)
+# last edit: Oct 19 2026 (prefetching remote DEMs during pileup)
+# last edit: Oct 19 2026 (block cache for remote DEMs)
+# last edit: Oct 19 2026 (lazy imports of heavy dependencies)
+# last edit: Oct 19 2026 (per-stage performance instrumentation)
+# last edit: Oct 19 2026 (vectorized form_mosaic on a CompactStack)
+# last edit: Oct 19 2026 (time-slice DEMs)
+# last edit: Oct 19 2026 (multi-window dh/dt)
+# last edit: Oct 19 2026 (streaming pileup for quick-look dh/dt)
+# last edit: Oct 19 2026 (per-pixel statistics of the stack)
+# last edit: Oct 19 2026 (map-wide breakpoint search)
+# last edit: Oct 19 2026 (batched GP transient analysis)
+# last edit: Oct 19 2026 (robust polyfit by IRLS)
+# last edit: Oct 19 2026 (jackknife / bootstrap dh/dt uncertainty)
+# last edit: Oct 19 2026 (parameter sweep)
 
 import numpy as np
 from numpy.linalg import inv
 import os
+import time
+import uuid
 # import sys
-try:
-    from osgeo import gdal
-except ImportError:
-    import gdal    # this was used until GDAL 3.1
 from datetime import datetime, date, timedelta
-from shapely.geometry import Polygon
 from carst import ConfParams
-from carst.libraster import SingleRaster
+from carst.libraster import SingleRaster, gdal, rasterio
+from carst.libcache import get_cache, is_remote, materialize
+from carst.liblazy import lazy_import
+from carst.libperf import timeit, stage, add_items, progress, file_size
+from carst.libstack import CompactStack, StreamingSums, RunningMedianGate, STATS, linear_predict
 import pickle
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from sklearn.cluster import DBSCAN
-from rasterio.errors import RasterioIOError
 from pathlib import Path
 
-from scipy.optimize import curve_fit
-from scipy.signal import argrelextrema
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import ConstantKernel
-from sklearn.gaussian_process.kernels import RationalQuadratic
-
-def timeit(func):
-    def time_wrapper(*args, **kwargs):
-        time_a = datetime.now()
-        print('Program Start: {}'.format(time_a.strftime('%Y-%m-%d %H:%M:%S')))
-        dec_func = func(*args, **kwargs)
-        time_b = datetime.now()
-        print('Program End: {}'.format(time_b.strftime('%Y-%m-%d %H:%M:%S')))
-        print('Time taken: ' + str(time_b - time_a))
-        return dec_func
-    return time_wrapper
-
-def resample_array(source, reference, method='bilinear', destination=None):
+# matplotlib, sklearn, scipy, and shapely are imported when they are first used (see carst.liblazy).
+plt = lazy_import('matplotlib.pyplot')
+mdates = lazy_import('matplotlib.dates')
+
+# the largest number of source pixels averaged in NumPy by read_aligned; larger aligned reads are warped
+ALIGNED_MAX_PIXELS = 2 ** 28
+# the largest integer factor averaged in NumPy when the source has no overviews; coarser grids are warped
+# with resampleAlg='average', which reads and reduces the source block by block in GDAL
+ALIGNED_MAX_K = 8
+
+def resample_array(source, reference, method='bilinear', destination=None, fast_path=True, overviews=True, build_overviews=False):
     """
     latest version. 
     resample the source raster using the extent and spacing provided by the reference raster. Two rasters must be in the same CRS.
@@ -47,6 +53,24 @@ def resample_array(source, reference, method='bilinear', destination=None):
     source: class UtilRaster.SingleRaster object
     reference: class UtilRaster.SingleRaster object
     destination: str, filename for the output to be written. If None, a temporary file (/vismem/) will be used.
+    fast_path: if True (default), skip warping when the two grids coincide (see grid_alignment):
+               - same lattice: the overlapping window of the source is read directly (any method);
+               - the reference spacing is an integer multiple (k) of the source spacing and the lattices align:
+                 each k-by-k block is averaged in NumPy, ignoring nodata ('bilinear' and 'average' only),
+                 or by gdal.Warp with resampleAlg='average' if k > ALIGNED_MAX_K or the source window
+                 exceeds ALIGNED_MAX_PIXELS.
+               Misaligned sources are always warped.
+    overviews: if True (default) and the reference is at least 2 times coarser than the source, gdal.Warp reads
+               the overview level closest to (but not coarser than) the reference spacing, instead of every
+               full-resolution pixel. This includes the internal overviews of COGs and external .ovr files.
+               An aligned integer-factor source is warped from its overview too if it has a usable one.
+               Without a usable overview, an aligned source with k > ALIGNED_MAX_K is area-averaged by gdal.Warp
+               (resampleAlg='average') for both 'bilinear' and 'average', so the decimation is done in GDAL
+               instead of interpolating a few of the full-resolution pixels.
+    build_overviews: if True, build external overviews (.ovr) for a local source that has none (see build_overviews).
+    A remote source (URL) is read through the block cache if it is set (see carst.libcache).
+    method: any gdal.Warp resampling method. 'average' gives area-averaging, which is suggested for
+            coarse reference grids.
     
     returns: an numpy array, which you can use the methods in UtilRaster to trasform it into a raster.
 
@@ -54,15 +78,52 @@ def resample_array(source, reference, method='bilinear', destination=None):
     For fasting resampling, we use GDAL and its C library.
     """
     
+    from shapely.geometry import Polygon
+
+    if is_remote(source.fpath) and get_cache() is not None:
+        # read the part of the remote DEM covering the reference through the block cache
+        ulx, uly, lrx, lry = reference.get_extent()
+        local_path = materialize(source.fpath, bounds=(ulx, lry, lrx, uly))
+        if local_path is None:
+            return np.full((reference.get_y_size(), reference.get_x_size()), reference.get_nodata())
+        try:
+            return resample_array(SingleRaster(local_path), reference, method=method, destination=destination,
+                                  fast_path=fast_path, overviews=overviews, build_overviews=False)
+        finally:
+            os.remove(local_path)
+
     s_ulx, s_uly, s_lrx, s_lry = source.get_extent()
     source_extent = Polygon([(s_ulx, s_uly), (s_lrx, s_uly), (s_lrx, s_lry), (s_ulx, s_lry)])
     ulx, uly, lrx, lry = reference.get_extent()
     reference_extent = Polygon([(ulx, uly), (lrx, uly), (lrx, lry), (ulx, lry)])
     if source_extent.intersects(reference_extent):
+        factor = abs(reference.get_x_res() / source.get_x_res())
+        if build_overviews and factor >= 2:
+            build_overviews_for(source, factor)
         ds = gdal.Open(source.fpath)
-        opts = gdal.WarpOptions(outputBounds=(ulx, lry, lrx, uly), xRes=reference.get_x_res(), yRes=reference.get_y_res(), resampleAlg=method)
+        ovr_level = choose_overview_level(ds, factor) if overviews and factor >= 2 else None
+        if fast_path:
+            alignment = grid_alignment(source, reference)
+            if alignment is not None and (alignment[0] == 1 or (method in ('bilinear', 'average') and ovr_level is None)):
+                k = alignment[0]
+                out_array = read_aligned(source, reference, *alignment) if k <= ALIGNED_MAX_K else None
+                if out_array is not None:
+                    if destination:
+                        write_like_reference(out_array, reference, destination, nodata=source.get_nodata())
+                    return out_array
+                # a large factor or too many source pixels to average in NumPy: let gdal.Warp do the block averaging
+                method = 'average'
+        warp_options = ['-ovr', str(ovr_level)] if ovr_level is not None else []
+        opts = gdal.WarpOptions(outputBounds=(ulx, lry, lrx, uly), xRes=reference.get_x_res(), yRes=reference.get_y_res(), resampleAlg=method,
+                                options=warp_options)
         if not destination:
-            out_ds = gdal.Warp('/vsimem/resampled.tif', ds, options=opts)
+            # a unique name per call, so that several DEMs can be resampled at the same time (see prefetch_map)
+            vsimem_path = '/vsimem/resampled_{}.tif'.format(uuid.uuid4().hex)
+            out_ds = gdal.Warp(vsimem_path, ds, options=opts)
+            out_array = out_ds.GetRasterBand(1).ReadAsArray()
+            out_ds = None
+            gdal.Unlink(vsimem_path)
+            return out_array
         else:
             out_ds = gdal.Warp(destination, ds, options=opts)
         return out_ds.GetRasterBand(1).ReadAsArray()
@@ -70,6 +131,215 @@ def resample_array(source, reference, method='bilinear', destination=None):
         return np.full((reference.get_y_size(), reference.get_x_size()), reference.get_nodata())
 
 
+def choose_overview_level(ds, factor):
+    """
+    Choose the overview level of a gdal dataset to read for a reference grid factor times coarser than the source.
+    Returns the index (for gdal.Warp -ovr) of the coarsest overview whose spacing does not exceed the reference
+    spacing, or None if there isn't any (e.g., no overviews or factor < 2).
+    """
+    band = ds.GetRasterBand(1)
+    level = None
+    for i in range(band.GetOverviewCount()):
+        ovr_factor = ds.RasterXSize / band.GetOverview(i).XSize
+        if ovr_factor <= factor * (1 + 1e-6):
+            if level is None or ovr_factor > ds.RasterXSize / band.GetOverview(level).XSize:
+                level = i
+    return level
+
+
+def build_overviews_for(source, factor, resampling='AVERAGE'):
+    """
+    Build external overviews (.ovr, by 2, 4, 8, ... up to factor) for a local raster that has no overviews.
+    Remote files (URL or /vsi paths) and rasters that already have overviews are left untouched.
+    """
+    if source.fpath.startswith(('http://', 'https://', '/vsi')):
+        return
+    ds = gdal.Open(source.fpath)     # read-only; the overviews go to an external .ovr file
+    if ds.GetRasterBand(1).GetOverviewCount() > 0:
+        return
+    levels = []
+    level = 2
+    while level <= factor:
+        levels.append(level)
+        level *= 2
+    if levels:
+        print('Building overviews {} for {}'.format(levels, source.fpath))
+        ds.BuildOverviews(resampling, levels)
+    ds = None
+
+
+# GDAL settings for reading remote COGs: keep HTTP connections alive (HTTP/2 multiplexing),
+# merge adjacent range requests, don't list the remote directory, retry on transient errors,
+# and cache the blocks already read. Values set by the user in the environment are respected.
+REMOTE_READ_CONFIG = {
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'GDAL_HTTP_VERSION': '2',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.TIF,.tiff,.ovr,.vrt',
+    'VSI_CACHE': 'TRUE',
+    'GDAL_HTTP_MAX_RETRY': '3',
+    'GDAL_HTTP_RETRY_DELAY': '1',
+}
+
+
+def configure_remote_reads(retries=None, backoff=None):
+    """
+    Set REMOTE_READ_CONFIG as environment variables, which both GDAL and rasterio read.
+    retries, backoff: override GDAL_HTTP_MAX_RETRY and GDAL_HTTP_RETRY_DELAY (in seconds).
+    """
+    config = dict(REMOTE_READ_CONFIG)
+    if retries is not None:
+        config['GDAL_HTTP_MAX_RETRY'] = str(retries)
+    if backoff is not None:
+        config['GDAL_HTTP_RETRY_DELAY'] = str(backoff)
+    for key, val in config.items():
+        os.environ.setdefault(key, val)
+
+
+def prefetch_map(func, items, workers=4, retries=3, backoff=1.0, retry_on=None):
+    """
+    Run func(item) for the upcoming items in a thread pool, while the caller is still processing the earlier ones.
+    Yields (item, result) in the same order as items. At most workers items are being fetched at a time,
+    so only a few resampled DEMs are held in memory.
+    An exception in retry_on (default: RasterioIOError and RuntimeError) is retried up to retries times, waiting backoff, 2 * backoff, 4 * backoff, ... seconds.
+    If it still fails, the exception itself is yielded as the result so that the caller can skip the item.
+    workers = 0: no threads; func runs when the caller asks for the next item (the old serial behavior).
+    """
+    if retry_on is None:
+        from rasterio.errors import RasterioIOError
+        retry_on = (RasterioIOError, RuntimeError)
+
+    def run_with_retry(item):
+        for attempt in range(retries + 1):
+            try:
+                return func(item)
+            except retry_on as inst:
+                if attempt == retries:
+                    return inst
+                print('Retrying ({}/{}) after error: {}'.format(attempt + 1, retries, inst))
+                time.sleep(backoff * 2 ** attempt)
+
+    if workers == 0:
+        for item in items:
+            yield item, run_with_retry(item)
+        return
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        queue = deque()
+        for item in items:
+            queue.append((item, executor.submit(run_with_retry, item)))
+            if len(queue) >= workers:
+                break
+        while queue:
+            item, future = queue.popleft()
+            result = future.result()
+            for next_item in items:
+                queue.append((next_item, executor.submit(run_with_retry, next_item)))
+                break
+            yield item, result
+
+
+def grid_alignment(source, reference, tol=1e-6):
+    """
+    Check if the reference grid can be made from the source grid without interpolation.
+    Returns (k, row_off, col_off) if both grids are in the same CRS, north-up, the reference spacing is
+    k times (k = 1, 2, 3, ...) the source spacing, and the reference origin is on the source lattice;
+    row_off and col_off are the position of the reference origin in source pixels.
+    Returns None otherwise. tol is in the unit of a source pixel.
+    """
+    with rasterio.open(source.fpath) as src, rasterio.open(reference.fpath) as ref:
+        if src.crs != ref.crs:
+            return None
+        s_gt = src.transform.to_gdal()
+        r_gt = ref.transform.to_gdal()
+    if s_gt[2] != 0 or s_gt[4] != 0 or r_gt[2] != 0 or r_gt[4] != 0:
+        return None
+    kx = r_gt[1] / s_gt[1]
+    ky = r_gt[5] / s_gt[5]
+    k = int(round(kx))
+    if k < 1 or abs(kx - k) > tol or abs(ky - k) > tol:
+        return None
+    col_off = (r_gt[0] - s_gt[0]) / s_gt[1]
+    row_off = (r_gt[3] - s_gt[3]) / s_gt[5]
+    if abs(col_off - round(col_off)) > tol or abs(row_off - round(row_off)) > tol:
+        return None
+    return k, int(round(row_off)), int(round(col_off))
+
+
+def read_aligned(source, reference, k, row_off, col_off, max_pixels=ALIGNED_MAX_PIXELS, strip_pixels=2 ** 22):
+    """
+    Read the source on the reference grid when grid_alignment(source, reference) = (k, row_off, col_off).
+    k = 1: a window read. k > 1: average of the valid source pixels in each k-by-k block.
+    Pixels without any valid source pixel are set to the nodata value of the source (or 0 if there isn't one),
+    the same as what gdal.Warp does.
+    For k > 1, only the part of the source overlapping the reference (rounded out to whole blocks) is read,
+    in strips of about strip_pixels source pixels, so the memory use does not depend on the reference size.
+    max_pixels: if that part has more source pixels than this, nothing is read and None is returned
+                (resample_array then warps with resampleAlg='average' instead).
+    Returns an array in the data type of the source.
+    """
+    ds = gdal.Open(source.fpath)
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    fill = nodata if nodata is not None else 0
+    out_rows, out_cols = reference.get_y_size(), reference.get_x_size()
+    # overlapping window in source pixels
+    r0, c0 = max(row_off, 0), max(col_off, 0)
+    r1, c1 = min(row_off + out_rows * k, ds.RasterYSize), min(col_off + out_cols * k, ds.RasterXSize)
+    if r1 <= r0 or c1 <= c0:
+        return np.full((out_rows, out_cols), fill)
+    if k == 1:
+        window = band.ReadAsArray(c0, r0, c1 - c0, r1 - r0)
+        out_array = np.full((out_rows, out_cols), fill, dtype=window.dtype)
+        out_array[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = window
+        return out_array
+    # output pixels touched by the window (i0:i1, j0:j1), i.e., the window rounded out to multiples of k
+    i0, j0 = (r0 - row_off) // k, (c0 - col_off) // k
+    i1, j1 = -((row_off - r1) // k), -((col_off - c1) // k)
+    if (i1 - i0) * (j1 - j0) * k * k > max_pixels:
+        return None
+    out_array = np.full((out_rows, out_cols), float(fill))
+    strip = max(strip_pixels // ((j1 - j0) * k * k), 1)     # output rows per strip
+    for i in range(i0, i1, strip):
+        i_end = min(i + strip, i1)
+        sr0, sr1 = max(row_off + i * k, r0), min(row_off + i_end * k, r1)
+        window = band.ReadAsArray(c0, sr0, c1 - c0, sr1 - sr0)
+        dtype = window.dtype
+        buffer = np.full(((i_end - i) * k, (j1 - j0) * k), np.nan)
+        buffer[sr0 - row_off - i * k:sr1 - row_off - i * k, c0 - col_off - j0 * k:c1 - col_off - j0 * k] = window
+        if nodata is not None:
+            buffer[buffer == nodata] = np.nan
+        valid = ~np.isnan(buffer)
+        buffer[~valid] = 0
+        count = valid.reshape(i_end - i, k, j1 - j0, k).sum(axis=(1, 3))
+        total = buffer.reshape(i_end - i, k, j1 - j0, k).sum(axis=(1, 3))
+        block_mean = np.full(count.shape, float(fill))
+        block_mean[count > 0] = total[count > 0] / count[count > 0]
+        out_array[i:i_end, j0:j1] = block_mean
+    return out_array.astype(dtype)
+
+
+def write_like_reference(array, reference, destination, nodata=None):
+    """
+    Write an array resampled onto the reference grid as a GeoTiff, in the data type of the array.
+    """
+    from osgeo import gdal_array
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(destination, array.shape[1], array.shape[0], 1, gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype))
+    out_ds.SetGeoTransform(reference.GetGeoTransform())
+    out_ds.SetProjection(reference.GetProjection())
+    out_band = out_ds.GetRasterBand(1)
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+    out_band.WriteArray(array)
+    out_band.FlushCache()
+    out_ds = out_band = None
+
+
     
 def EVMD_DBSCAN(x, y, eps=6, min_samples=4):
     """
@@ -81,6 +351,7 @@ def EVMD_DBSCAN(x, y, eps=6, min_samples=4):
         1: 2nd cluster
         ...
     """
+    from sklearn.cluster import DBSCAN
     # x, assuming the temporal axis (unit=days), is scaled by 365 for proper eps consideration.
     x2d = np.column_stack((x / 365, y))
     if x2d.shape[0] >= min_samples:
@@ -105,6 +376,7 @@ def EVMD(y, x=None, threshold=6, method='legacy'):
     method: 'DBSCAN' or 'legacy'
     """
     if method == 'DBSCAN':
+        from sklearn.cluster import DBSCAN
         # x, assuming the temporal axis (unit=days), is scaled by 100 for proper eps consideration.
         x2d = np.coulmn_stack((x / 100, y))
         # min samples is fixed at 4 (i.e., four DEMs together can be considered as a cluster!)
@@ -254,6 +526,7 @@ def wl_reg(xx, yy, ye=None, min_datapoints=4, min_time_span=365):
     
 
 def sigmoid_reg(xx, yy, ye=None, k_bounds=None, x0_bounds=None, downward_first=True):
+    from scipy.optimize import curve_fit
     xx_rescaled = (xx - np.mean(xx)) / np.std(xx)
     yy_rescaled = (yy - np.mean(yy)) / np.std(yy)
     if ye is not None:
@@ -351,10 +624,21 @@ def sigmoid_reg(xx, yy, ye=None, k_bounds=None, x0_bounds=None, downward_first=T
         return x_pred_pos, y_prediction, sigmoid_height, sigmoid_height_stderr, sigmoid_timing, exitstate
 
 
+def default_gp_kernel():
+    """
+    The default kernel of gp_reg (all hyperparameters fixed), for the rescaled date and elevation.
+    """
+    from sklearn.gaussian_process.kernels import ConstantKernel, RationalQuadratic
+    return ConstantKernel(constant_value=160, constant_value_bounds='fixed') * RationalQuadratic(
+                          length_scale=1.2, alpha=0.1, alpha_bounds='fixed', length_scale_bounds='fixed')
+
+
 def gp_reg(xx, yy, ye=None, kernel=None, return_ystd=False):
     """
     GP regression ver 2.
     """
+    from scipy.signal import argrelextrema
+    from sklearn.gaussian_process import GaussianProcessRegressor
     xx_rescaled = (xx - np.mean(xx)) / np.std(xx)
     xx_rescaled = xx_rescaled.reshape(-1, 1)    # to form a vertical vector
     yy_rescaled = (yy - np.mean(yy)) / np.std(yy)
@@ -365,10 +649,10 @@ def gp_reg(xx, yy, ye=None, kernel=None, return_ystd=False):
         ye_rescaled = None
         alpha = 1e-10    # default value, probably not so good
     if kernel is None:
-        kernel = ConstantKernel(constant_value=160, constant_value_bounds='fixed') * RationalQuadratic(
-                                length_scale=1.2, alpha=0.1, alpha_bounds='fixed', length_scale_bounds='fixed')
+        kernel = default_gp_kernel()
 
-    gaussian_process = GaussianProcessRegressor(kernel=kernel, alpha=alpha, n_restarts_optimizer=5)
+    # No restarts if all the hyperparameters are fixed (there is nothing to optimize)
+    gaussian_process = GaussianProcessRegressor(kernel=kernel, alpha=alpha, n_restarts_optimizer=5 if kernel.n_dims > 0 else 0)
     gaussian_process.fit(xx_rescaled, yy_rescaled)
 
 
@@ -400,7 +684,7 @@ def gp_reg(xx, yy, ye=None, kernel=None, return_ystd=False):
         else:
             localmax_pos = np.append(localmax_pos, y_prediction.size - 1)
     elif localmin_pos.any() or localmax_pos.any():
-        if localmin_pos:
+        if localmin_pos.size > 0:
             localmax_pos = np.insert(localmax_pos, 0, 0)
             localmax_pos = np.append(localmax_pos, y_prediction.size - 1)
         else:
@@ -451,10 +735,98 @@ def gp_reg(xx, yy, ye=None, kernel=None, return_ystd=False):
         return x_pred_pos, y_prediction, max_transient_dh, max_transient_dh_stderr, max_transient_timing, exitstate
 
 
+def gp_transient_batch(xx, yy, ye, kernel=None, n_pred=200, max_duration=730):
+    """
+    gp_reg for a batch of pixels with the same number of observations, with a fixed kernel (no hyperparameters
+    to optimize): the GP posterior of all pixels is computed by stacked Cholesky solves instead of one
+    GaussianProcessRegressor per pixel, and the transient search is vectorized as well.
+    xx, yy, ye: (pixels, observations) arrays of date (days), elevation and uncertainty.
+    max_duration: a transient event lasts at most this many days (730 in gp_reg).
+    Returns max_transient_dh, max_transient_dh_stderr, max_transient_timing (days), one per pixel (NaN if none).
+    """
+    if kernel is None:
+        kernel = default_gp_kernel()
+    if kernel.n_dims > 0:
+        raise ValueError('gp_transient_batch needs a kernel with all hyperparameters fixed. Use gp_reg instead.')
+    xx = np.asarray(xx, dtype=float)
+    yy = np.asarray(yy, dtype=float)
+    ye = np.asarray(ye, dtype=float)
+    npix, nobs = xx.shape
+    xmean, xstd = xx.mean(axis=1, keepdims=True), xx.std(axis=1, keepdims=True)
+    ymean, ystd = yy.mean(axis=1, keepdims=True), yy.std(axis=1, keepdims=True)
+    xs = (xx - xmean) / xstd
+    ys = (yy - ymean) / ystd
+    alpha = (ye / ystd) ** 2
+    steps = np.linspace(0, 1, n_pred)
+    xp = xs.min(axis=1, keepdims=True) + steps * (xs.max(axis=1, keepdims=True) - xs.min(axis=1, keepdims=True))
+
+    # ==== kernel matrices ====
+    if kernel.is_stationary():
+        # a stationary kernel depends only on the distance, so all pairs of all pixels are evaluated in one call
+        def kfun(a, b):
+            d = np.abs(a[:, :, None] - b[:, None, :])
+            return kernel(np.zeros((1, 1)), d.reshape(-1, 1)).reshape(d.shape)
+        K = kfun(xs, xs)
+        K[:, np.arange(nobs), np.arange(nobs)] = kernel.diag(np.zeros((1, 1)))[0]
+        Ks = kfun(xp, xs)
+        Kss = np.full(xp.shape, kernel.diag(np.zeros((1, 1)))[0])
+    else:
+        K = np.stack([kernel(i.reshape(-1, 1)) for i in xs])
+        Ks = np.stack([kernel(i.reshape(-1, 1), j.reshape(-1, 1)) for i, j in zip(xp, xs)])
+        Kss = np.stack([kernel.diag(i.reshape(-1, 1)) for i in xp])
+    K[:, np.arange(nobs), np.arange(nobs)] += alpha
+
+    # ==== posterior mean and std by stacked Cholesky solves ====
+    L = np.linalg.cholesky(K)
+    v = np.linalg.solve(L, ys[:, :, None])
+    weights = np.linalg.solve(np.swapaxes(L, 1, 2), v)[:, :, 0]
+    V = np.linalg.solve(L, np.swapaxes(Ks, 1, 2))
+    y_pred = np.einsum('ijk,ik->ij', Ks, weights) * ystd + ymean
+    y_std = np.sqrt(np.maximum(Kss - np.sum(V ** 2, axis=1), 0)) * ystd
+    x_pred = xp * xstd + xmean
+
+    # ==== transient search (see gp_reg) ====
+    inner_max = np.zeros(y_pred.shape, dtype=bool)
+    inner_min = np.zeros(y_pred.shape, dtype=bool)
+    inner_max[:, 1:-1] = (y_pred[:, 1:-1] > y_pred[:, :-2]) & (y_pred[:, 1:-1] > y_pred[:, 2:])
+    inner_min[:, 1:-1] = (y_pred[:, 1:-1] < y_pred[:, :-2]) & (y_pred[:, 1:-1] < y_pred[:, 2:])
+    extremum = inner_max | inner_min
+    has = extremum.any(axis=1)
+    first = np.argmax(extremum, axis=1)
+    last = n_pred - 1 - np.argmax(extremum[:, ::-1], axis=1)
+    rows = np.arange(npix)
+    is_max = inner_max.copy()
+    is_min = inner_min.copy()
+    # the head and tail are the opposite of the nearest extremum
+    is_max[rows[has], 0] = inner_min[rows[has], first[has]]
+    is_min[rows[has], 0] = inner_max[rows[has], first[has]]
+    is_max[rows[has], -1] = inner_min[rows[has], last[has]]
+    is_min[rows[has], -1] = inner_max[rows[has], last[has]]
+    spacing = np.round(max_duration / (x_pred[:, 1] - x_pred[:, 0])).astype(int)
+    dh = np.full(npix, np.inf)
+    best_i = np.zeros(npix, dtype=int)
+    best_j = np.zeros(npix, dtype=int)
+    for offset in range(1, min(int(spacing.max()), n_pred - 1) + 1):
+        pair = (((is_max[:, :-offset] & is_min[:, offset:]) | (is_min[:, :-offset] & is_max[:, offset:]))
+                & (offset <= spacing[:, None]))
+        change = np.where(pair, y_pred[:, offset:] - y_pred[:, :-offset], np.inf)
+        i = np.argmin(change, axis=1)
+        better = change[rows, i] < dh
+        dh[better] = change[rows[better], i[better]]
+        best_i[better] = i[better]
+        best_j[better] = i[better] + offset
+    found = np.isfinite(dh)
+    max_transient_dh = np.where(found, dh, np.nan)
+    max_transient_dh_stderr = np.where(found, y_std[rows, best_i] + y_std[rows, best_j], np.nan)
+    max_transient_timing = np.where(found, x_pred[rows, best_i], np.nan)
+    return max_transient_dh, max_transient_dh_stderr, max_transient_timing
+
+
 def gaussian_process_reg(xx, yy, kernel, alpha=4**2):
     """
     GP regression ver 1. Kept for backward compatibility.
     """
+    from sklearn.gaussian_process import GaussianProcessRegressor
     yy_mean = yy.mean()
     gaussian_process = GaussianProcessRegressor(kernel=kernel, alpha=alpha, n_restarts_optimizer=5)
     gaussian_process.fit(xx, yy - yy_mean)
@@ -575,6 +947,7 @@ class DemPile(object):
         self.picklepath = picklepath
         self.dhdtprefix = dhdtprefix
         self.ts = None
+        self.stack = None
         self.dems = []
         self.refdate = None
         if refdate is not None:
@@ -587,6 +960,10 @@ class DemPile(object):
         self.mosaic = {'value': [], 'date': [], 'uncertainty': []}
         self.maskparam = {'max_uncertainty': 9999, 'min_time_span': 0}
         self.evmd_threshold = evmd_threshold
+        self.windows = []
+        self.sweep_param = {}
+        self.resample_param = {'method': 'bilinear', 'build_overviews': False, 'prefetch': 0, 'retries': 3, 'backoff': 1.0}
+        self.quicklook_param = {'gate': 'median', 'reference': None, 'gate_threshold': None, 'window': 5, 'min_samples': 4}
 
     def add_dem(self, dems):
         # ==== Add DEM object list ====
@@ -626,6 +1003,49 @@ class DemPile(object):
         if 'evmd_threshold' in ini.regression:
             self.evmd_threshold = float(ini.regression['evmd_threshold'])
 
+    def set_windows(self, ini):
+        # ==== e.g. windows = 2010-01-01/2015-01-01, 2015-01-01/2020-01-01, / (an empty side is open-ended) ====
+        if 'windows' in ini.settings:
+            for window in ini.settings['windows'].split(','):
+                if window.strip():
+                    start, end = [i.strip() or None for i in window.split('/')]
+                    self.windows.append((start, end))
+
+    def set_sweep_params(self, ini):
+        # ==== parameter lists of sweep (comma-separated) ====
+        if hasattr(ini, 'sweep'):
+            for key in ['evmd_threshold', 'min_time_span']:
+                if key in ini.sweep:
+                    self.sweep_param[key] = [float(i) for i in ini.sweep[key].split(',')]
+            if 'min_samples' in ini.sweep:
+                self.sweep_param['min_samples'] = [int(i) for i in ini.sweep['min_samples'].split(',')]
+            if 'rasters' in ini.sweep:
+                self.sweep_param['rasters'] = ini.sweep['rasters'].lower() in ['true', 't', 'yes', 'y', '1']
+
+    def set_quicklook_params(self, ini):
+        # ==== gate settings of pileup_streaming ("dhdt.py defaults.ini -s quicklook") ====
+        if hasattr(ini, 'quicklook'):
+            for key in ['gate', 'reference']:
+                if key in ini.quicklook:
+                    self.quicklook_param[key] = ini.quicklook[key]
+            if 'gate_threshold' in ini.quicklook:
+                self.quicklook_param['gate_threshold'] = float(ini.quicklook['gate_threshold'])
+            for key in ['window', 'min_samples']:
+                if key in ini.quicklook:
+                    self.quicklook_param[key] = int(ini.quicklook[key])
+
+    def set_resample_params(self, ini):
+        if 'resample_method' in ini.settings:
+            self.resample_param['method'] = ini.settings['resample_method']
+        if 'build_overviews' in ini.settings:
+            self.resample_param['build_overviews'] = ini.settings['build_overviews'].lower() in ['true', 't', 'yes', 'y', '1']
+        if 'prefetch' in ini.settings:
+            self.resample_param['prefetch'] = int(ini.settings['prefetch'])
+        if 'prefetch_retries' in ini.settings:
+            self.resample_param['retries'] = int(ini.settings['prefetch_retries'])
+        if 'prefetch_backoff' in ini.settings:
+            self.resample_param['backoff'] = float(ini.settings['prefetch_backoff'])
+
     def init_ts(self):
         # ==== Prepare the reference geometry ====
         refgeo_Ysize = self.refgeo.get_y_size()
@@ -651,58 +1071,186 @@ class DemPile(object):
         self.set_refdate(ini.settings['refdate'])
         self.set_mask_params(ini)
         self.set_evmd_threshold(ini)
+        self.set_resample_params(ini)
+        self.set_windows(ini)
+        self.set_sweep_params(ini)
+        self.set_quicklook_params(ini)
+
+    def iter_resampled_dems(self, bitmask=False, prefetch=None):
+        """
+        Read every DEM and resample it onto the reference geometry, in the order of self.dems.
+        Yields (i, znew, bitmask_znew) (bitmask_znew is None if bitmask is False). The DEMs that are too uncertain
+        or cannot be read are reported and skipped.
+        prefetch: number of DEMs read and resampled ahead in background threads while the earlier ones
+                  are being piled up (default: self.resample_param['prefetch'], 0 = serial).
+                  Useful for URL-based DEM lists, where reading is bound by network latency.
+        """
+        from rasterio.errors import RasterioIOError
+        if prefetch is None:
+            prefetch = self.resample_param['prefetch']
+        if prefetch > 0:
+            configure_remote_reads()
+
+        def resample_dem(i):
+            if self.dems[i].uncertainty > self.maskparam['max_uncertainty']:
+                return None
+            with stage('pileup.resample', dem=self.dems[i].fpath) as st:
+                znew = resample_array(self.dems[i], self.refgeo, method=self.resample_param['method'],
+                                      build_overviews=self.resample_param['build_overviews'])
+                st.add_items(znew.size)
+                st.add_bytes(read=file_size(self.dems[i].fpath))
+                bitmask_znew = None
+                if bitmask:
+                    bitmask_fpath = self.dems[i].fpath.replace('dem.tif', 'bitmask.tif')
+                    bitmask_dem = SingleRaster(bitmask_fpath)
+                    bitmask_znew = resample_array(bitmask_dem, self.refgeo, method='nearest')
+                    st.add_bytes(read=file_size(bitmask_fpath))
+            return znew, bitmask_znew
+
+        retries = 0 if prefetch == 0 else self.resample_param['retries']
+        for i, result in prefetch_map(resample_dem, range(len(self.dems)), workers=prefetch, retries=retries,
+                                      backoff=self.resample_param['backoff'], retry_on=(RasterioIOError,)):
+            print('{}) {}'.format(i + 1, os.path.basename(self.dems[i].fpath) ))
+            if result is None:
+                print("This one won't be piled up because its uncertainty ({}) exceeds the maximum uncertainty allowed ({})."
+                      .format(self.dems[i].uncertainty, self.maskparam['max_uncertainty']))
+                continue
+            elif isinstance(result, RasterioIOError):    # To show and skip the error of a bad url
+                print(result)
+                continue
+            znew, bitmask_znew = result
+            yield i, znew, bitmask_znew
 
     @timeit
-    def pileup(self, bitmask=False):
+    def pileup(self, bitmask=False, prefetch=None):
+        """
+        prefetch: see iter_resampled_dems.
+        """
         # ==== Start to read every DEM and save it to our final array ====
         ts = [[ [] for n in range(self.ts.shape[1])] for m in range(self.ts.shape[0])]
         if bitmask:
             ts_bitmask = [[ [] for n in range(self.ts.shape[1])] for m in range(self.ts.shape[0])]
-        
-        for i in range(len(self.dems)):
-            print('{}) {}'.format(i + 1, os.path.basename(self.dems[i].fpath) ))
-            if self.dems[i].uncertainty <= self.maskparam['max_uncertainty']:
-                datedelta = self.dems[i].date - self.refdate
-                try:
-                    znew = resample_array(self.dems[i], self.refgeo, method='bilinear')
-                except RasterioIOError as inst:    # To show and skip the error of a bad url
-                    print(inst)
-                    continue
-                if bitmask:
-                    bitmask_fpath = self.dems[i].fpath.replace('dem.tif', 'bitmask.tif')
-                    bitmask_dem = SingleRaster(bitmask_fpath)
-                    bitmask_znew = resample_array(bitmask_dem, self.refgeo, method='nearest')
+
+        for i, znew, bitmask_znew in self.iter_resampled_dems(bitmask=bitmask, prefetch=prefetch):
+            datedelta = self.dems[i].date - self.refdate
                 
-                ### Attempt to remove the znew > 0 constraint (failed for now; there is a lot of -9999 points) 
-                # znew_mask = self.refgeomask
-                znew_mask = np.logical_and(znew > 0, self.refgeomask)
-                fill_idx = np.where(znew_mask)
+            ### Attempt to remove the znew > 0 constraint (failed for now; there is a lot of -9999 points) 
+            # znew_mask = self.refgeomask
+            znew_mask = np.logical_and(znew > 0, self.refgeomask)
+            fill_idx = np.where(znew_mask)
+            with stage('pileup.stack', items=fill_idx[0].size, dem=self.dems[i].fpath):
                 for m,n in zip(fill_idx[0], fill_idx[1]):
                     record = [datedelta.days, znew[m, n], self.dems[i].uncertainty, i]
                     ts[m][n] += [record]
                     if bitmask:
                         record_bitmask = bitmask_znew[m, n]
                         ts_bitmask[m][n] += [record_bitmask]
-
-            else:
-                print("This one won't be piled up because its uncertainty ({}) exceeds the maximum uncertainty allowed ({})."
-                      .format(self.dems[i].uncertainty, self.maskparam['max_uncertainty']))
                 
         # After the content of ts is all populated, we move the data to self.ts as an array of PixelTimeSeries.
-        for m in range(self.ts.shape[0]):
-            for n in range(self.ts.shape[1]):
-                self.ts[m, n] = PixelTimeSeries(ts[m][n])
-                if bitmask: 
-                    self.ts[m, n].add_bitmask_labels(ts_bitmask[m][n])
-                
+        self.stack = None
+        with stage('pileup.finalize', items=self.ts.size):
+            for m in range(self.ts.shape[0]):
+                for n in range(self.ts.shape[1]):
+                    self.ts[m, n] = PixelTimeSeries(ts[m][n])
+                    if bitmask: 
+                        self.ts[m, n].add_bitmask_labels(ts_bitmask[m][n])
+
+    @timeit
+    def pileup_streaming(self, gate=None, reference=None, gate_threshold=None, window=None, min_samples=None, prefetch=None):
+        """
+        Quick-look dh/dt for large regions: the DEMs are read as in pileup, but instead of keeping every observation,
+        only the sums needed by the regression of polyfit are accumulated, so the memory is O(pixels) rather than
+        O(observations). The results are in self.fitdata (write them with fitdata2file); self.ts is not populated.
+        EVMD is replaced by a gate that needs no full time series:
+            gate = 'median': an observation is kept if it is within gate_threshold of the median of the window
+                             (default 5) observations around it in time. Each pixel keeps only the last window
+                             observations, and pixels with fewer than min_samples observations are left empty.
+            gate = 'reference': an observation is kept if it is within gate_threshold of the reference DEM
+                                (a SingleRaster or path) at that pixel.
+        gate_threshold: in meters; default: self.evmd_threshold.
+        min_samples: at most window.
+        The arguments that are not given are taken from self.quicklook_param (the [quicklook] section of the ini file).
+        For final products, use the full pileup / do_evmd / polyfit.
+        """
+        if gate is None:
+            gate = self.quicklook_param['gate']
+        if reference is None:
+            reference = self.quicklook_param['reference']
+        if gate_threshold is None:
+            gate_threshold = self.quicklook_param['gate_threshold']
+        if window is None:
+            window = self.quicklook_param['window']
+        if min_samples is None:
+            min_samples = self.quicklook_param['min_samples']
+        if gate not in ['median', 'reference']:
+            raise ValueError('gate must be "median" or "reference".')
+        threshold = self.evmd_threshold if gate_threshold is None else gate_threshold
+        shape = self.refgeomask.shape
+        npix = self.refgeomask.size
+        dates = [(i.date - self.refdate).days for i in self.dems]
+        sums = StreamingSums(npix, xref=np.mean(dates) if dates else 0.0)
+        if gate == 'median':
+            median_gate = RunningMedianGate(npix, window=window, threshold=threshold, min_samples=min_samples)
+        else:
+            if reference is None:
+                raise ValueError('A reference DEM is needed for gate="reference".')
+            if type(reference) is str:
+                reference = SingleRaster(reference)
+            zref = resample_array(reference, self.refgeo, method=self.resample_param['method']).ravel()
+
+        for i, znew, _ in self.iter_resampled_dems(prefetch=prefetch):
+            pix = np.flatnonzero(np.logical_and(znew > 0, self.refgeomask))
+            value = znew.ravel()[pix].astype(float)
+            date = np.full(pix.size, dates[i], dtype=float)
+            uncertainty = np.full(pix.size, self.dems[i].uncertainty, dtype=float)
+            with stage('pileup.accumulate', items=pix.size, dem=self.dems[i].fpath):
+                if gate == 'median':
+                    sums.add(*median_gate.push(pix, date, value, uncertainty))
+                else:
+                    sums.add(pix, date, value, uncertainty, np.abs(value - zref[pix]) <= threshold)
+        if gate == 'median':
+            sums.add(*median_gate.flush())
+
+        nodata = self.refgeo.get_nodata()
+        fit = sums.fit(min_time_span=self.maskparam['min_time_span'])
+        count = np.where(sums.count_all > 0, fit['count'], np.nan)
+        self.fitdata['slope']     = np.where(np.isnan(fit['slope']), nodata, fit['slope']).reshape(shape)
+        self.fitdata['slope_err'] = np.where(np.isnan(fit['slope_err']), nodata, fit['slope_err']).reshape(shape)
+        self.fitdata['residual']  = np.where(np.isnan(fit['residual']), nodata, fit['residual']).reshape(shape)
+        self.fitdata['count']     = np.where(np.isnan(count), nodata, count).reshape(shape)
+        return sums
+
     def dump_pickle(self):
         pickle.dump(self.ts, open(self.picklepath, "wb"))
 
     def load_pickle(self):
         self.ts = pickle.load( open(self.picklepath, "rb") )
+        self.stack = None
+
+    def get_stack(self):
+        """
+        All observations in self.ts as a CompactStack (flat arrays sorted by pixel and date), for
+        the vectorized methods. It is built once and rebuilt after self.ts changes (pileup, do_evmd, load_pickle).
+        """
+        if self.stack is None:
+            with stage('stack.build', items=self.ts.size):
+                self.stack = CompactStack.from_ts(self.ts)
+        return self.stack
+
+    def _labelled_stack(self, parallel=False, min_samples=4):
+        """
+        get_stack(), after running do_evmd(parallel, min_samples) if the observations have no EVMD labels yet.
+        """
+        stack = self.get_stack()
+        if stack.labels is None:
+            print('No EVMD labels detected. Run do_evmd first.')
+            self.do_evmd(parallel=parallel, min_samples=min_samples)
+            stack = self.get_stack()
+        return stack
         
     def init_fitdata(self):
         # ==== Create final array ====
+        self.fitdata = {}
         self.fitdata['slope']     = np.full_like(self.ts, self.refgeo.get_nodata(), dtype=float)
         self.fitdata['slope_err'] = np.full_like(self.ts, self.refgeo.get_nodata(), dtype=float)
         self.fitdata['residual']  = np.full_like(self.ts, self.refgeo.get_nodata(), dtype=float)
@@ -714,9 +1262,25 @@ class DemPile(object):
         self.mosaic['uncertainty']= np.full_like(self.ts, self.refgeo.get_nodata(), dtype=float)
         
     @timeit
-    def polyfit(self, parallel=False, chunksize=(1000, 1000), min_samples=4):
+    def polyfit(self, parallel=False, chunksize=(1000, 1000), min_samples=4, robust=None, robust_iterations=10):
+        """
+        robust: None (weighted least squares, as wlr_corefun), 'huber' or 'tukey'. With the latter, the regression
+                is done by iteratively reweighted least squares (robust_iterations iterations) for all pixels at once
+                on the CompactStack, and self.fitdata also gets the summary of the final robust weights
+                (weight_mean, weight_min and downweighted; see CompactStack.irls_fit).
+        """
+        add_items(self.ts.size)      # pixels, for the performance report
         # ==== Create final array ====
         self.init_fitdata()
+        if robust is not None:
+            stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+            fit = stack.irls_fit(stack.verified(), method=robust, iterations=robust_iterations,
+                                 min_time_span=self.maskparam['min_time_span'])
+            nodata = self.refgeo.get_nodata()
+            for key in ['slope', 'slope_err', 'residual', 'weight_mean', 'weight_min', 'downweighted']:
+                self.fitdata[key] = stack.to_grid(fit[key], fill=nodata)
+            self.fitdata['count'] = stack.to_grid(np.where(stack.counts > 0, fit['count'], np.nan), fill=nodata)
+            return
         # ==== Weighted regression ====
         if parallel:
             import dask
@@ -799,6 +1363,109 @@ class DemPile(object):
                         self.fitdata['residual'][m, n] = residual
                         self.fitdata['count'][m, n] = count
 
+    @timeit
+    def polyfit_windows(self, windows=None, parallel=False, min_samples=4):
+        """
+        dh/dt of several time windows at once, e.g. [('2010-01-01', '2015-01-01'), ('2015-01-01', '2020-01-01'), (None, None)].
+        windows: list of (start, end) in 'YYYY-MM-DD' (inclusive; None = open-ended). Default: self.windows.
+        The regression is the same as polyfit on the EVMD-verified observations within each window (EVMD is done
+        on the full series). Prefix sums of the regression statistics are built once on the CompactStack,
+        so that each window costs about the same as a few array operations.
+        count is the number of verified observations in the window.
+        Writes {dhdtprefix}_{start}_{end}_dhdt.tif, _dhdt_error.tif, _dhdt_residual.tif and _dhdt_count.tif for each
+        window (start/end are "start"/"end" if open-ended), and returns the fitdata dict of each window.
+        """
+        if windows is None:
+            windows = self.windows
+        stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+        add_items(stack.npix * len(windows))      # pixel-windows, for the performance report
+        nodata = self.refgeo.get_nodata()
+        days = [[None if i is None else (datetime.strptime(i, '%Y-%m-%d') - self.refdate).days for i in w] for w in windows]
+        fits = stack.wlr_windows(days, mask=stack.verified(), min_time_span=self.maskparam['min_time_span'])
+        results = []
+        for (start, end), fit in zip(windows, fits):
+            fitdata = {'slope': stack.to_grid(fit['slope'], fill=nodata),
+                       'slope_err': stack.to_grid(fit['slope_err'], fill=nodata),
+                       'residual': stack.to_grid(fit['residual'], fill=nodata),
+                       'count': stack.to_grid(fit['count'], fill=nodata)}
+            prefix = '{}_{}_{}'.format(self.dhdtprefix, 'start' if start is None else start.replace('-', ''),
+                                       'end' if end is None else end.replace('-', ''))
+            SingleRaster(prefix + '_dhdt.tif').Array2Raster(fitdata['slope'], self.refgeo)
+            SingleRaster(prefix + '_dhdt_error.tif').Array2Raster(fitdata['slope_err'], self.refgeo)
+            SingleRaster(prefix + '_dhdt_residual.tif').Array2Raster(fitdata['residual'], self.refgeo)
+            SingleRaster(prefix + '_dhdt_count.tif').Array2Raster(fitdata['count'], self.refgeo)
+            results.append(fitdata)
+        return results
+
+    @timeit
+    def slope_uncertainty(self, method='bootstrap', replicates=200, percentiles=(2.5, 97.5), seed=None, parallel=False, min_samples=4):
+        """
+        Empirical uncertainty of the polyfit dh/dt by resampling the EVMD-verified observations of each pixel
+        (see CompactStack.resample_slopes): 'jackknife' (leave one out) or 'bootstrap' (replicates samples with
+        replacement). Unlike slope_err, which is the formal error, it reflects the actual scatter of the observations.
+        Writes {dhdtprefix}_dhdt_{method}_std.tif (and {dhdtprefix}_dhdt_bootstrap_p{percentile}.tif for each of
+        the percentiles), and returns them as a dict of 2-D arrays.
+        """
+        stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+        add_items(stack.npix)      # pixels, for the performance report
+        result = stack.resample_slopes(stack.verified(), method=method, replicates=replicates, percentiles=percentiles,
+                                       seed=seed, min_time_span=self.maskparam['min_time_span'])
+        nodata = self.refgeo.get_nodata()
+        results = {}
+        for key, value in result.items():
+            results[key] = stack.to_grid(value, fill=nodata)
+            SingleRaster('{}_dhdt_{}_{}.tif'.format(self.dhdtprefix, method, key)).Array2Raster(results[key], self.refgeo)
+        return results
+
+    @timeit
+    def sweep(self, evmd_thresholds=None, min_samples=None, min_time_spans=None, rasters=None):
+        """
+        Parameter study of evmd_threshold, min_samples (of EVMD_DBSCAN) and min_time_span: dh/dt is estimated
+        (as do_evmd + polyfit) for every combination, from the stack loaded once. The EVMD of all combinations is done
+        by CompactStack.dbscan_kept, reusing the pairwise distances, and each combination then costs one vectorized fit.
+        The parameter lists default to self.sweep_param (the [sweep] section of the ini file), or to the current values.
+        Writes a summary to {dhdtprefix}_sweep.csv, one row per combination:
+            coverage: fraction of the pixels with observations that get a dh/dt
+            kept_fraction: fraction of the observations kept by EVMD
+            median_dhdt, median_dhdt_error, median_rms_residual: medians over the pixels with a dh/dt
+        If rasters is True, also writes {dhdtprefix}_sweep_evmd{}_ms{}_span{}_dhdt.tif and _dhdt_error.tif for each.
+        Returns the summary as a list of dicts.
+        """
+        evmd_thresholds = self.sweep_param.get('evmd_threshold', [self.evmd_threshold]) if evmd_thresholds is None else evmd_thresholds
+        min_samples = self.sweep_param.get('min_samples', [4]) if min_samples is None else min_samples
+        min_time_spans = self.sweep_param.get('min_time_span', [self.maskparam['min_time_span']]) if min_time_spans is None else min_time_spans
+        rasters = self.sweep_param.get('rasters', False) if rasters is None else rasters
+        stack = self.get_stack()
+        add_items(stack.npix * len(evmd_thresholds) * len(min_samples) * len(min_time_spans))
+        nodata = self.refgeo.get_nodata()
+        with stage('sweep.evmd', items=stack.nobs):
+            kept = stack.dbscan_kept(eps=evmd_thresholds, min_samples=min_samples)
+        has_data = stack.counts > 0
+        summary = []
+        for (eps, min_sample), mask in kept.items():
+            fit = stack.wlr_fit(mask, min_time_span=-1)
+            span = stack.reduce(['span'], mask=mask)['span']
+            for min_time_span in min_time_spans:
+                valid = ~np.isnan(fit['slope']) & (span > min_time_span)
+                rms = np.sqrt(fit['residual'][valid] / fit['count'][valid])
+                summary.append({'evmd_threshold': eps, 'min_samples': min_sample, 'min_time_span': min_time_span,
+                                'coverage': valid.sum() / max(has_data.sum(), 1),
+                                'kept_fraction': mask.sum() / max(stack.nobs, 1),
+                                'median_dhdt': np.median(fit['slope'][valid]) if valid.any() else np.nan,
+                                'median_dhdt_error': np.median(fit['slope_err'][valid]) if valid.any() else np.nan,
+                                'median_rms_residual': np.median(rms) if valid.any() else np.nan})
+                if rasters:
+                    prefix = '{}_sweep_evmd{:g}_ms{}_span{:g}'.format(self.dhdtprefix, eps, min_sample, min_time_span)
+                    slope = stack.to_grid(np.where(valid, fit['slope'], np.nan), fill=nodata)
+                    slope_err = stack.to_grid(np.where(valid, fit['slope_err'], np.nan), fill=nodata)
+                    SingleRaster(prefix + '_dhdt.tif').Array2Raster(slope, self.refgeo)
+                    SingleRaster(prefix + '_dhdt_error.tif').Array2Raster(slope_err, self.refgeo)
+        with open(self.dhdtprefix + '_sweep.csv', 'w') as f:
+            f.write(','.join(summary[0].keys()) + '\n')
+            for row in summary:
+                f.write(','.join(['{:g}'.format(i) for i in row.values()]) + '\n')
+        return summary
+
     def fitdata2file(self):
         # ==== Write to file ====
         dhdt_dem = SingleRaster(self.dhdtprefix + '_dhdt.tif')
@@ -809,6 +1476,10 @@ class DemPile(object):
         dhdt_error.Array2Raster(self.fitdata['slope_err'], self.refgeo)
         dhdt_res.Array2Raster(self.fitdata['residual'], self.refgeo)
         dhdt_count.Array2Raster(self.fitdata['count'], self.refgeo)
+        # ==== e.g. the robust weights summary of polyfit(robust=...) ====
+        for key in self.fitdata:
+            if key not in ['slope', 'slope_err', 'residual', 'count']:
+                SingleRaster('{}_dhdt_{}.tif'.format(self.dhdtprefix, key)).Array2Raster(self.fitdata[key], self.refgeo)
 
     def show_dhdt_tifs(self):
         dhdt_dem = SingleRaster(self.dhdtprefix + '_dhdt.tif')
@@ -818,60 +1489,256 @@ class DemPile(object):
         return dhdt_dem, dhdt_error, dhdt_res, dhdt_count
     
     @timeit
-    def form_mosaic(self, order='ascending', method='DBSCAN', parallel=False, min_samples=4):
+    def form_mosaic(self, order='ascending', method='DBSCAN', parallel=False, min_samples=4, target_date=None):
         """
         order options:
             ascending: early elevations will be populated first
             descending: late elevations will be populated first
-        method: 'DBSCAN' or 'legacy'
+            median: median of the largest EVMD cluster (the date and uncertainty are the medians of the cluster as well)
+            uncertainty: the verified elevation with the lowest uncertainty
+            nearest: the verified elevation closest to target_date ('YYYY-MM-DD')
+        method: 'DBSCAN' or 'legacy' (legacy only supports ascending and descending)
+        With DBSCAN, all pixels are done at once by segmented reductions on the CompactStack (see get_stack).
         """
         # ==== Create mosaicked array ====
         self.init_mosaic()
-        if method == 'DBSCAN' and self.ts[0, 0].evmd_labels is None:
-            print('No EVMD labels detected. Run do_evmd first.')
-            self.do_evmd(parallel=parallel, min_samples=min_samples)
-        for m in range(self.ts.shape[0]):
-            self.display_progress(m, self.ts.shape[0])
-            for n in range(self.ts.shape[1]):
-                date = self.ts[m, n].get_date()
-                uncertainty = self.ts[m, n].get_uncertainty()
-                value = self.ts[m, n].get_value()
-                if method == 'DBSCAN':
-                    labels = self.ts[m, n].evmd_labels
-                    if any(labels >= 0):
-                        verified_y_labels_idx = np.where(labels >= 0)[0]
-                        if order == 'descending':
-                            idx = verified_y_labels_idx[-1]
-                        elif order == 'ascending':
-                            idx = verified_y_labels_idx[0]
-                        else:
-                            raise ValueError('order must be "ascending" or "descending".')
-                        self.mosaic['value'][m, n] = value[idx]
-                        self.mosaic['date'][m, n] = date[idx]
-                        self.mosaic['uncertainty'][m, n] = uncertainty[idx]
-                elif method == 'legacy':
-                    if order == 'descending':
-                        date = np.flip(date)
-                        uncertainty = np.flip(uncertainty)
-                        value = np.flip(value)
-                    elif order != 'ascending':
-                        raise ValueError('order must be "ascending" or "descending".')
-                    exitstate, validated_value, validated_value_idx = EVMD(value, threshold=self.evmd_threshold)
-                    if exitstate < 0:
-                        self.mosaic['value'][m, n] = validated_value
-                        self.mosaic['date'][m, n] = date[validated_value_idx]
-                        self.mosaic['uncertainty'][m, n] = uncertainty[validated_value_idx]
+        if method == 'legacy':
+            self.form_mosaic_legacy(order=order)
+        elif method == 'DBSCAN':
+            stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+            add_items(stack.npix)      # pixels, for the performance report
+            verified = stack.verified()
+            nodata = self.refgeo.get_nodata()
+            if order in ['ascending', 'descending', 'uncertainty', 'nearest']:
+                if order == 'ascending':
+                    idx = stack.segment_first(verified)
+                elif order == 'descending':
+                    idx = stack.segment_last(verified)
+                elif order == 'uncertainty':
+                    idx = stack.segment_argmin(stack.uncertainty, verified)
                 else:
-                    raise ValueError('method must be "DBSCAN" or "legacy".')
+                    if target_date is None:
+                        raise ValueError('target_date is needed for order="nearest".')
+                    target = (datetime.strptime(target_date, '%Y-%m-%d') - self.refdate).days
+                    idx = stack.segment_argmin(np.abs(stack.date - target), verified)
+                value = stack.take(stack.value, idx)
+                date = stack.take(stack.date, idx)
+                uncertainty = stack.take(stack.uncertainty, idx)
+            elif order == 'median':
+                cluster = stack.largest_cluster()
+                value = stack.segment_median(stack.value, cluster)
+                date = stack.segment_median(stack.date, cluster)
+                uncertainty = stack.segment_median(stack.uncertainty, cluster)
+            else:
+                raise ValueError('order must be "ascending", "descending", "median", "uncertainty" or "nearest".')
+            self.mosaic['value'] = stack.to_grid(value, fill=nodata)
+            self.mosaic['date'] = stack.to_grid(date, fill=nodata)
+            self.mosaic['uncertainty'] = stack.to_grid(uncertainty, fill=nodata)
+        else:
+            raise ValueError('method must be "DBSCAN" or "legacy".')
+        if order == 'nearest':
+            order = 'nearest-{}'.format(target_date)
         mosaic_value       = SingleRaster('{}_mosaic-{}_value.tif'.format(self.dhdtprefix, order))
         mosaic_date        = SingleRaster('{}_mosaic-{}_date.tif'.format(self.dhdtprefix, order))
         mosaic_uncertainty = SingleRaster('{}_mosaic-{}_uncertainty.tif'.format(self.dhdtprefix, order))
         mosaic_value.Array2Raster(self.mosaic['value'], self.refgeo)
         mosaic_date.Array2Raster(self.mosaic['date'], self.refgeo)
         mosaic_uncertainty.Array2Raster(self.mosaic['uncertainty'], self.refgeo)
-        
+
+    def form_mosaic_legacy(self, order='ascending'):
+        # ==== The legacy EVMD, pixel by pixel ====
+        if order not in ['ascending', 'descending']:
+            raise ValueError('order must be "ascending" or "descending".')
+        for m in range(self.ts.shape[0]):
+            self.display_progress(m, self.ts.shape[0])
+            for n in range(self.ts.shape[1]):
+                date = self.ts[m, n].get_date()
+                uncertainty = self.ts[m, n].get_uncertainty()
+                value = self.ts[m, n].get_value()
+                if order == 'descending':
+                    date = np.flip(date)
+                    uncertainty = np.flip(uncertainty)
+                    value = np.flip(value)
+                exitstate, validated_value, validated_value_idx = EVMD(value, threshold=self.evmd_threshold)
+                if exitstate < 0:
+                    self.mosaic['value'][m, n] = validated_value
+                    self.mosaic['date'][m, n] = date[validated_value_idx]
+                    self.mosaic['uncertainty'][m, n] = uncertainty[validated_value_idx]
+
+    @timeit
+    def breakpoint_fit(self, min_segment=3, min_segment_span=365, parallel=False, min_samples=4):
+        """
+        Map-wide change-point analysis (e.g. surge onsets): a two-segment piecewise-linear model with an exhaustive
+        breakpoint search on the EVMD-verified observations of every pixel (see CompactStack.breakpoint_search).
+        min_segment: minimum number of observations on each side of the breakpoint.
+        min_segment_span: minimum time span (days) of each side.
+        Writes {dhdtprefix}_breakpoint_{name}.tif for name in date (days since refdate), date_err, pre_dhdt,
+        pre_dhdt_err, post_dhdt, post_dhdt_err, step, step_err and dbic (> 0 favors a breakpoint over a single
+        line), and returns them as a dict of 2-D arrays.
+        """
+        stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+        add_items(stack.npix)      # pixels, for the performance report
+        nodata = self.refgeo.get_nodata()
+        result = stack.breakpoint_search(stack.verified(), min_segment=min_segment, min_segment_span=min_segment_span)
+        names = {'date': 'date', 'date_err': 'date_err', 'pre_slope': 'pre_dhdt', 'pre_slope_err': 'pre_dhdt_err',
+                 'post_slope': 'post_dhdt', 'post_slope_err': 'post_dhdt_err', 'step': 'step', 'step_err': 'step_err', 'dbic': 'dbic'}
+        results = {}
+        for key, name in names.items():
+            results[name] = stack.to_grid(result[key], fill=nodata)
+            SingleRaster('{}_breakpoint_{}.tif'.format(self.dhdtprefix, name)).Array2Raster(results[name], self.refgeo)
+        return results
+
+    @timeit
+    def gp_transient(self, kernel=None, min_count=4, workers=4, chunksize=1000, parallel=False, min_samples=4):
+        """
+        The GP transient analysis of the viewer (gp_reg) for every pixel, on the EVMD-verified observations.
+        kernel: a sklearn kernel for the rescaled dates and elevations (default: default_gp_kernel()).
+                If all its hyperparameters are fixed, pixels with the same number of observations are done together
+                in chunks of chunksize pixels by gp_transient_batch (stacked Cholesky solves); otherwise each pixel
+                is fitted by gp_reg, including the optimization of the hyperparameters.
+        min_count: pixels with fewer verified observations are skipped.
+        workers: number of threads running the chunks (or pixels) in parallel.
+        Writes {dhdtprefix}_gp_max_transient_dh.tif, _gp_max_transient_dh_stderr.tif and _gp_max_transient_timing.tif
+        (days since refdate), and returns them as a dict of 2-D arrays.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if kernel is None:
+            kernel = default_gp_kernel()
+        stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+        add_items(stack.npix)      # pixels, for the performance report
+        verified = stack.subset(stack.verified())
+        results = {key: np.full(stack.npix, np.nan) for key in ['max_transient_dh', 'max_transient_dh_stderr', 'max_transient_timing']}
+
+        # ==== tasks: chunks of pixels with equal observation counts ====
+        tasks = []
+        for count in np.unique(verified.counts[verified.counts >= max(min_count, 2)]):
+            pixels = np.flatnonzero(verified.counts == count)
+            idx = verified.offsets[pixels][:, None] + np.arange(count)
+            # skip the pixels whose dates or elevations are all the same (they cannot be rescaled)
+            usable = (np.ptp(verified.date[idx], axis=1) > 0) & (np.ptp(verified.value[idx], axis=1) > 0)
+            pixels, idx = pixels[usable], idx[usable]
+            step = chunksize if kernel.n_dims == 0 else 1
+            for k in range(0, pixels.size, step):
+                tasks.append((pixels[k:k + step], idx[k:k + step]))
+
+        def run(task):
+            pixels, idx = task
+            xx, yy, ye = verified.date[idx], verified.value[idx], verified.uncertainty[idx]
+            if kernel.n_dims == 0:
+                try:
+                    return pixels, gp_transient_batch(xx, yy, ye, kernel=kernel)
+                except np.linalg.LinAlgError:
+                    pass
+            # free hyperparameters, or a chunk with an ill-conditioned pixel: one pixel at a time
+            out = np.full((3, pixels.size), np.nan)
+            for k in range(pixels.size):
+                try:
+                    if kernel.n_dims == 0:
+                        out[:, k] = np.ravel(gp_transient_batch(xx[k:k + 1], yy[k:k + 1], ye[k:k + 1], kernel=kernel))
+                    else:
+                        out[:, k] = gp_reg(xx[k], yy[k], ye=ye[k], kernel=kernel)[2:5]
+                except (np.linalg.LinAlgError, ValueError):
+                    continue
+            return pixels, out
+
+        with stage('gp_transient.solve', items=sum([i[0].size for i in tasks])):
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                for pixels, out in executor.map(run, tasks):
+                    results['max_transient_dh'][pixels] = out[0]
+                    results['max_transient_dh_stderr'][pixels] = out[1]
+                    results['max_transient_timing'][pixels] = out[2]
+
+        nodata = self.refgeo.get_nodata()
+        for key in results:
+            results[key] = stack.to_grid(results[key], fill=nodata)
+            SingleRaster('{}_gp_{}.tif'.format(self.dhdtprefix, key)).Array2Raster(results[key], self.refgeo)
+        return results
+
+    @timeit
+    def reduce_stack(self, stats=STATS, verified_only=False, write=True, parallel=False, min_samples=4):
+        """
+        Per-pixel statistics of the stack in one pass over the CompactStack (see CompactStack.reduce for the list:
+        count, min, max, median, mad, first_date, last_date, span, evmd_fraction, year_count).
+        verified_only: use only the EVMD-verified observations.
+        EVMD is done first if needed (for evmd_fraction or verified_only) and not done yet.
+        Returns {stat: 2-D array} (year_count: {year: 2-D array}), with nodata where a pixel has no observations.
+        If write is True, each is also written to {dhdtprefix}_stat-{stat}.tif ({dhdtprefix}_stat-count-{year}.tif
+        for year_count).
+        """
+        if verified_only or 'evmd_fraction' in stats:
+            stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+        else:
+            stack = self.get_stack()
+        add_items(stack.npix)      # pixels, for the performance report
+        nodata = self.refgeo.get_nodata()
+        mask = stack.verified() if verified_only else None
+        results = {}
+        for key, value in stack.reduce(stats, mask=mask, refdate=self.refdate).items():
+            if key == 'year_count':
+                results[key] = {year: stack.to_grid(i, fill=nodata) for year, i in value.items()}
+                paths = {'{}_stat-count-{}.tif'.format(self.dhdtprefix, year): grid for year, grid in results[key].items()}
+            else:
+                results[key] = stack.to_grid(value, fill=nodata)
+                paths = {'{}_stat-{}.tif'.format(self.dhdtprefix, key): results[key]}
+            if write:
+                for path, grid in paths.items():
+                    SingleRaster(path).Array2Raster(grid, self.refgeo)
+        return results
+
+    @timeit
+    def time_slice(self, dates, method='linear', max_extrapolation=None, parallel=False, min_samples=4):
+        """
+        Elevation and its uncertainty at each of the target dates ('YYYY-MM-DD'), from the EVMD-verified observations.
+        method options:
+            linear: the weighted linear regression of polyfit, evaluated at the date
+            bracket: linear interpolation between the verified observations right before and after the date
+                     (the uncertainty is propagated from the two); the linear regression is used outside
+                     the observed period.
+        max_extrapolation: in days. Pixels whose observations end (or start) longer ago than this before (after)
+                           the date are left empty. None = no limit.
+        All dates are done together on the CompactStack. Writes {dhdtprefix}_dem-{date}_value.tif and
+        {dhdtprefix}_dem-{date}_uncertainty.tif for each date, and returns {date: (value, uncertainty)}.
+        """
+        if method not in ['linear', 'bracket']:
+            raise ValueError('method must be "linear" or "bracket".')
+        if type(dates) is str:
+            dates = [dates]
+        stack = self._labelled_stack(parallel=parallel, min_samples=min_samples)
+        add_items(stack.npix * len(dates))      # pixel-dates, for the performance report
+        nodata = self.refgeo.get_nodata()
+        targets = np.array([(datetime.strptime(i, '%Y-%m-%d') - self.refdate).days for i in dates], dtype=float)
+        verified = stack.verified()
+        fit = stack.wlr_fit(verified, min_time_span=self.maskparam['min_time_span'])
+        value, uncertainty = linear_predict(fit, targets[:, None])
+        first = stack.take(stack.date, stack.segment_first(verified))
+        last = stack.take(stack.date, stack.segment_last(verified))
+        if method == 'bracket':
+            before, after = stack.bracket(targets, verified)
+            inside = (before >= 0) & (after >= 0)
+            i0 = before[inside]
+            i1 = after[inside]
+            t = np.broadcast_to(targets[:, None], before.shape)[inside]
+            dt = stack.date[i1] - stack.date[i0]
+            f = np.where(dt > 0, (t - stack.date[i0]) / np.where(dt > 0, dt, 1), 0.0)
+            value[inside] = (1 - f) * stack.value[i0] + f * stack.value[i1]
+            uncertainty[inside] = np.sqrt(((1 - f) * stack.uncertainty[i0]) ** 2 + (f * stack.uncertainty[i1]) ** 2)
+        if max_extrapolation is not None:
+            far = (targets[:, None] - last > max_extrapolation) | (first - targets[:, None] > max_extrapolation)
+            value[far] = np.nan
+            uncertainty[far] = np.nan
+        results = {}
+        for k, datestr in enumerate(dates):
+            results[datestr] = (stack.to_grid(value[k], fill=nodata), stack.to_grid(uncertainty[k], fill=nodata))
+            dem_value       = SingleRaster('{}_dem-{}_value.tif'.format(self.dhdtprefix, datestr))
+            dem_uncertainty = SingleRaster('{}_dem-{}_uncertainty.tif'.format(self.dhdtprefix, datestr))
+            dem_value.Array2Raster(results[datestr][0], self.refgeo)
+            dem_uncertainty.Array2Raster(results[datestr][1], self.refgeo)
+        return results
+
     @timeit
     def do_evmd(self, parallel=False, chunksize=(1000, 1000), min_samples=4, use_bitmask=False):
+        add_items(self.ts.size)      # pixels, for the performance report
+        self.stack = None
         if parallel:
             import dask
             from dask.diagnostics import ProgressBar
@@ -948,8 +1815,8 @@ class DemPile(object):
                 
     @staticmethod                
     def display_progress(m, total):
-        if m % 100 == 0:
-            print(f'{m}/{total} lines processed')
+        # logged every 100 lines, and recorded as the progress of the running stage (see libperf.progress)
+        progress(m, total)
     
     def viz(self, figsize=(8,8), clim=(-6, 6), evmd_threshold=8, min_samples=4, reg_method='linear', gp_kernel=None, k_bounds=[10, 150], downward_first=True,
             use_bitmask_only=False, use_evmd_only=True, use_matrix_alpha=False):
@@ -974,11 +1841,10 @@ class DemPile(object):
                 img[img == nodata] = np.nan
                 first_img = axs[0].imshow(img, cmap='gist_earth')
             else:
-                get_median_elev = lambda n: np.median(n.get_value())
-                vfunc = np.vectorize(get_median_elev)
-                img = vfunc(self.ts)
+                img = self.reduce_stack(['median'], write=False)['median']
                 quick_topography = SingleRaster(quick_topography_path.as_posix())
                 quick_topography.Array2Raster(img, self.refgeo)
+                img[img == self.refgeo.get_nodata()] = np.nan
                 first_img = axs[0].imshow(img, cmap='gist_earth')
         if gp_kernel is None:
             onclick = onclick_wrapper(self.ts, axs, self.refdate, evmd_threshold=evmd_threshold, min_samples=min_samples, reg_method=reg_method, 
@@ -991,9 +1857,9 @@ class DemPile(object):
         cid = fig.canvas.mpl_connect('button_press_event', onclick)
     
 def onclick_wrapper(data, axs, refdate, evmd_threshold=8, min_samples=4, reg_method='linear', k_bounds=[10, 150], downward_first=True,
-                    use_bitmask_only=False, use_evmd_only=True, use_matrix_alpha=False,
-                    gp_kernel = ConstantKernel(constant_value=160, constant_value_bounds='fixed') * RationalQuadratic(
-                       length_scale=1.2, alpha=0.1, alpha_bounds='fixed', length_scale_bounds='fixed')):
+                    use_bitmask_only=False, use_evmd_only=True, use_matrix_alpha=False, gp_kernel=None):
+    # gp_kernel = None: gp_reg uses the default kernel,
+    # ConstantKernel(160, fixed) * RationalQuadratic(length_scale=1.2, alpha=0.1, fixed)
     def onclick_ipynb(event):
         """
         Callback function for mouse click
@@ -1,14 +1,23 @@
 # used for pixel tracking
 # by Whyjay Zheng, Jul 6 2018
-# requires isce >= 2.0.0
+# requires isce >= 2.0.0 (or use the native numpy backend, see ncc_ampcor)
+# last edit: Oct 19 2026 (per-stage performance instrumentation)
+# last edit: Oct 19 2026 (native numpy backend)
 
-import isce
-from mroipac.ampcor.Ampcor import Ampcor
+try:
+	import isce
+	from mroipac.ampcor.Ampcor import Ampcor
+	HAS_ISCE = True
+except ImportError:
+	# ISCE is not installed. Only the native numpy backend (ncc_ampcor) can be used.
+	Ampcor = object
+	HAS_ISCE = False
 # from isceobj.Image.Image import Image
 import multiprocessing as mp
 from functools import partial
 import numpy as np
 import pickle
+from carst.libperf import stage, file_size
 
 class Ampcor_Corrected(Ampcor):
 
@@ -107,7 +116,137 @@ def multicore_ampcor(downrange, a, imgpair):
 	a.ampcor(imgpair[0].iscepointer, imgpair[1].iscepointer)
 	return a
 
+def ampcor_backend(backend='auto'):
+
+	"""
+	Return the ampcor backend to use: 'isce' (ampcor of ISCE) or 'numpy' (ncc_ampcor).
+	'auto' means 'isce' if ISCE is installed, otherwise 'numpy'.
+	"""
+
+	if backend is None or backend == 'auto':
+		return 'isce' if HAS_ISCE else 'numpy'
+	if backend not in ['isce', 'numpy']:
+		raise ValueError('backend must be "auto", "isce", or "numpy".')
+	if backend == 'isce' and not HAS_ISCE:
+		raise RuntimeError('ISCE is not installed. Use backend = numpy in [pxsettings].')
+	return backend
+
+def _box_sum(a, h, w):
+
+	"""
+	Sums of all the h-by-w windows of a (stack of) 2-D arrays, using an integral image.
+	"""
+
+	c = np.zeros(a.shape[:-2] + (a.shape[-2] + 1, a.shape[-1] + 1))
+	c[..., 1:, 1:] = a.cumsum(axis=-2).cumsum(axis=-1)
+	return c[..., h:, w:] - c[..., :-h, w:] - c[..., h:, :-w] + c[..., :-h, :-w]
+
+def ncc_offsets(refchips, searchchips, workers=1):
+
+	"""
+	Normalized cross-correlation of a stack of reference chips (B, h, w) over a stack of search chips
+	(B, h + 2 * sy, w + 2 * sx), computed with FFTs.
+	Return (dx, dy, peak, snr, cov) for each chip, where dx and dy are the sub-pixel offsets of the
+	best match (relative to the search chip center; from a parabola fit around the integer peak),
+	snr is the squared peak over the mean squared NCC outside the peak, and cov (B, 3) is the approximated
+	variance of dx, variance of dy, and their covariance, in pixels^2 (from the curvature of the peak).
+	Offsets are NaN where the peak is at the edge of the search range or a chip has no texture.
+	"""
+
+	from scipy import fft
+
+	nb, h, w = refchips.shape
+	H, W = searchchips.shape[1:]
+	sy, sx = (H - h) // 2, (W - w) // 2
+	r = refchips - refchips.mean(axis=(1, 2), keepdims=True)
+	rnorm = np.sqrt((r ** 2).sum(axis=(1, 2)))
+	spec = fft.rfft2(searchchips, s=(H, W), workers=workers) * np.conj(fft.rfft2(r, s=(H, W), workers=workers))
+	corr = fft.irfft2(spec, s=(H, W), workers=workers)[:, :2 * sy + 1, :2 * sx + 1]
+	n = h * w
+	s1 = _box_sum(searchchips, h, w)
+	s2 = _box_sum(searchchips ** 2, h, w)
+	svar = np.clip(s2 - s1 ** 2 / n, 0, None)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		ncc = corr / (rnorm[:, None, None] * np.sqrt(svar))
+	ncc[~np.isfinite(ncc)] = 0
+
+	flat = ncc.reshape(nb, -1).argmax(axis=1)
+	iy, ix = np.unravel_index(flat, ncc.shape[1:])
+	b = np.arange(nb)
+	inner = (iy > 0) & (iy < 2 * sy) & (ix > 0) & (ix < 2 * sx) & (rnorm > 0)
+	iyc, ixc = np.clip(iy, 1, 2 * sy - 1), np.clip(ix, 1, 2 * sx - 1)
+	c0 = ncc[b, iyc, ixc]
+	cxm, cxp = ncc[b, iyc, ixc - 1], ncc[b, iyc, ixc + 1]
+	cym, cyp = ncc[b, iyc - 1, ixc], ncc[b, iyc + 1, ixc]
+	dxx = cxp - 2 * c0 + cxm
+	dyy = cyp - 2 * c0 + cym
+	dxy = (ncc[b, iyc + 1, ixc + 1] - ncc[b, iyc + 1, ixc - 1] - ncc[b, iyc - 1, ixc + 1] + ncc[b, iyc - 1, ixc - 1]) / 4
+	inner &= (dxx < 0) & (dyy < 0)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		dx = ixc - sx + 0.5 * (cxm - cxp) / dxx
+		dy = iyc - sy + 0.5 * (cym - cyp) / dyy
+		# peak power over the mean power outside the 3-by-3 peak neighbourhood
+		power = (ncc ** 2).reshape(nb, -1).sum(axis=1)
+		peak_area = sum([ncc[b, iyc + i, ixc + j] ** 2 for i in (-1, 0, 1) for j in (-1, 0, 1)])
+		snr = c0 ** 2 / ((power - peak_area) / (ncc.shape[1] * ncc.shape[2] - 9))
+		# covariance ~ (1 - peak) / n * inv(-Hessian of the NCC surface)
+		det = dxx * dyy - dxy ** 2
+		scale = (1 - c0) / n / det
+		cov = np.stack([-dyy * scale, -dxx * scale, dxy * scale], axis=1)
+	dx[~inner] = np.nan
+	dy[~inner] = np.nan
+	return dx, dy, c0, snr, cov
+
+def ncc_ampcor(img1, img2, refwindow=(32, 32), searchwindow=(20, 20), skip=(10, 10), workers=1):
+
+	"""
+	Native (numpy) replacement for ampcor of ISCE, used when ISCE is not installed.
+	img1, img2: 2-D arrays (NaN for nodata).
+	refwindow: (x, y) size of the reference chips; searchwindow: (x, y) search range, in pixels on each side;
+	skip: (x, y) spacing of the chip centers.
+	Return an N-by-8 array in the same layout as the ampcor output:
+	x (1-based column of the chip center), offset across, y (1-based row), offset down, SNR, cov1, cov2, cov3.
+	Chips touching nodata, without texture, or with the peak at the edge of the search range are not returned.
+	The sub-pixel peak is found by a parabola fit instead of the oversampling of the correlation surface.
+	"""
+
+	w, h = refwindow
+	sx, sy = searchwindow
+	rows, cols = img1.shape
+	cx = np.arange(sx + w // 2, cols - (w - w // 2) - sx + 1, skip[0])
+	cy = np.arange(sy + h // 2, rows - (h - h // 2) - sy + 1, skip[1])
+	if cx.size == 0 or cy.size == 0:
+		return np.empty((0, 8))
+	results = []
+	for y in cy:
+		strip1 = img1[y - h // 2:y - h // 2 + h]
+		strip2 = img2[y - h // 2 - sy:y - h // 2 + h + sy]
+		left = cx - w // 2
+		refchips = np.lib.stride_tricks.sliding_window_view(strip1, (h, w))[0, left]
+		searchchips = np.lib.stride_tricks.sliding_window_view(strip2, (h + 2 * sy, w + 2 * sx))[0, left - sx]
+		valid = ~(np.isnan(refchips).any(axis=(1, 2)) | np.isnan(searchchips).any(axis=(1, 2)))
+		if not valid.any():
+			continue
+		dx, dy, peak, snr, cov = ncc_offsets(refchips[valid].astype(float), searchchips[valid].astype(float), workers=workers)
+		good = ~np.isnan(dx)
+		results.append(np.column_stack([cx[valid][good] + 1, dx[good], np.full(good.sum(), y + 1), dy[good], snr[good], cov[good]]))
+	if not results:
+		return np.empty((0, 8))
+	return np.vstack(results)
+
 def ampcor_task(imgpair, ini):
+	if ampcor_backend(ini.pxsettings.get('backend', 'auto')) == 'numpy':
+		img1, img2 = [i.ReadAsArray().astype(float) for i in imgpair]
+		for img, raster in zip([img1, img2], imgpair):
+			if raster.get_nodata() is not None:
+				img[img == raster.get_nodata()] = np.nan
+		px = ini.pxsettings
+		with stage('ampcor', bytes_read=img1.nbytes + img2.nbytes) as st:
+			task_result = ncc_ampcor(img1, img2, refwindow=(px['refwindow_x'], px['refwindow_y']),
+			                         searchwindow=(px['searchwindow_x'], px['searchwindow_y']),
+			                         skip=(px['skip_across'], px['skip_down']), workers=px['threads'])
+			st.add_items(task_result.shape[0])
+		return task_result
 	a = create_ampcor_task(ini)
 	downrange = []
 	downsize = imgpair[0].get_y_size()
@@ -118,27 +257,34 @@ def ampcor_task(imgpair, ini):
 	downrange[-1] = [i * downsize_each + 1, downsize]
 	pool = mp.Pool()
 	poolwork = partial(multicore_ampcor, a=a, imgpair=imgpair)
-	task_result = pool.map(poolwork, downrange)
+	with stage('ampcor', items=threads, bytes_read=sum([file_size(i.fpath) for i in imgpair])):
+		task_result = pool.map(poolwork, downrange)
 	return task_result
 
 def writeout_ampcor_task(task_result, ini):
-	field_list = [np.array(i.getOffsetField().unpackOffsets()) for i in task_result]
-	# vvvv---- zero field size detection
-	field_size = np.array([i.size for i in field_list])
-	field_size_zero_idx = np.where(field_size == 0)[0]
-	if field_size_zero_idx.size != 0:
-		for i in reversed(field_size_zero_idx):
-			del field_list[i]
-	# ^^^^----
-	field = np.vstack(field_list)
-	cov1 = np.hstack([np.array(i.getCov1()) for i in task_result])
-	cov2 = np.hstack([np.array(i.getCov2()) for i in task_result])
-	cov3 = np.hstack([np.array(i.getCov3()) for i in task_result])
-	cov = np.stack([cov1, cov2, cov3])
-	complete_set = np.concatenate([field, cov.T], axis = 1)
-	pickle.dump(complete_set, open(ini.rawoutput['label_ampcor'] + '.p', 'wb'))
-	if ini.rawoutput['if_generate_ampofftxt']:
-		np.savetxt(ini.rawoutput['label_ampcor'] + '.txt', complete_set, delimiter=" ", fmt='%5d %10.6f %5d %10.6f %10.6f %11.6f %11.6f %11.6f')
+	if isinstance(task_result, np.ndarray):
+		# output of the numpy backend, already in the final layout
+		complete_set = task_result
+	else:
+		field_list = [np.array(i.getOffsetField().unpackOffsets()) for i in task_result]
+		# vvvv---- zero field size detection
+		field_size = np.array([i.size for i in field_list])
+		field_size_zero_idx = np.where(field_size == 0)[0]
+		if field_size_zero_idx.size != 0:
+			for i in reversed(field_size_zero_idx):
+				del field_list[i]
+		# ^^^^----
+		field = np.vstack(field_list)
+		cov1 = np.hstack([np.array(i.getCov1()) for i in task_result])
+		cov2 = np.hstack([np.array(i.getCov2()) for i in task_result])
+		cov3 = np.hstack([np.array(i.getCov3()) for i in task_result])
+		cov = np.stack([cov1, cov2, cov3])
+		complete_set = np.concatenate([field, cov.T], axis = 1)
+	with stage('ampcor.write', items=complete_set.shape[0]) as st:
+		pickle.dump(complete_set, open(ini.rawoutput['label_ampcor'] + '.p', 'wb'))
+		if ini.rawoutput['if_generate_ampofftxt']:
+			np.savetxt(ini.rawoutput['label_ampcor'] + '.txt', complete_set, delimiter=" ", fmt='%5d %10.6f %5d %10.6f %10.6f %11.6f %11.6f %11.6f')
+		st.add_bytes(written=file_size(ini.rawoutput['label_ampcor'] + '.p'))
 
 # ===== params that have not been addressed yet
 # complex number
@@ -0,0 +1,71 @@
+# Func: lazy_import
+# used for deferring heavy dependencies (GDAL, rasterio, matplotlib, ...) until they are actually used,
+# so that "import carst" and the command line tools start quickly.
+# Oct 19 2026
+
+import importlib
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+
+    """
+    A placeholder of a module that is imported when one of its attributes is first accessed.
+    fallback: another module name to try if the import fails (e.g., 'gdal' for old GDAL versions).
+    on_load: a function called once with the real module right after it is imported.
+    """
+
+    def __init__(self, name, fallback=None, on_load=None):
+        super().__init__(name)
+        self.__dict__['_lazy_fallback'] = fallback
+        self.__dict__['_lazy_on_load'] = on_load
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is not None:
+            return module
+        with self.__dict__['_lazy_lock']:
+            if self.__dict__['_lazy_module'] is None:
+                try:
+                    module = importlib.import_module(self.__name__)
+                except ImportError:
+                    if self.__dict__['_lazy_fallback'] is None:
+                        raise
+                    module = importlib.import_module(self.__dict__['_lazy_fallback'])
+                if self.__dict__['_lazy_on_load'] is not None:
+                    self.__dict__['_lazy_on_load'](module)
+                self.__dict__['_lazy_module'] = module
+        return self.__dict__['_lazy_module']
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__['_lazy_module'] is None:
+            return "<lazy module '{}' (not loaded)>".format(self.__name__)
+        return repr(self.__dict__['_lazy_module'])
+
+
+def lazy_import(name, fallback=None, on_load=None):
+
+    """
+    Return the module if it has already been imported, or a LazyModule otherwise.
+    Example: gdal = lazy_import('osgeo.gdal', fallback='gdal')
+    """
+
+    if name in sys.modules:
+        module = sys.modules[name]
+        if on_load is not None:
+            on_load(module)
+        return module
+    return LazyModule(name, fallback=fallback, on_load=on_load)
@@ -0,0 +1,321 @@
+# Func: stage, timeit, add_items, add_bytes, progress, enable, disable, write_report, log_to_console
+# used for per-stage performance instrumentation (wall/CPU time, bytes, peak memory, throughput)
+# Oct 19 2026
+#
+# Turn it on with the environment variables
+#     CARST_PERF_REPORT=report.json   (JSON summary of every stage)
+#     CARST_PERF_TRACE=trace.json     (Chrome trace; open it in chrome://tracing or https://ui.perfetto.dev)
+# or with the --perf-report / --perf-trace options of the scripts in bin/, or by calling enable().
+# When it is off, stage() returns a shared do-nothing object, so the hooks cost almost nothing.
+# The start/end times of timeit and the loop progress are logged (logger 'carst') at the INFO level;
+# the scripts in bin/ show them on the console (see log_to_console).
+
+import os
+import sys
+import json
+import time
+import logging
+import atexit
+import threading
+import functools
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:       # Windows
+    resource = None
+
+_recorder = None
+_atexit_registered = False
+log = logging.getLogger('carst')
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024     # bytes on macOS, KB on Linux
+
+
+class _NullStage:
+
+    """ What stage() returns when the instrumentation is off. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add_items(self, n):
+        pass
+
+    def add_bytes(self, read=0, written=0):
+        pass
+
+    def set_progress(self, done, total):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+
+    """
+    One timed run of a stage. Use it as a context manager (see stage()).
+    add_items / add_bytes can be called inside the block to report the work done.
+    """
+
+    def __init__(self, recorder, name, items=0, bytes_read=0, bytes_written=0, args=None):
+        self.recorder = recorder
+        self.name = name
+        self.items = items
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.args = args or {}
+
+    def __enter__(self):
+        self.recorder.active().append(self)
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.t0
+        cpu = time.process_time() - self.cpu0
+        self.recorder.active().pop()
+        self.recorder.record(self, wall, cpu, failed=exc_type is not None)
+        return False
+
+    def add_items(self, n):
+        self.items += n
+
+    def add_bytes(self, read=0, written=0):
+        self.bytes_read += read
+        self.bytes_written += written
+
+    def set_progress(self, done, total):
+        self.recorder.counter(self.name + '.progress', {'done': done, 'total': total})
+
+
+class Recorder:
+
+    """
+    Collects the stages of a run and writes the JSON report and the Chrome trace.
+    """
+
+    def __init__(self, report_path=None, trace_path=None):
+        self.report_path = report_path
+        self.trace_path = trace_path
+        self.t0 = time.perf_counter()
+        self.start = datetime.now()
+        self.stages = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def active(self):
+        """ The stack of the stages running in the current thread. """
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def record(self, stage, wall, cpu, failed=False):
+        rss = peak_rss_mb()
+        with self._lock:
+            summary = self.stages.setdefault(stage.name, {'count': 0, 'failed': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                          'items': 0, 'bytes_read': 0, 'bytes_written': 0,
+                                                          'max_wall_s': 0.0, 'peak_rss_mb': None})
+            summary['count'] += 1
+            summary['failed'] += int(failed)
+            summary['wall_s'] += wall
+            summary['cpu_s'] += cpu
+            summary['items'] += stage.items
+            summary['bytes_read'] += stage.bytes_read
+            summary['bytes_written'] += stage.bytes_written
+            summary['max_wall_s'] = max(summary['max_wall_s'], wall)
+            summary['peak_rss_mb'] = rss
+            if self.trace_path is not None:
+                args = dict(stage.args, items=stage.items, bytes_read=stage.bytes_read,
+                            bytes_written=stage.bytes_written, cpu_s=cpu)
+                self.events.append({'name': stage.name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (stage.t0 - self.t0) * 1e6, 'dur': wall * 1e6, 'args': args})
+
+    def counter(self, name, values):
+        """ A counter event in the trace (e.g., the progress of a stage). """
+        if self.trace_path is not None:
+            with self._lock:
+                self.events.append({'name': name, 'ph': 'C', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (time.perf_counter() - self.t0) * 1e6, 'args': values})
+
+    def report(self):
+        with self._lock:
+            stages = {}
+            for name, summary in self.stages.items():
+                summary = dict(summary)
+                summary['items_per_s'] = summary['items'] / summary['wall_s'] if summary['wall_s'] > 0 else None
+                summary['cpu_utilization'] = summary['cpu_s'] / summary['wall_s'] if summary['wall_s'] > 0 else None
+                stages[name] = summary
+        return {'argv': sys.argv, 'start': self.start.isoformat(), 'wall_s': time.perf_counter() - self.t0,
+                'cpu_s': time.process_time(), 'peak_rss_mb': peak_rss_mb(), 'cpu_count': os.cpu_count(),
+                'stages': stages}
+
+    def write(self):
+        if self.report_path is not None:
+            with open(self.report_path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+            print('Performance report: {}'.format(self.report_path))
+        if self.trace_path is not None:
+            with self._lock:
+                events = list(self.events)
+            with open(self.trace_path, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            print('Performance trace: {}'.format(self.trace_path))
+
+
+def enable(report_path=None, trace_path=None):
+
+    """
+    Start recording. The report and the trace are written at exit (or by write_report()).
+    """
+
+    global _recorder, _atexit_registered
+    _recorder = Recorder(report_path=report_path, trace_path=trace_path)
+    if not _atexit_registered:
+        atexit.register(write_report)
+        _atexit_registered = True
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def write_report():
+    if _recorder is not None:
+        _recorder.write()
+
+
+def stage(name, items=0, bytes_read=0, bytes_written=0, **args):
+
+    """
+    Time a block of code as a named stage:
+        with stage('pileup.resample', dem=fpath) as st:
+            ...
+            st.add_items(n)
+    Records wall and CPU time, items and bytes (reported by the block), and peak RSS.
+    Stages with the same name are summed in the report and shown one by one in the trace.
+    """
+
+    if _recorder is None:
+        return _NULL_STAGE
+    return Stage(_recorder, name, items=items, bytes_read=bytes_read, bytes_written=bytes_written, args=args)
+
+
+def add_items(n):
+
+    """
+    Report n items processed by the innermost running stage of this thread (e.g., a function decorated by timeit).
+    """
+
+    if _recorder is not None:
+        stack = _recorder.active()
+        if stack:
+            stack[-1].add_items(n)
+
+
+def add_bytes(read=0, written=0):
+
+    """
+    Report bytes read / written by the innermost running stage of this thread.
+    """
+
+    if _recorder is not None:
+        stack = _recorder.active()
+        if stack:
+            stack[-1].add_bytes(read=read, written=written)
+
+
+def progress(done, total, unit='lines', every=100):
+
+    """
+    Report the progress of a loop (done out of total): logged every `every` units, and, when recording,
+    set as the progress of the innermost running stage of this thread (a counter in the trace).
+    The work itself is counted by add_items, so progress does not change the items of the stage.
+    """
+
+    if done % every == 0:
+        log.info('{}/{} {} processed'.format(done, total, unit))
+    if _recorder is not None:
+        stack = _recorder.active()
+        if stack:
+            stack[-1].set_progress(done, total)
+
+
+def timeit(func):
+
+    """
+    Record the function as a stage, and log its start time, end time, and time taken
+    (the messages that used to be printed; see log_to_console).
+    """
+
+    name = func.__module__.replace('carst.', '') + '.' + func.__qualname__
+
+    @functools.wraps(func)
+    def time_wrapper(*args, **kwargs):
+        time_a = datetime.now()
+        log.info('Program Start: {} ({})'.format(time_a.strftime('%Y-%m-%d %H:%M:%S'), name))
+        with stage(name):
+            dec_func = func(*args, **kwargs)
+        time_b = datetime.now()
+        log.info('Program End: {}'.format(time_b.strftime('%Y-%m-%d %H:%M:%S')))
+        log.info('Time taken: ' + str(time_b - time_a))
+        return dec_func
+    return time_wrapper
+
+
+def log_to_console(level=logging.INFO):
+
+    """
+    Show the messages of the 'carst' logger (timeit and progress) on stdout, as the scripts in bin/ do.
+    Library users can configure logging themselves instead.
+    """
+
+    if not any(getattr(handler, '_carst_console', False) for handler in log.handlers):
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler._carst_console = True
+        log.addHandler(handler)
+    log.setLevel(level)
+
+
+def file_size(fpath):
+    try:
+        return os.path.getsize(fpath)
+    except (OSError, TypeError):
+        return 0
+
+
+def add_arguments(parser):
+
+    """
+    Add --perf-report and --perf-trace to an argparse parser (used by the scripts in bin/).
+    """
+
+    parser.add_argument('--perf-report', help='Write a JSON performance report of each stage', dest='perf_report')
+    parser.add_argument('--perf-trace', help='Write a Chrome trace (chrome://tracing) of each stage', dest='perf_trace')
+
+
+def enable_from_args(args):
+    if getattr(args, 'perf_report', None) or getattr(args, 'perf_trace', None):
+        enable(report_path=args.perf_report, trace_path=args.perf_trace)
+
+
+if os.environ.get('CARST_PERF_REPORT') or os.environ.get('CARST_PERF_TRACE'):
+    enable(report_path=os.environ.get('CARST_PERF_REPORT') or None, trace_path=os.environ.get('CARST_PERF_TRACE') or None)
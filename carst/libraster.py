@@ -7,6 +7,14 @@
 # last edit: Sep 11 2018 (added a new class: RasterVelos)
 # last edit: Mar 01 2021 (enable URL support)
 # last edit: Apr 21 2023 (using rasterio for fast COG processing without changing the input URL)
+# last edit: Oct 19 2026 (block-by-block reading and writing for RasterVelos)
+# last edit: Oct 19 2026 (tiled filtering in a thread pool)
+# last edit: Oct 19 2026 (tiled connected-component labeling for small clump removal)
+# last edit: Oct 19 2026 (in-process gdal.Warp for Unify)
+# last edit: Oct 19 2026 (block cache for remote files)
+# last edit: Oct 19 2026 (lazy imports of GDAL and rasterio)
+# last edit: Oct 19 2026 (per-stage performance instrumentation)
+# last edit: Oct 19 2026 (binned KDE in VeloCorrectionInfo)
 
 import sys
 import os
@@ -28,29 +36,21 @@ import subprocess
 from subprocess import PIPE
 import numpy as np
 from datetime import datetime
-try:
-    from osgeo import gdal
-except ImportError:
-    import gdal    # this was used until GDAL 3.1
-from osgeo import osr
-import rasterio
+from carst.liblazy import lazy_import
+from carst.libcache import get_cache, is_remote, cached_read, materialize, local_copy
+from carst.libperf import timeit, stage
 # we assume the fpath is the file with .tif or .TIF suffix.
 
-try:
-    gdal.GetDriverByName('DODS').Deregister()
-except AttributeError:          # In Case that DODS driver does not exist (for GDAL >= 3.5)
-    pass
-
-def timeit(func):
-    def time_wrapper(*args, **kwargs):
-        time_a = datetime.now()
-        print('Program Start: {}'.format(time_a.strftime('%Y-%m-%d %H:%M:%S')))
-        dec_func = func(*args, **kwargs)
-        time_b = datetime.now()
-        print('Program End: {}'.format(time_b.strftime('%Y-%m-%d %H:%M:%S')))
-        print('Time taken: ' + str(time_b - time_a))
-        return dec_func
-    return time_wrapper
+def deregister_dods(gdal):
+    try:
+        gdal.GetDriverByName('DODS').Deregister()
+    except AttributeError:          # In Case that DODS driver does not exist (for GDAL >= 3.5)
+        pass
+
+# GDAL and rasterio are imported when they are first used (see carst.liblazy).
+gdal = lazy_import('osgeo.gdal', fallback='gdal', on_load=deregister_dods)    # 'gdal' was used until GDAL 3.1
+osr = lazy_import('osgeo.osr')
+rasterio = lazy_import('rasterio')
 
 class SingleRaster:
 
@@ -169,32 +169,56 @@ class SingleRaster:
         return dsband.DataType
 
 
-    def Unify(self, params):
+    def Unify(self, params, warp_memory=None, threads=None):
 
-        """ Use gdalwarp to clip, reproject, and resample a DEM using a given set of params (which can 'unify' all DEMs). """
+        """
+        Use gdal.Warp to clip, reproject, and resample a DEM using a given set of params (which can 'unify' all DEMs).
+        params: a dict like the [gdalwarp] section of the ini file, e.g.,
+                {'t_srs': 'EPSG:32646', 'tr': '30 30', 'te': 'xmin ymin xmax ymax', 'of': 'GTiff', 'ot': 'Float32', 'output_dir': 'xxx'}
+                'wm' (warp memory in MB) and 'threads' (number of warping threads or ALL_CPUS) are also accepted.
+        warp_memory, threads: same as params['wm'] and params['threads']; override the params if given.
+        The warping runs in the current process (no gdalwarp subprocess).
+        Raises RuntimeError if the warping fails.
+        Using Gdal.
+        """
 
-        print('Calling Gdalwarp...')
+        print('Calling gdal.Warp...')
         fpath_warped = self.fpath[:-4] + '_warped' + self.fpath[-4:]
         if 'output_dir' in params:
             newpath = '/'.join([params['output_dir'], fpath_warped.split('/')[-1]])
         else:
             # for pixel tracking (temporarily)
             newfolder = 'test_folder'
-            if not os.path.exists(newfolder):
-                os.makedirs(newfolder)
+            os.makedirs(newfolder, exist_ok=True)     # may run concurrently (see unify_rasters)
             newpath = '/'.join([newfolder, fpath_warped.split('/')[-1]])
             newpath = newpath.replace(newpath.split('.')[-1], 'img')
-        gdalwarp_cmd = 'gdalwarp -t_srs ' + params['t_srs'] + ' -tr ' + params['tr'] + ' -te ' + params['te']
+        if warp_memory is None:
+            warp_memory = params.get('wm', None)
+        if threads is None:
+            threads = params.get('threads', 'ALL_CPUS')
+        xres, yres = [float(i) for i in params['tr'].split()]
+        kwargs = dict(dstSRS=params['t_srs'].strip('\'"'),
+                      xRes=xres, yRes=yres,
+                      outputBounds=[float(i) for i in params['te'].split()],
+                      multithread=True,
+                      warpOptions=['NUM_THREADS={}'.format(threads)],
+                      options=['-overwrite'])
         if 'of' in params:
-            gdalwarp_cmd += ' -of ' + params['of']
+            kwargs['format'] = params['of']
         if 'ot' in params:
-            gdalwarp_cmd += ' -ot ' + params['ot']
-        gdalwarp_cmd += ' -overwrite ' + self.fpath + ' ' + newpath
-        print(gdalwarp_cmd)
-        retcode = subprocess.call(gdalwarp_cmd, shell=True)
-        if retcode != 0:
-            print('Gdalwarp failed. Please check if all the input parameters are properly set.')
-            sys.exit(retcode)
+            kwargs['outputType'] = gdal.GetDataTypeByName(params['ot'])
+        if warp_memory is not None:
+            kwargs['warpMemoryLimit'] = float(warp_memory)
+        print('gdal.Warp: {} -> {} ({})'.format(self.fpath, newpath, kwargs))
+        gdal.ErrorReset()
+        try:
+            ds = gdal.Warp(newpath, self.fpath, options=gdal.WarpOptions(**kwargs))
+        except RuntimeError as err:      # when gdal.UseExceptions() is on
+            raise RuntimeError('gdal.Warp failed for {}: {}'.format(self.fpath, err)) from err
+        if ds is None:
+            raise RuntimeError('gdal.Warp failed for {}: {} Please check if all the input parameters are properly set.'.format(
+                               self.fpath, gdal.GetLastErrorMsg()))
+        ds = None     # flush and close
         self.fpath = newpath
 
     def ReadGeolocPoint(self, x, y, band=1):
@@ -273,13 +297,30 @@ class SingleRaster:
     def ReadAsArray(self, band=1):
 
         """ The default will return the first band. 
+        Remote files (URL) are read through the block cache if it is set (see carst.libcache).
         Still using Gdal.
         """
 
+        if is_remote(self.fpath) and get_cache() is not None:
+            return cached_read(self.fpath, band=band)
         ds = gdal.Open(self.fpath)
         dsband = ds.GetRasterBand(band)
         return dsband.ReadAsArray()
 
+    def iter_blocks(self, *others, blocksize=(1024, 1024), halo=0, band=1):
+
+        """
+        Read this raster block by block instead of the whole band at once.
+        others: other SingleRaster objects on the same grid; their windows are read along with this one.
+        blocksize: (rows, cols) of each block.
+        halo: number of extra pixels read around each block (clipped at the raster edges), for neighbourhood filters.
+        Yields (block, arrays), where block is a RasterBlock and arrays is a list of numpy arrays
+        (this raster first, then others in the given order).
+        Using Gdal.
+        """
+
+        return iter_raster_blocks([self] + list(others), blocksize=blocksize, halo=halo, band=band)
+
     def Array2Raster(self, array, refdem):
 
         """ 
@@ -299,9 +340,10 @@ class SingleRaster:
         nodatavalue = refdem.get_nodata() if refdem.get_nodata() is not None else -9999.0
         array[np.isnan(array)] = nodatavalue
         out_raster.GetRasterBand(1).SetNoDataValue( nodatavalue )
-        out_raster.GetRasterBand(1).WriteArray(array)
-        # Save to file
-        out_raster.FlushCache()
+        with stage('raster.write', bytes_written=array.shape[0] * array.shape[1] * 4, fpath=self.fpath):
+            out_raster.GetRasterBand(1).WriteArray(array)
+            # Save to file
+            out_raster.FlushCache()
 
     def XYZArray2Raster(self, array, projection=''):
 
@@ -388,16 +430,22 @@ class SingleRaster:
         import isce
         from isceobj.Image.Image import Image
 
+        # ==== a remote file is copied to a local file through the block cache (if it is set),
+        # ==== so that ampcor reads a local file instead of the URL (see carst.libcache.local_copy)
+        fpath = self.fpath
+        if is_remote(fpath) and get_cache() is not None:
+            fpath = local_copy(self.fpath)
+
         # ==== need a vrt file
         # >= Python 3.4 
         from pathlib import Path
-        vrtpath = Path(self.fpath + '.vrt')
+        vrtpath = Path(fpath + '.vrt')
         if not vrtpath.is_file():
             print('Calling gdalbuildvrt...')
-            if self.fpath.startswith('http'):
-                gdalbuildvrt_cmd = 'gdalbuildvrt ' + os.path.basename(self.fpath) + '.vrt ' + self.fpath
+            if fpath.startswith('http'):
+                gdalbuildvrt_cmd = 'gdalbuildvrt ' + os.path.basename(fpath) + '.vrt ' + fpath
             else:
-                gdalbuildvrt_cmd = 'gdalbuildvrt ' + self.fpath + '.vrt ' + self.fpath
+                gdalbuildvrt_cmd = 'gdalbuildvrt ' + fpath + '.vrt ' + fpath
             print(gdalbuildvrt_cmd)
             retcode = subprocess.call(gdalbuildvrt_cmd, shell=True)
             if retcode != 0:
@@ -406,7 +454,7 @@ class SingleRaster:
         # ====================
 
         obj = Image()
-        obj.setFilename(self.fpath)
+        obj.setFilename(fpath)
         obj.setWidth(self.get_x_size())      # gdalinfo, first number
         if self.GetDataType() <= 3:
             obj.setDataType('SHORT')
@@ -465,96 +513,472 @@ class SingleRaster:
         # return np.extract(clipped_data != nodata, clipped_data)
         return clipped_data
 
-    def GaussianHighPass(self, sigma=3, truncate=1.0):
+    def GaussianHighPass(self, sigma=3, truncate=1.0, blocksize=(1024, 1024), workers=None):
 
         """
         Gaussian High Pass filter. Default sigma = 3.
+        The raster is filtered tile by tile in a thread pool (see tiled_filter), with a halo
+        equal to the Gaussian kernel radius, so the result is identical to filtering the whole array.
         Using Gdal.
         """
 
-        from scipy.ndimage import gaussian_filter
-        data = self.ReadAsArray()
-        data = data.astype(float)
-        if self.get_nodata() is not None:
-            data[data == self.get_nodata()] = np.nan
-        else:
-            data[data == 0] = np.nan    # LS-8 case
-        lowpass = gaussian_filter(data, sigma, truncate=truncate)
-        highpass = data - lowpass
+        from functools import partial
         if self.fpath.startswith('http://') or self.fpath.startswith('https://'):
             tmp = os.path.basename(self.fpath)
             hp_raster_path = tmp.rsplit('.', 1)[0] + '_GHP-' + str(sigma) + 'sig.tif'
         else:
             hp_raster_path = self.fpath.rsplit('.', 1)[0] + '_GHP-' + str(sigma) + 'sig.tif'
-        hp_raster = SingleRaster(hp_raster_path)
-        hp_raster.Array2Raster(highpass, self)
+        func = partial(_gaussian_highpass_kernel, sigma=sigma, truncate=truncate, nodata_val=self.get_nodata())
+        tiled_filter(func, [self], hp_raster_path, halo=gaussian_halo(sigma, truncate=truncate),
+                     blocksize=blocksize, workers=workers)
         self.set_path(hp_raster_path)
 
-    def GaussianLowPass(self, sigma=1):
+    def GaussianLowPass(self, sigma=1, blocksize=(1024, 1024), workers=None):
 
         """
         Gaussian Low Pass filter. Default sigma = 1.
         deal with nodata values.
         https://stackoverflow.com/questions/18697532/gaussian-filtering-a-image-with-nan-in-python
+        The raster is filtered tile by tile in a thread pool (see tiled_filter).
         Using Gdal.
         """
 
-        from scipy.ndimage import gaussian_filter
-        data = self.ReadAsArray()
-        # data[data == self.get_nodata()] = np.nan
-        # lowpass = gaussian_filter(data.astype(float), sigma, truncate=truncate)
-        nodata_pos = data == self.get_nodata()
-        data[nodata_pos] = 0
-        w = np.ones_like(data)
-        w[nodata_pos] = 0
-        vv = gaussian_filter(data.astype(float), sigma)
-        ww = gaussian_filter(w.astype(float), sigma)
-        ww[ww == 0] = np.finfo(float).eps
-        lowpass = vv / ww
-        lowpass[nodata_pos] = self.get_nodata()
+        from functools import partial
         if self.fpath.startswith('http://') or self.fpath.startswith('https://'):
             tmp = os.path.basename(self.fpath)
             lp_raster_path = tmp.rsplit('.', 1)[0] + '_GLP-' + str(sigma) + 'sig.tif'
         else:
             lp_raster_path = self.fpath.rsplit('.', 1)[0] + '_GLP-' + str(sigma) + 'sig.tif'
-        lp_raster = SingleRaster(lp_raster_path)
-        lp_raster.Array2Raster(lowpass, self)
+        func = partial(_gaussian_lowpass_kernel, sigma=sigma, nodata_val=self.get_nodata())
+        tiled_filter(func, [self], lp_raster_path, halo=gaussian_halo(sigma),
+                     blocksize=blocksize, workers=workers)
         self.set_path(lp_raster_path)
 
-    def CannyEdge(self, sigma=3):
+    def CannyEdge(self, sigma=3, edge_halo=32, blocksize=(1024, 1024), workers=None):
 
         """
         Canny Edge filter. Default sigma = 3.
         deal with nodata values.
         https://scikit-image.org/docs/dev/auto_examples/edges/plot_canny.html
+        The raster is filtered tile by tile in a thread pool (see tiled_filter).
+        Smoothing, gradients and non-maximum suppression are local, but the hysteresis step links
+        weak edges to strong ones along connected paths. edge_halo is the extra overlap given to
+        this step; an edge chain that leaves the tile by more than edge_halo pixels may be linked
+        differently than in the whole-array result.
         Using Gdal.
         """
 
-        from skimage import feature
-        data = self.ReadAsArray()
-        nodata_pos = data == self.get_nodata()
-        data[nodata_pos] = 0
-
-        edges = feature.canny(data, sigma=sigma)
-        edges[nodata_pos] = self.get_nodata()
-
+        from functools import partial
         if self.fpath.startswith('http://') or self.fpath.startswith('https://'):
             tmp = os.path.basename(self.fpath)
             canny_raster_path = tmp.rsplit('.', 1)[0] + '_Canny-' + str(sigma) + 'sig.tif'
         else:
             canny_raster_path = self.fpath.rsplit('.', 1)[0] + '_Canny-' + str(sigma) + 'sig.tif'
-        canny_raster = SingleRaster(canny_raster_path)
-        canny_raster.Array2Raster(edges, self)
+        func = partial(_canny_kernel, sigma=sigma, nodata_val=self.get_nodata())
+        # Gaussian radius + sobel (1) + non-maximum suppression (1) + mask erosion (1)
+        halo = gaussian_halo(sigma) + 3 + edge_halo
+        tiled_filter(func, [self], canny_raster_path, halo=halo, blocksize=blocksize, workers=workers)
         self.set_path(canny_raster_path)
 
 
+def unify_rasters(rasters, params, memory_budget=2048, workers=None):
+
+    """
+    Run SingleRaster.Unify on a list of rasters concurrently.
+    rasters: a list of SingleRaster objects. Each fpath is changed to the warped file, as Unify does.
+    params: the same as SingleRaster.Unify.
+    memory_budget: total warp memory (in MB) shared by all concurrent jobs; each of the
+                   workers jobs gets memory_budget / workers, and the CPUs are split in the same way.
+    workers: number of rasters warped at the same time (default: min(4, os.cpu_count())).
+    A failed raster does not stop the others.
+    Returns a list of the same length as rasters: None for success, or the exception raised.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    ncpu = os.cpu_count() or 1
+    if workers is None:
+        workers = min(4, ncpu)
+    warp_memory = max(float(memory_budget) / workers, 1.0)
+    threads = max(ncpu // workers, 1)
+
+    def run_unify(raster):
+        try:
+            raster.Unify(params, warp_memory=warp_memory, threads=threads)
+        except Exception as err:
+            print('Unify failed: {}'.format(err))
+            return err
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_unify, rasters))
+
+
+class RasterBlock:
+
+    """
+    A rectangular window of a raster grid, used for reading/writing a raster block by block.
+    xoff, yoff, xsize, ysize: the core window that this block is responsible for (in pixels).
+    read_xoff, read_yoff, read_xsize, read_ysize: the window actually read, i.e., the core window
+    padded with a halo and clipped at the raster edges.
+    """
+
+    def __init__(self, xoff, yoff, xsize, ysize, raster_xsize, raster_ysize, halo=0):
+        self.xoff = xoff
+        self.yoff = yoff
+        self.xsize = xsize
+        self.ysize = ysize
+        self.halo = halo
+        self.read_xoff = max(xoff - halo, 0)
+        self.read_yoff = max(yoff - halo, 0)
+        self.read_xsize = min(xoff + xsize + halo, raster_xsize) - self.read_xoff
+        self.read_ysize = min(yoff + ysize + halo, raster_ysize) - self.read_yoff
+
+    def __repr__(self):
+        return 'RasterBlock(xoff={}, yoff={}, xsize={}, ysize={}, halo={})'.format(
+               self.xoff, self.yoff, self.xsize, self.ysize, self.halo)
+
+    @property
+    def slices(self):
+        """ (row slice, col slice) of the core window in the full raster. """
+        return (slice(self.yoff, self.yoff + self.ysize), slice(self.xoff, self.xoff + self.xsize))
+
+    @property
+    def inner(self):
+        """ (row slice, col slice) that crops an array read with the halo back to the core window. """
+        row0 = self.yoff - self.read_yoff
+        col0 = self.xoff - self.read_xoff
+        return (slice(row0, row0 + self.ysize), slice(col0, col0 + self.xsize))
+
+
+def block_windows(xsize, ysize, blocksize=(1024, 1024), halo=0):
+
+    """
+    Split a raster grid of xsize (samples) by ysize (lines) into RasterBlocks, row by row.
+    blocksize: (rows, cols) of each block. Blocks at the right and bottom edges may be smaller.
+    """
+
+    rows, cols = blocksize
+    for yoff in range(0, ysize, rows):
+        for xoff in range(0, xsize, cols):
+            yield RasterBlock(xoff, yoff, min(cols, xsize - xoff), min(rows, ysize - yoff), xsize, ysize, halo=halo)
+
+
+def iter_raster_blocks(rasters, blocksize=(1024, 1024), halo=0, band=1):
+
+    """
+    Read aligned windows from several rasters that share the same grid.
+    rasters: a list of SingleRaster objects.
+    Yields (block, arrays): block is a RasterBlock, and arrays are the read windows (core + halo)
+    of all rasters in the same order as the input. Use arrays[i][block.inner] to get the core window.
+    Only one block per raster is held in memory at a time.
+    Using Gdal.
+    """
+
+    datasets = [gdal.Open(raster.fpath) for raster in rasters]
+    xsize = datasets[0].RasterXSize
+    ysize = datasets[0].RasterYSize
+    for raster, ds in zip(rasters, datasets):
+        if ds.RasterXSize != xsize or ds.RasterYSize != ysize:
+            raise ValueError('{} does not have the same size as {}.'.format(raster.fpath, rasters[0].fpath))
+    dsbands = [ds.GetRasterBand(band) for ds in datasets]
+    for block in block_windows(xsize, ysize, blocksize=blocksize, halo=halo):
+        arrays = [dsband.ReadAsArray(block.read_xoff, block.read_yoff, block.read_xsize, block.read_ysize)
+                  for dsband in dsbands]
+        yield block, arrays
+
+
+class RasterBlockWriter:
+
+    """
+    Write a new raster block by block. The output is the same as what SingleRaster.Array2Raster generates
+    (a 32-bit float geotiff using the size, projection, geotransform, and nodata value of refdem),
+    but the full array never needs to be in memory.
+    inputs: SingleRaster objects that are read while this raster is written. If fpath is one of them
+            (compared with os.path.realpath), the blocks are written to a temporary file in the same folder,
+            which replaces fpath (os.replace) when closing; otherwise the input would be truncated
+            before its first block is read.
+    Use it as a context manager, or call close() after the last block is written.
+    Using Gdal.
+    """
+
+    def __init__(self, fpath, refdem, inputs=()):
+        self.raster = SingleRaster(fpath)
+        self.nodatavalue = refdem.get_nodata() if refdem.get_nodata() is not None else -9999.0
+        input_paths = [os.path.realpath(raster.fpath) for raster in inputs if raster is not None]
+        if os.path.realpath(fpath) in input_paths:
+            self.write_path = '{}.tmp{}.tif'.format(fpath.rsplit('.', 1)[0], os.getpid())
+        else:
+            self.write_path = fpath
+        driver = gdal.GetDriverByName('GTiff')
+        self.ds = driver.Create(self.write_path, refdem.get_x_size(), refdem.get_y_size(), 1, gdal.GDT_Float32)
+        self.ds.SetGeoTransform( refdem.GetGeoTransform() )
+        self.ds.SetProjection(   refdem.GetProjection()   )
+        self.dsband = self.ds.GetRasterBand(1)
+        self.dsband.SetNoDataValue( self.nodatavalue )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, block, array):
+
+        """
+        Write the core window of a block. array can be either the core window or the whole read window
+        (core + halo); in the latter case the halo is cropped here. NaN is set to the nodata value.
+        """
+
+        if array.shape != (block.ysize, block.xsize):
+            array = array[block.inner]
+        array[np.isnan(array)] = self.nodatavalue
+        with stage('block.write', items=1, bytes_written=block.xsize * block.ysize * 4):
+            self.dsband.WriteArray(array, block.xoff, block.yoff)
+
+    def close(self):
+        if self.ds is not None:
+            self.dsband.FlushCache()
+            self.ds.FlushCache()
+            self.dsband = self.ds = None
+            if self.write_path != self.raster.fpath:
+                os.replace(self.write_path, self.raster.fpath)
+
+
+def check_distinct_outputs(fpaths):
+
+    """
+    Raise ValueError if two output paths (e.g., of several RasterBlockWriters fed by the same blocks)
+    point to the same file, in which case one output would silently overwrite the other.
+    """
+
+    seen = {}
+    for fpath in fpaths:
+        real = os.path.realpath(fpath)
+        if real in seen:
+            raise ValueError('Two outputs point to the same file: {} and {}'.format(seen[real], fpath))
+        seen[real] = fpath
+
+
+def gaussian_halo(sigma, truncate=4.0):
+
+    """
+    The radius of scipy.ndimage.gaussian_filter, which is the halo needed for exact tiled filtering.
+    """
+
+    return int(truncate * float(sigma) + 0.5)
+
+
+def tiled_filter(func, sources, destination, refdem=None, halo=0, blocksize=(1024, 1024), workers=None, band=1):
+
+    """
+    Apply a neighbourhood filter to huge rasters tile by tile, using a thread pool.
+    func: a function that takes one array per source (a tile padded with the halo) and returns
+          the filtered array of the same shape. It should be a local operation whose footprint
+          does not exceed the halo; in that case the output equals whole-array filtering bit for bit,
+          since every output pixel is computed from exactly the same input pixels.
+    sources: a list of SingleRaster objects on the same grid.
+    destination: output path. The output is a 32-bit float geotiff using the geometry and nodata
+                 value of refdem (default: sources[0]), same as SingleRaster.Array2Raster.
+    halo: overlap (in pixels) read around each tile and cropped before writing.
+    workers: number of threads (default: os.cpu_count()). scipy.ndimage releases the GIL,
+             so tiles are filtered in parallel. Each thread opens its own Gdal datasets.
+    Returns a SingleRaster object of the output.
+    """
+
+    if refdem is None:
+        refdem = sources[0]
+    blocks = block_windows(sources[0].get_x_size(), sources[0].get_y_size(), blocksize=blocksize, halo=halo)
+    with RasterBlockWriter(destination, refdem) as writer:
+        for block, result in map_raster_blocks(lambda block, *arrays: func(*arrays), sources, blocks,
+                                               workers=workers, band=band):
+            writer.write(block, result)
+    return writer.raster
+
+
+def map_raster_blocks(func, sources, blocks, workers=None, band=1):
+
+    """
+    Read the same window from each source and call func(block, *arrays) in a thread pool.
+    sources: a list of SingleRaster objects on the same grid.
+    blocks: an iterable of RasterBlocks (see block_windows).
+    workers: number of threads (default: os.cpu_count()). Each thread opens its own Gdal datasets.
+    Yields (block, result) in the order the blocks finish. At most 2 * workers blocks are in flight,
+    so results should be consumed (e.g., written) as they come to bound the memory use.
+    """
+
+    import threading
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    xsize = sources[0].get_x_size()
+    ysize = sources[0].get_y_size()
+    for source in sources[1:]:
+        if source.get_x_size() != xsize or source.get_y_size() != ysize:
+            raise ValueError('{} does not have the same size as {}.'.format(source.fpath, sources[0].fpath))
+
+    thread_data = threading.local()
+
+    cache = get_cache()
+    cached = [cache is not None and is_remote(source.fpath) for source in sources]
+
+    def run_block(block):
+        if not hasattr(thread_data, 'dsbands'):
+            thread_data.datasets = [None if use_cache else gdal.Open(source.fpath) for source, use_cache in zip(sources, cached)]
+            thread_data.dsbands = [None if ds is None else ds.GetRasterBand(band) for ds in thread_data.datasets]
+        window = (block.read_xoff, block.read_yoff, block.read_xsize, block.read_ysize)
+        with stage('block.read', items=1) as st:
+            arrays = [cached_read(source.fpath, band=band, window=window, cache=cache) if dsband is None else dsband.ReadAsArray(*window)
+                      for source, dsband in zip(sources, thread_data.dsbands)]
+            st.add_bytes(read=sum([array.nbytes for array in arrays]))
+        with stage('block.process', items=1, func=getattr(func, '__name__', repr(func))):
+            result = func(block, *arrays)
+        return block, result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for block in blocks:
+            pending.add(executor.submit(run_block, block))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def tiled_remove_small_objects(source, destination, min_size=17, nodata_val=None, blocksize=(1024, 1024),
+                               workers=None, band=1):
+
+    """
+    Tiled version of SmallObjects_noise_remover: set the connected clumps of valid pixels
+    that have fewer than min_size pixels to nodata, without reading the whole raster into memory.
+    Clumps can span many tiles, so a halo does not work here. Instead,
+    1. each tile is labeled independently (4-connectivity, as skimage.morphology.remove_small_objects),
+       keeping only the clump sizes and the labels on the tile borders;
+    2. labels that touch across tile borders are merged (union-find on a graph of the border pairs)
+       and clump sizes are summed over the whole raster;
+    3. each tile is labeled again and the small clumps are removed while streaming to the output.
+    The result is the same as SmallObjects_noise_remover on the full array.
+    source: a SingleRaster object. nodata_val: default is source.get_nodata().
+    Returns a SingleRaster object of the output.
+    """
+
+    from functools import partial
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if nodata_val is None:
+        nodata_val = source.get_nodata()
+    blocks = list(block_windows(source.get_x_size(), source.get_y_size(), blocksize=blocksize))
+
+    # ---- pass 1: label each tile
+    tiles = {}
+    for block, result in map_raster_blocks(partial(_label_tile, nodata_val=nodata_val, borders_only=True),
+                                           [source], blocks, workers=workers, band=band):
+        tiles[(block.yoff, block.xoff)] = result
+    offsets = {}
+    sizes = [np.zeros(1, dtype=np.int64)]    # global label 0 = nodata
+    nlabels = 0
+    for block in blocks:
+        offsets[(block.yoff, block.xoff)] = nlabels
+        tile_sizes = tiles[(block.yoff, block.xoff)]['sizes']
+        sizes.append(tile_sizes[1:])
+        nlabels += tile_sizes.size - 1
+    sizes = np.concatenate(sizes)
+
+    # ---- merge the labels across the tile borders
+    src = []
+    dst = []
+    for block in blocks:
+        key = (block.yoff, block.xoff)
+        for neighbor, side, neighbor_side in [((block.yoff, block.xoff + block.xsize), 'right', 'left'),
+                                              ((block.yoff + block.ysize, block.xoff), 'bottom', 'top')]:
+            if neighbor not in tiles:
+                continue
+            a = tiles[key][side]
+            b = tiles[neighbor][neighbor_side]
+            touching = (a > 0) & (b > 0)
+            src.append(a[touching] + offsets[key])
+            dst.append(b[touching] + offsets[neighbor])
+    src = np.concatenate(src) if src else np.array([], dtype=np.int64)
+    dst = np.concatenate(dst) if dst else np.array([], dtype=np.int64)
+    graph = coo_matrix((np.ones(src.size, dtype=np.int8), (src, dst)), shape=(nlabels + 1, nlabels + 1))
+    ncomponents, components = connected_components(graph, directed=False)
+    component_sizes = np.bincount(components, weights=sizes, minlength=ncomponents)
+    keep = component_sizes[components] >= min_size
+    keep[0] = False
+
+    # ---- pass 2: remove the small clumps
+    def remove_tile(block, array):
+        labels = _label_tile(block, array, nodata_val=nodata_val)['labels']
+        offset = offsets[(block.yoff, block.xoff)]
+        nlabels_tile = tiles[(block.yoff, block.xoff)]['sizes'].size - 1
+        keep_tile = np.concatenate([[False], keep[offset + 1:offset + nlabels_tile + 1]])
+        array[~keep_tile[labels]] = nodata_val
+        return array
+
+    with RasterBlockWriter(destination, source) as writer:
+        for block, result in map_raster_blocks(remove_tile, [source], blocks, workers=workers, band=band):
+            writer.write(block, result)
+    return writer.raster
+
+
+def _label_tile(block, array, nodata_val=-9999.0, borders_only=False):
+    from scipy.ndimage import label
+    labels, n = label(array != nodata_val)
+    if borders_only:
+        return {'sizes': np.bincount(labels.ravel(), minlength=n + 1),
+                'top': labels[0].copy(), 'bottom': labels[-1].copy(),
+                'left': labels[:, 0].copy(), 'right': labels[:, -1].copy()}
+    else:
+        return {'labels': labels}
+
+
+def _gaussian_highpass_kernel(data, sigma=3, truncate=1.0, nodata_val=None):
+    from scipy.ndimage import gaussian_filter
+    data = data.astype(float)
+    if nodata_val is not None:
+        data[data == nodata_val] = np.nan
+    else:
+        data[data == 0] = np.nan    # LS-8 case
+    lowpass = gaussian_filter(data, sigma, truncate=truncate)
+    return data - lowpass
+
+
+def _gaussian_lowpass_kernel(data, sigma=1, nodata_val=None):
+    from scipy.ndimage import gaussian_filter
+    nodata_pos = data == nodata_val
+    data[nodata_pos] = 0
+    w = np.ones_like(data)
+    w[nodata_pos] = 0
+    vv = gaussian_filter(data.astype(float), sigma)
+    ww = gaussian_filter(w.astype(float), sigma)
+    ww[ww == 0] = np.finfo(float).eps
+    lowpass = vv / ww
+    lowpass[nodata_pos] = nodata_val
+    return lowpass
+
+
+def _canny_kernel(data, sigma=3, nodata_val=None):
+    from skimage import feature
+    nodata_pos = data == nodata_val
+    data[nodata_pos] = 0
+    edges = feature.canny(data, sigma=sigma)
+    edges[nodata_pos] = nodata_val
+    return edges
+
 
 class RasterVelos():
 
-	def __init__(self, vx=None, vy=None, mag=None, snr=None, errx=None, erry=None, errmag=None):
+	def __init__(self, vx=None, vy=None, mag=None, snr=None, errx=None, erry=None, errmag=None, blocksize=(1024, 1024), workers=None):
 
 		'''
 		All 6 attributes are supposed to be a SingleRaster object.
+		blocksize: (rows, cols) of the blocks used by the pixel-wise operations, which read and write
+		all rasters block by block so that a full scene never needs to be in memory.
+		workers: number of threads used by the tiled noise filters (default: os.cpu_count()).
 		'''
 
 		self.vx = None
@@ -567,6 +991,8 @@ class RasterVelos():
 		self.errx = None
 		self.erry = None
 		self.errmag = None
+		self.blocksize = blocksize
+		self.workers = workers
 		if type(vx) is SingleRaster:
 			self.vx = vx
 		if type(vy) is SingleRaster:
@@ -603,13 +1029,47 @@ class RasterVelos():
 	def SetErrmag(self, errmag):
 		self.errmag = errmag
 
-	def CalMag(self):
+	def IterMag(self):
+
+		"""
+		Yield (block, magnitude of velocity) block by block (see self.blocksize), computed from Vx and Vy.
+		Use it (or CalMag with an output file) to process a scene that does not fit in memory.
+		"""
+
 		if self.vx is None or self.vy is None:
 			raise TypeError("You Need BOTH Vx and Vy to calculate the magnitude of velocity.")
+		for block, (vx_val, vy_val) in self.vx.iter_blocks(self.vy, blocksize=self.blocksize):
+			yield block, np.sqrt(vx_val ** 2 + vy_val ** 2)
+
+	def CalMag(self, fpath=None):
+
+		"""
+		Calculate the magnitude of velocity from Vx and Vy.
+		fpath: if given, the magnitude is written to this geotiff block by block and set as self.mag;
+		       the full scene is never in memory.
+		       Otherwise, the full-scene array is stored in self.mag_val as before, for the callers
+		       that use it as an array (this needs the whole scene in memory).
+		"""
+
+		if self.vx is None or self.vy is None:
+			raise TypeError("You Need BOTH Vx and Vy to calculate the magnitude of velocity.")
+		if fpath is not None:
+			with RasterBlockWriter(fpath, self.vx, inputs=[self.vx, self.vy]) as writer:
+				for block, mag_block in self.IterMag():
+					writer.write(block, mag_block)
+			self.SetMag(writer.raster)
 		else:
-			self.mag_val = np.sqrt(self.vx.ReadAsArray() ** 2 + self.vy.ReadAsArray() ** 2)
+			self.mag_val = None
+			for block, mag_block in self.IterMag():
+				if self.mag_val is None:
+					self.mag_val = np.empty((self.vx.get_y_size(), self.vx.get_x_size()), dtype=mag_block.dtype)
+				self.mag_val[block.slices] = mag_block
+
+	def VeloCorrectionInfo(self, vx_zarray, vy_zarray, ini, pngname=None, plot_max_points=100000):
 
-	def VeloCorrectionInfo(self, vx_zarray, vy_zarray, ini, pngname=None):
+		"""
+		pngname: if given, a scatter plot (at most plot_max_points random points) colored by the point density is saved.
+		"""
 
 		a = SingleRaster(ini.imagepair['image1'], date=ini.imagepair['image1_date'])
 		b = SingleRaster(ini.imagepair['image2'], date=ini.imagepair['image2_date'])
@@ -649,15 +1109,17 @@ class RasterVelos():
 		if pngname is not None:
 			import matplotlib.pyplot as plt
 			# import matplotlib
-			from scipy.stats import gaussian_kde
+			from carst.libxyz import kde_at_points
 			# font = {'family' : 'sans-serif',
 			#         'weight' : 'normal',
 			#         'size'   : 26}
 			# matplotlib.rc('font', **font)
 
-			xy = np.vstack([vx_zarray, vy_zarray])
-			z = gaussian_kde(xy)(xy)
-			plt.scatter(vx_zarray, vy_zarray, c=z, s=8, edgecolor='')
+			z = kde_at_points(vx_zarray, vy_zarray)     # binned (near-linear) for large arrays
+			sub = np.arange(len(vx_zarray))
+			if sub.size > plot_max_points:
+				sub = np.sort(np.random.default_rng(0).choice(sub.size, plot_max_points, replace=False))
+			plt.scatter(np.asarray(vx_zarray)[sub], np.asarray(vy_zarray)[sub], c=z[sub], s=8, edgecolor='')
 			# cbar = plt.colorbar()
 			# cbar.set_label('Kernel density estimation')
 			# plt.scatter(np.reshape(c_data, -1), np.reshape(w_data, -1), c=cc)
@@ -684,29 +1146,30 @@ class RasterVelos():
 
 		'''
 		vx_zarray and vy_zarray are ZArray objects.
+		All rasters are processed block by block (see self.blocksize).
 		'''
 
 		nodata_val = self.mag.get_nodata()
-		nodata_pos = self.mag.ReadAsArray() == nodata_val
-
-		vx_val_corrected = self.vx.ReadAsArray() - vx_zarray.MAD_median
-		vy_val_corrected = self.vy.ReadAsArray() - vy_zarray.MAD_median
-		mag_val_corrected = np.sqrt(vx_val_corrected ** 2 + vy_val_corrected ** 2)
-
-		vx_val_corrected[nodata_pos] = nodata_val
-		vy_val_corrected[nodata_pos] = nodata_val
-		mag_val_corrected[nodata_pos] = nodata_val
-
-		raster_vx_corrected = SingleRaster(output_raster_prefix + '_vx.tif')
-		raster_vx_corrected.Array2Raster(vx_val_corrected, self.vx)
-		raster_vy_corrected = SingleRaster(output_raster_prefix + '_vy.tif')
-		raster_vy_corrected.Array2Raster(vy_val_corrected, self.vy)
-		raster_mag_corrected = SingleRaster(output_raster_prefix + '_mag.tif')
-		raster_mag_corrected.Array2Raster(mag_val_corrected, self.vx)
-
-		self.SetVx(raster_vx_corrected)
-		self.SetVy(raster_vy_corrected)
-		self.SetMag(raster_mag_corrected)
+		has_errx = self.errx is not None
+		has_erry = self.erry is not None
+
+		inputs = [self.vx, self.vy]
+		if has_errx:
+			inputs.append(self.errx)
+		if has_erry:
+			inputs.append(self.erry)
+		# an output may be one of the inputs (e.g., the same label_geotiff for [rawoutput] and [velocorrection]);
+		# such an output is written to a temporary file and moved to its place when done.
+		read_rasters = [self.mag] + inputs
+		writers = {'vx':  RasterBlockWriter(output_raster_prefix + '_vx.tif', self.vx, inputs=read_rasters),
+		           'vy':  RasterBlockWriter(output_raster_prefix + '_vy.tif', self.vy, inputs=read_rasters),
+		           'mag': RasterBlockWriter(output_raster_prefix + '_mag.tif', self.vx, inputs=read_rasters)}
+		if has_errx:
+			writers['errx'] = RasterBlockWriter(output_raster_prefix + '_errx.tif', self.errx, inputs=read_rasters)
+		if has_erry:
+			writers['erry'] = RasterBlockWriter(output_raster_prefix + '_erry.tif', self.erry, inputs=read_rasters)
+		if has_errx and has_erry:
+			writers['errmag'] = RasterBlockWriter(output_raster_prefix + '_errmag.tif', self.errx, inputs=read_rasters)
 
 		# ==== Calculate the corrected error ====
 		# Note that we changed the way to calculate it from the previous version; Now the
@@ -721,59 +1184,80 @@ class RasterVelos():
 		#
 		# for a more realistic and conserved error estimate.
 
-		if self.errx is not None:
-			errx_val_corrected = self.errx.ReadAsArray() + vx_zarray.MAD_std
-			errx_val_corrected[nodata_pos] = nodata_val
-			raster_errx_corrected = SingleRaster(output_raster_prefix + '_errx.tif')
-			raster_errx_corrected.Array2Raster(errx_val_corrected, self.errx)
-			self.SetErrx(raster_errx_corrected)
-
-
-		if self.erry is not None:
-			erry_val_corrected = self.erry.ReadAsArray() + vy_zarray.MAD_std
-			erry_val_corrected[nodata_pos] = nodata_val
-			raster_erry_corrected = SingleRaster(output_raster_prefix + '_erry.tif')
-			raster_erry_corrected.Array2Raster(erry_val_corrected, self.erry)
-			self.SetErry(raster_erry_corrected)
-
-		if self.errx is not None and self.erry is not None:
-			errmag_val_corrected = np.sqrt(
-				                   (vx_val_corrected ** 2 * errx_val_corrected ** 2 + vy_val_corrected ** 2 * erry_val_corrected ** 2)
-				                   / (vx_val_corrected ** 2 + vy_val_corrected ** 2)
-				                   )
-			errmag_val_corrected[nodata_pos] = nodata_val
-			raster_errmag_corrected = SingleRaster(output_raster_prefix + '_errmag.tif')
-			raster_errmag_corrected.Array2Raster(errmag_val_corrected, self.errx)
-			self.SetErrmag(raster_errmag_corrected)
+		for block, arrays in self.mag.iter_blocks(*inputs, blocksize=self.blocksize):
+			mag_val, vx_val, vy_val = arrays[:3]
+			nodata_pos = mag_val == nodata_val
+
+			vx_val_corrected = vx_val - vx_zarray.MAD_median
+			vy_val_corrected = vy_val - vy_zarray.MAD_median
+			mag_val_corrected = np.sqrt(vx_val_corrected ** 2 + vy_val_corrected ** 2)
+
+			vx_val_corrected[nodata_pos] = nodata_val
+			vy_val_corrected[nodata_pos] = nodata_val
+			mag_val_corrected[nodata_pos] = nodata_val
+
+			writers['vx'].write(block, vx_val_corrected)
+			writers['vy'].write(block, vy_val_corrected)
+			writers['mag'].write(block, mag_val_corrected)
+
+			if has_errx:
+				errx_val_corrected = arrays[3] + vx_zarray.MAD_std
+				errx_val_corrected[nodata_pos] = nodata_val
+				writers['errx'].write(block, errx_val_corrected)
+
+			if has_erry:
+				erry_val_corrected = arrays[-1] + vy_zarray.MAD_std
+				erry_val_corrected[nodata_pos] = nodata_val
+				writers['erry'].write(block, erry_val_corrected)
+
+			if has_errx and has_erry:
+				errmag_val_corrected = np.sqrt(
+					                   (vx_val_corrected ** 2 * errx_val_corrected ** 2 + vy_val_corrected ** 2 * erry_val_corrected ** 2)
+					                   / (vx_val_corrected ** 2 + vy_val_corrected ** 2)
+					                   )
+				errmag_val_corrected[nodata_pos] = nodata_val
+				writers['errmag'].write(block, errmag_val_corrected)
+
+		for writer in writers.values():
+			writer.close()
+
+		self.SetVx(writers['vx'].raster)
+		self.SetVy(writers['vy'].raster)
+		self.SetMag(writers['mag'].raster)
+		if has_errx:
+			self.SetErrx(writers['errx'].raster)
+		if has_erry:
+			self.SetErry(writers['erry'].raster)
+		if has_errx and has_erry:
+			self.SetErrmag(writers['errmag'].raster)
 
 	def SNR_CutNoise(self, snr_threshold=5):
-		bad_pts = self.snr.ReadAsArray() <= snr_threshold
-		mag_val = self.mag.ReadAsArray()
-		mag_val[bad_pts] = self.mag.get_nodata()
-		raster_mag_cutnoise = SingleRaster(self.mag.fpath.rsplit('.', 1)[0]  + '_SNT.tif')
-		raster_mag_cutnoise.Array2Raster(mag_val, self.mag)
-		self.SetMag(raster_mag_cutnoise)
+		nodata_val = self.mag.get_nodata()
+		with RasterBlockWriter(self.mag.fpath.rsplit('.', 1)[0]  + '_SNT.tif', self.mag) as writer:
+			for block, (snr_val, mag_val) in self.snr.iter_blocks(self.mag, blocksize=self.blocksize):
+				bad_pts = snr_val <= snr_threshold
+				mag_val[bad_pts] = nodata_val
+				writer.write(block, mag_val)
+		self.SetMag(writer.raster)
 
 	def Gaussian_CutNoise(self, sigma=1):
-		mag_val = self.mag.ReadAsArray()
-		mag_val_ok = Gussian_noise_remover(mag_val, sigma=sigma, nodata_val=self.mag.get_nodata())
-		raster_mag_cutnoise = SingleRaster(self.mag.fpath.rsplit('.', 1)[0]  + '-GAU.tif')
-		raster_mag_cutnoise.Array2Raster(mag_val_ok, self.mag)
+		from functools import partial
+		func = partial(_gaussian_noise_kernel, sigma=sigma, nodata_val=self.mag.get_nodata())
+		raster_mag_cutnoise = tiled_filter(func, [self.mag], self.mag.fpath.rsplit('.', 1)[0]  + '-GAU.tif',
+		                                   halo=gaussian_halo(sigma), blocksize=self.blocksize, workers=self.workers)
 		self.SetMag(raster_mag_cutnoise)
 
 	def MorphoOpen_CutNoise(self, iterations=1):
-		mag_val = self.mag.ReadAsArray()
-		mag_val_ok = MorphoOpen_noise_remover(mag_val, nodata_val=self.mag.get_nodata(), iterations=1)
-		raster_mag_cutnoise = SingleRaster(self.mag.fpath.rsplit('.', 1)[0]  + '-MOR.tif')
-		raster_mag_cutnoise.Array2Raster(mag_val_ok, self.mag)
+		from functools import partial
+		func = partial(_morphoopen_noise_kernel, nodata_val=self.mag.get_nodata(), iterations=1)
+		# erosion and then dilation with a 3x3 structure: 2 pixels per iteration
+		raster_mag_cutnoise = tiled_filter(func, [self.mag], self.mag.fpath.rsplit('.', 1)[0]  + '-MOR.tif',
+		                                   halo=2, blocksize=self.blocksize, workers=self.workers)
 		self.SetMag(raster_mag_cutnoise)
 
 	def SmallObjects_CutNoise(self, min_size=17):
-		from skimage.morphology import remove_small_objects
-		mag_val = self.mag.ReadAsArray()
-		mag_val_ok = SmallObjects_noise_remover(mag_val, nodata_val=self.mag.get_nodata(), min_size=min_size)
-		raster_mag_cutnoise = SingleRaster(self.mag.fpath.rsplit('.', 1)[0]  + '-RSO.tif')
-		raster_mag_cutnoise.Array2Raster(mag_val_ok, self.mag)
+		raster_mag_cutnoise = tiled_remove_small_objects(self.mag, self.mag.fpath.rsplit('.', 1)[0]  + '-RSO.tif',
+		                                                 min_size=min_size, blocksize=self.blocksize, workers=self.workers)
 		self.SetMag(raster_mag_cutnoise)
 
 	def Fahnestock_CutNoise(self):
@@ -785,33 +1269,26 @@ class RasterVelos():
 		self.SetMag(raster_mag_cutnoise)
 
 	def MaskAllRasters(self):
-		mag_val = self.mag.ReadAsArray()
-		nodata = mag_val == self.mag.get_nodata()
-		vx_val = self.vx.ReadAsArray()
-		vx_val[nodata] = self.vx.get_nodata()
-		raster_vx_cutnoise = SingleRaster(self.mag.fpath.replace('mag', 'vx'))
-		raster_vx_cutnoise.Array2Raster(vx_val, self.vx)
-		self.SetVx(raster_vx_cutnoise)
-		vy_val = self.vy.ReadAsArray()
-		vy_val[nodata] = self.vy.get_nodata()
-		raster_vy_cutnoise = SingleRaster(self.mag.fpath.replace('mag', 'vy'))
-		raster_vy_cutnoise.Array2Raster(vy_val, self.vy)
-		self.SetVy(raster_vy_cutnoise)
-		errx_val = self.errx.ReadAsArray()
-		errx_val[nodata] = self.errx.get_nodata()
-		raster_errx_cutnoise = SingleRaster(self.mag.fpath.replace('mag', 'errx'))
-		raster_errx_cutnoise.Array2Raster(errx_val, self.errx)
-		self.SetErrx(raster_errx_cutnoise)
-		erry_val = self.erry.ReadAsArray()
-		erry_val[nodata] = self.erry.get_nodata()
-		raster_erry_cutnoise = SingleRaster(self.mag.fpath.replace('mag', 'erry'))
-		raster_erry_cutnoise.Array2Raster(erry_val, self.erry)
-		self.SetErry(raster_erry_cutnoise)
-		errmag_val = self.errmag.ReadAsArray()
-		errmag_val[nodata] = self.errmag.get_nodata()
-		raster_errmag_cutnoise = SingleRaster(self.mag.fpath.replace('mag', 'errmag'))
-		raster_errmag_cutnoise.Array2Raster(errmag_val, self.errmag)
-		self.SetErrmag(raster_errmag_cutnoise)
+		targets = [('vx', self.vx), ('vy', self.vy), ('errx', self.errx), ('erry', self.erry), ('errmag', self.errmag)]
+		outputs = [self.mag.fpath.replace('mag', label) for label, raster in targets]
+		# e.g., a mag file name without 'mag' would send all outputs to the mag file itself
+		check_distinct_outputs([self.mag.fpath] + outputs)
+		read_rasters = [self.mag] + [raster for label, raster in targets]
+		writers = [RasterBlockWriter(output, raster, inputs=read_rasters) for output, (label, raster) in zip(outputs, targets)]
+		nodata_vals = [raster.get_nodata() for label, raster in targets]
+		mag_nodata = self.mag.get_nodata()
+		for block, arrays in self.mag.iter_blocks(*[raster for label, raster in targets], blocksize=self.blocksize):
+			nodata = arrays[0] == mag_nodata
+			for writer, val, nodata_val in zip(writers, arrays[1:], nodata_vals):
+				val[nodata] = nodata_val
+				writer.write(block, val)
+		for writer in writers:
+			writer.close()
+		self.SetVx(writers[0].raster)
+		self.SetVy(writers[1].raster)
+		self.SetErrx(writers[2].raster)
+		self.SetErry(writers[3].raster)
+		self.SetErrmag(writers[4].raster)
 
 
 @timeit
@@ -823,6 +1300,9 @@ def Gussian_noise_remover(array, sigma=1, nodata_val=-9999.0):
 	https://stackoverflow.com/questions/18697532/gaussian-filtering-a-image-with-nan-in-python
 	"""
 
+	return _gaussian_noise_kernel(array, sigma=sigma, nodata_val=nodata_val)
+
+def _gaussian_noise_kernel(array, sigma=1, nodata_val=-9999.0):
 	from scipy.ndimage import gaussian_filter
 	nodata_pos = array == nodata_val
 	array[nodata_pos] = 0
@@ -852,6 +1332,9 @@ def SmallObjects_noise_remover(array, nodata_val=-9999.0, min_size=17):
 @timeit
 def MorphoOpen_noise_remover(array, nodata_val=-9999.0, iterations=1):
 
+	return _morphoopen_noise_kernel(array, nodata_val=nodata_val, iterations=iterations)
+
+def _morphoopen_noise_kernel(array, nodata_val=-9999.0, iterations=1):
 	from scipy.ndimage import binary_opening
 	nodata_pos = array == nodata_val
 	bin_array = np.ones_like(array)
@@ -860,8 +1343,6 @@ def MorphoOpen_noise_remover(array, nodata_val=-9999.0, iterations=1):
 	array[~new_bin_array] = nodata_val
 	return array
 
-from skimage.morphology import remove_small_objects
-
 @timeit
 def Fahnestock_noise_remover(array, error_array, nodata_val=-9999.0):
 
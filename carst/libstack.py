@@ -0,0 +1,803 @@
+# Class: CompactStack, StreamingSums, RunningMedianGate
+# used for vectorized (whole-map) processing of the DEM time series piled up by DemPile,
+#      and for streaming (O(pixels)) accumulation of the regression statistics
+# Oct 19 2026
+
+import numpy as np
+
+# Sums over the observations of a pixel that are enough for the weighted linear regression of wlr_corefun
+# (weights = 1 / uncertainty ** 2), including the unweighted ones for the sum of squared residuals.
+SUM_TERMS = ('n', 'w', 'wx', 'wxx', 'wy', 'wxy', 'wyy', 'x', 'xx', 'y', 'xy', 'yy')
+
+# Tuning constants of the robust weights (95% efficiency for normally distributed residuals)
+ROBUST_TUNING = {'huber': 1.345, 'tukey': 4.685}
+
+# Per-pixel statistics available in CompactStack.reduce
+STATS = ('count', 'min', 'max', 'median', 'mad', 'first_date', 'last_date', 'span', 'evmd_fraction', 'year_count')
+
+
+def regression_terms(x, y, ye, weight=None):
+
+    """
+    Per-observation terms whose (per-pixel) sums are the sufficient statistics listed in SUM_TERMS.
+    x: date (days); y: value (better centered per pixel, for precision); ye: uncertainty.
+    weight: an extra factor of the weights 1 / ye ** 2 (e.g. the robust weights of CompactStack.irls_fit).
+    """
+
+    w = 1 / ye ** 2 if weight is None else weight / ye ** 2
+    return {'n': np.ones_like(x), 'w': w, 'wx': w * x, 'wxx': w * x * x, 'wy': w * y, 'wxy': w * x * y, 'wyy': w * y * y,
+            'x': x, 'xx': x * x, 'y': y, 'xy': x * y, 'yy': y * y}
+
+
+def wlr_from_sums(sums, span, min_count=3, min_time_span=365):
+
+    """
+    The weighted linear regression of wlr_corefun (y = a + b * x), for every pixel at once, from the sums
+    of regression_terms. span: time span (days) of the observations of each pixel.
+    Returns a dict of arrays: slope and slope_err (m/yr), residual (sum of squared residuals), count,
+    intercept, and the covariance of the coefficients (var_a, var_b, cov_ab; x in days).
+    Pixels with fewer than min_count observations or a span <= min_time_span have NaN in all but count.
+    """
+
+    n = sums['n']
+    det = sums['w'] * sums['wxx'] - sums['wx'] ** 2
+    ok = (n >= min_count) & (span > min_time_span) & (det > 0)
+    det = np.where(ok, det, 1.0)
+    b = (sums['w'] * sums['wxy'] - sums['wx'] * sums['wy']) / det
+    a = (sums['wxx'] * sums['wy'] - sums['wx'] * sums['wxy']) / det
+    resid = (sums['yy'] - 2 * a * sums['y'] - 2 * b * sums['xy'] + a * a * n + 2 * a * b * sums['x'] + b * b * sums['xx'])
+    fit = {'slope': b * 365.25,
+           'slope_err': np.sqrt(sums['w'] / det) * 365.25,
+           'residual': np.maximum(resid, 0),
+           'intercept': a,
+           'var_a': sums['wxx'] / det,
+           'var_b': sums['w'] / det,
+           'cov_ab': -sums['wx'] / det}
+    for key in fit:
+        fit[key] = np.where(ok, fit[key], np.nan)
+    fit['count'] = n.astype(float)
+    return fit
+
+
+def wlr_chi2(sums):
+
+    """ Weighted sum of squared residuals (chi-squared) of the regression of wlr_from_sums; NaN if it cannot be fitted. """
+
+    det = sums['w'] * sums['wxx'] - sums['wx'] ** 2
+    ok = det > 0
+    det = np.where(ok, det, 1.0)
+    chi2 = sums['wyy'] - (sums['wxx'] * sums['wy'] ** 2 - 2 * sums['wx'] * sums['wy'] * sums['wxy'] + sums['w'] * sums['wxy'] ** 2) / det
+    return np.where(ok, np.maximum(chi2, 0), np.nan)
+
+
+def batch_slopes(x, y, w):
+
+    """
+    Weighted linear regression slopes (per day) along the last axis of x, y and w (weights, 1 / uncertainty ** 2);
+    NaN where the slope is undefined (e.g. all dates are the same).
+    """
+
+    sw = w.sum(axis=-1)
+    swx = (w * x).sum(axis=-1)
+    swy = (w * y).sum(axis=-1)
+    swxx = (w * x * x).sum(axis=-1)
+    swxy = (w * x * y).sum(axis=-1)
+    det = sw * swxx - swx ** 2
+    ok = det > 1e-12 * np.maximum(sw * swxx, 1e-300)
+    return np.where(ok, (sw * swxy - swx * swy) / np.where(ok, det, 1.0), np.nan)
+
+
+def shift_fit(fit, x0, y0):
+
+    """
+    Convert (in place) the intercept and covariance of wlr_from_sums from sums of (x - x0, y - y0) to x and y.
+    The slope, its error and the residual do not change.
+    """
+
+    b = fit['slope'] / 365.25
+    fit['intercept'] = fit['intercept'] + y0 - b * x0
+    fit['var_a'] = fit['var_a'] - 2 * x0 * fit['cov_ab'] + x0 ** 2 * fit['var_b']
+    fit['cov_ab'] = fit['cov_ab'] - x0 * fit['var_b']
+    return fit
+
+
+def linear_predict(fit, x):
+
+    """ Value and its uncertainty at x (days) from the coefficients of wlr_from_sums. """
+
+    value = fit['intercept'] + fit['slope'] / 365.25 * x
+    var = fit['var_a'] + 2 * x * fit['cov_ab'] + x * x * fit['var_b']
+    return value, np.sqrt(np.maximum(var, 0))
+
+
+class CompactStack:
+
+    """
+    All the observations of a DemPile in flat arrays, sorted by pixel and then by date
+    (like a CSR sparse matrix), so that per-pixel operations can be done for all pixels at once
+    as segmented reductions instead of a Python loop over PixelTimeSeries objects.
+
+    shape: (rows, cols) of the reference geometry. Pixels are numbered row by row (row * cols + col).
+    pixel: pixel number of each observation.
+    date: days since the reference date; value: elevation; uncertainty; demno: index in DemPile.dems.
+    labels: EVMD labels (-1 = outlier, >= 0 = cluster number), or None if EVMD has not been done.
+    offsets: the observations of pixel p are [offsets[p], offsets[p + 1]).
+    """
+
+    def __init__(self, shape, pixel, date, value, uncertainty, demno=None, labels=None, sort=True):
+        self.shape = tuple(shape)
+        pixel = np.asarray(pixel, dtype=np.int64)
+        arrays = {'date': date, 'value': value, 'uncertainty': uncertainty,
+                  'demno': np.full(pixel.size, -1) if demno is None else demno, 'labels': labels}
+        if sort and pixel.size > 0:
+            order = np.lexsort((np.asarray(date), pixel))
+            pixel = pixel[order]
+            arrays = {k: None if v is None else np.asarray(v)[order] for k, v in arrays.items()}
+        self.pixel = pixel
+        self.date = np.asarray(arrays['date'], dtype=float)
+        self.value = np.asarray(arrays['value'], dtype=float)
+        self.uncertainty = np.asarray(arrays['uncertainty'], dtype=float)
+        self.demno = np.asarray(arrays['demno']).astype(np.int64)
+        self.labels = None if arrays['labels'] is None else np.asarray(arrays['labels']).astype(np.int64)
+        self.counts = np.bincount(pixel, minlength=self.npix)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __repr__(self):
+        return 'CompactStack(shape={}, observations={}, labels={})'.format(self.shape, self.nobs, self.labels is not None)
+
+    @property
+    def npix(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def nobs(self):
+        return self.pixel.size
+
+    @classmethod
+    def from_ts(cls, ts):
+
+        """
+        Build from DemPile.ts (a 2-D object array of PixelTimeSeries).
+        EVMD labels are included if every pixel with data has them.
+        """
+
+        series = ts.ravel()
+        datas = [np.ndarray([0, 4]) if i is None else i._data.reshape(-1, 4) for i in series]
+        counts = np.array([i.shape[0] for i in datas], dtype=np.int64)
+        data = np.concatenate(datas) if datas else np.ndarray([0, 4])
+        pixel = np.repeat(np.arange(series.size), counts)
+        labels = None
+        if all([i is None or i._data.size == 0 or i.evmd_labels is not None for i in series]):
+            labels = np.concatenate([np.array([], dtype=np.int64) if i is None or i._data.size == 0
+                                     else np.asarray(i.evmd_labels).reshape(-1) for i in series])
+        return cls(ts.shape, pixel, data[:, 0], data[:, 1], data[:, 2], demno=data[:, 3], labels=labels)
+
+    # ==== selection ====
+
+    def dbscan_kept(self, eps=(6,), min_samples=(4,), max_elements=2 ** 24):
+
+        """
+        The observations that EVMD_DBSCAN would keep (labels >= 0) for every combination of eps and min_samples,
+        for all pixels. A point is kept if it has at least min_samples points (itself included) within eps on
+        the (date / 365, value) plane (a core point), or if it is within eps of a core point.
+        Pixels with the same number of observations are done together, and the pairwise distances of each chunk
+        of pixels (at most max_elements elements) are computed once for all the combinations.
+        Returns {(eps, min_samples): boolean mask of the observations}.
+        """
+
+        eps = np.atleast_1d(eps)
+        min_samples = np.atleast_1d(min_samples)
+        kept = {(e, m): np.zeros(self.nobs, dtype=bool) for e in eps for m in min_samples}
+        x = self.date / 365
+        for count in np.unique(self.counts[self.counts >= min_samples.min()]):
+            pixels = np.flatnonzero(self.counts == count)
+            step = max(1, max_elements // (count * count))
+            for k in range(0, pixels.size, step):
+                idx = self.offsets[pixels[k:k + step]][:, None] + np.arange(count)
+                distance = np.hypot(x[idx][:, :, None] - x[idx][:, None, :], self.value[idx][:, :, None] - self.value[idx][:, None, :])
+                for e in eps:
+                    neighbor = distance <= e
+                    neighbor_count = neighbor.sum(axis=2)
+                    for m in min_samples:
+                        core = neighbor_count >= m
+                        kept[(e, m)][idx] = core | (neighbor & core[:, None, :]).any(axis=2)
+        return kept
+
+    def verified(self):
+
+        """ Mask of the observations kept by EVMD (labels >= 0); all observations if there are no labels. """
+
+        if self.labels is None:
+            return np.ones(self.nobs, dtype=bool)
+        return self.labels >= 0
+
+    def subset(self, mask):
+
+        """ A new CompactStack with the observations where mask is True. """
+
+        return CompactStack(self.shape, self.pixel[mask], self.date[mask], self.value[mask], self.uncertainty[mask],
+                            demno=self.demno[mask], labels=None if self.labels is None else self.labels[mask], sort=False)
+
+    # ==== segmented reductions (one value per pixel) ====
+
+    def segment_count(self, mask=None):
+        if mask is None:
+            return self.counts.copy()
+        return np.bincount(self.pixel[mask], minlength=self.npix)
+
+    def segment_sum(self, values, mask=None):
+        if mask is None:
+            return np.bincount(self.pixel, weights=values, minlength=self.npix)
+        return np.bincount(self.pixel[mask], weights=values[mask], minlength=self.npix)
+
+    def segment_first(self, mask=None):
+
+        """ Index of the first (earliest) observation of each pixel where mask is True, or -1. """
+
+        idx = np.arange(self.nobs) if mask is None else np.where(mask)[0]
+        first = np.full(self.npix, -1, dtype=np.int64)
+        first[self.pixel[idx[::-1]]] = idx[::-1]         # the last assignment wins
+        return first
+
+    def segment_last(self, mask=None):
+
+        """ Index of the last (latest) observation of each pixel where mask is True, or -1. """
+
+        idx = np.arange(self.nobs) if mask is None else np.where(mask)[0]
+        last = np.full(self.npix, -1, dtype=np.int64)
+        last[self.pixel[idx]] = idx
+        return last
+
+    def segment_argmin(self, values, mask=None):
+
+        """ Index of the observation with the smallest value in each pixel (the earliest if tied), or -1. """
+
+        idx = np.arange(self.nobs) if mask is None else np.where(mask)[0]
+        order = idx[np.lexsort((idx, values[idx], self.pixel[idx]))]
+        first = np.full(self.npix, -1, dtype=np.int64)
+        first[self.pixel[order[::-1]]] = order[::-1]
+        return first
+
+    def segment_min(self, values, mask=None, fill=np.nan):
+        out = np.full(self.npix, fill, dtype=float)
+        idx = self.segment_argmin(values, mask)
+        out[idx >= 0] = values[idx[idx >= 0]]
+        return out
+
+    def segment_max(self, values, mask=None, fill=np.nan):
+        out = np.full(self.npix, fill, dtype=float)
+        idx = self.segment_argmin(-values, mask)
+        out[idx >= 0] = values[idx[idx >= 0]]
+        return out
+
+    def segment_quantile(self, values, q, mask=None, fill=np.nan):
+
+        """
+        q-th quantile (0 - 1) of the values in each pixel, with linear interpolation (same as np.quantile).
+        q can be a list; the result is then (len(q), npix).
+        """
+
+        idx = np.arange(self.nobs) if mask is None else np.where(mask)[0]
+        order = idx[np.lexsort((values[idx], self.pixel[idx]))]
+        sorted_values = values[order]
+        counts = np.bincount(self.pixel[order], minlength=self.npix)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        has = counts > 0
+        qs = np.atleast_1d(q)
+        out = np.full((qs.size, self.npix), fill, dtype=float)
+        for k, qi in enumerate(qs):
+            pos = qi * (counts[has] - 1)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.ceil(pos).astype(np.int64)
+            frac = pos - lo
+            vlo = sorted_values[starts[has] + lo]
+            vhi = sorted_values[starts[has] + hi]
+            out[k, has] = vlo + (vhi - vlo) * frac
+        return out if np.ndim(q) else out[0]
+
+    def segment_median(self, values, mask=None, fill=np.nan):
+        return self.segment_quantile(values, 0.5, mask=mask, fill=fill)
+
+    def largest_cluster(self):
+
+        """
+        Mask of the observations in the largest EVMD cluster of each pixel (the lowest label if tied).
+        """
+
+        if self.labels is None:
+            raise ValueError('No EVMD labels. Run DemPile.do_evmd first.')
+        kept = self.labels >= 0
+        nlabel = int(self.labels.max()) + 1 if kept.any() else 1
+        key = self.pixel[kept] * nlabel + self.labels[kept]
+        size = np.bincount(key, minlength=self.npix * nlabel).reshape(self.npix, nlabel)
+        best = size.argmax(axis=1)
+        return kept & (self.labels == best[self.pixel])
+
+    def search_dates(self, targets, side='left'):
+
+        """
+        Positions in the stack where each target date (days) would be inserted in each pixel, as (len(targets), npix):
+        the observations of pixel p before the position are earlier than the date (side='left') or not later
+        than it (side='right'). Like np.searchsorted, for all pixels and dates in one search.
+        """
+
+        targets = np.asarray(targets, dtype=float)
+        if self.nobs == 0:
+            return np.zeros((targets.size, self.npix), dtype=np.int64)
+        lo = min(self.date.min(), targets.min())
+        span = max(self.date.max(), targets.max()) - lo + 1
+        key = self.pixel * span + (self.date - lo)      # monotonic because the stack is sorted by pixel and date
+        query = np.arange(self.npix)[None, :] * span + (targets[:, None] - lo)
+        return np.searchsorted(key, query, side=side)
+
+    def previous_index(self, mask=None):
+
+        """ For each observation, the index of the closest observation at or before it where mask is True, or -1. """
+
+        if mask is None:
+            return np.arange(self.nobs)
+        return np.maximum.accumulate(np.where(mask, np.arange(self.nobs), -1)) if self.nobs else np.array([], dtype=np.int64)
+
+    def next_index(self, mask=None):
+
+        """ For each observation, the index of the closest observation at or after it where mask is True, or nobs. """
+
+        if mask is None:
+            return np.arange(self.nobs)
+        if self.nobs == 0:
+            return np.array([], dtype=np.int64)
+        return np.minimum.accumulate(np.where(mask, np.arange(self.nobs), self.nobs)[::-1])[::-1]
+
+    def bracket(self, targets, mask=None):
+
+        """
+        For each target date (days) and pixel, the index of the last observation on or before the date and
+        the index of the first observation on or after it, among the observations where mask is True (-1 if none).
+        Both are (len(targets), npix).
+        """
+
+        start = self.offsets[:-1][None, :]
+        end = self.offsets[1:][None, :]
+        prev = np.concatenate([self.previous_index(mask), [-1]])
+        nxt = np.concatenate([self.next_index(mask), [self.nobs]])
+        before = prev[self.search_dates(targets, side='right') - 1]
+        after = nxt[self.search_dates(targets, side='left')]
+        before = np.where(before >= start, before, -1)
+        after = np.where(after < end, after, -1)
+        return before, after
+
+    def segment_cumsum(self, values, chunk=65536):
+
+        """
+        Cumulative sum of the values restarted at each pixel (inclusive). It is computed in chunks of whole pixels
+        so that the rounding error depends on the chunk size, not on the size of the stack.
+        """
+
+        out = np.empty(self.nobs, dtype=float)
+        bounds = np.unique(np.append(self.offsets[np.searchsorted(self.offsets, np.arange(0, self.nobs, chunk))], self.nobs))
+        for c0, c1 in zip(bounds[:-1], bounds[1:]):
+            cs = np.cumsum(values[c0:c1])
+            start = self.offsets[self.pixel[c0:c1]] - c0
+            out[c0:c1] = cs - np.where(start > 0, cs[start - 1], 0)
+        return out
+
+    def reduce(self, stats=STATS, mask=None, refdate=None):
+
+        """
+        Per-pixel statistics of the observations where mask is True, computed over the whole stack at once.
+        stats: any of STATS:
+            count, min, max, median (of value), mad (median absolute deviation from the median, unscaled),
+            first_date, last_date, span (days), evmd_fraction (fraction of the observations kept by EVMD; all
+            observations, regardless of mask), year_count (number of observations in each calendar year).
+        refdate: the date (datetime or 'YYYY-MM-DD') that the dates are relative to; needed for year_count.
+        Returns {stat: array of npix}, except year_count, which is {year: array of npix}.
+        Pixels without observations are NaN (0 for the counts).
+        """
+
+        unknown = [i for i in stats if i not in STATS]
+        if unknown:
+            raise ValueError('Unknown statistics: {}. Choose from {}.'.format(unknown, STATS))
+        result = {}
+        count = self.segment_count(mask)
+        has = count > 0
+        if 'count' in stats:
+            result['count'] = count.astype(float)
+        if 'min' in stats:
+            result['min'] = self.segment_min(self.value, mask)
+        if 'max' in stats:
+            result['max'] = self.segment_max(self.value, mask)
+        if 'median' in stats or 'mad' in stats:
+            median = self.segment_median(self.value, mask)
+            if 'median' in stats:
+                result['median'] = median
+            if 'mad' in stats:
+                result['mad'] = self.segment_median(np.abs(self.value - median[self.pixel]), mask)
+        if {'first_date', 'last_date', 'span'} & set(stats):
+            first_date = self.take(self.date, self.segment_first(mask))
+            last_date = self.take(self.date, self.segment_last(mask))
+            if 'first_date' in stats:
+                result['first_date'] = first_date
+            if 'last_date' in stats:
+                result['last_date'] = last_date
+            if 'span' in stats:
+                result['span'] = last_date - first_date
+        if 'evmd_fraction' in stats:
+            if self.labels is None:
+                raise ValueError('No EVMD labels. Run DemPile.do_evmd first.')
+            result['evmd_fraction'] = np.where(self.counts > 0, self.segment_count(self.labels >= 0) / np.maximum(self.counts, 1), np.nan)
+        if 'year_count' in stats:
+            if refdate is None:
+                raise ValueError('refdate is needed for year_count.')
+            years = (np.datetime64(refdate, 'D') + self.date.astype('timedelta64[D]')).astype('datetime64[Y]').astype(int) + 1970
+            keep = np.ones(self.nobs, dtype=bool) if mask is None else mask
+            result['year_count'] = {int(year): self.segment_count(keep & (years == year)).astype(float)
+                                    for year in np.unique(years[keep])}
+        for key in ['min', 'max', 'median', 'mad', 'first_date', 'last_date', 'span']:
+            if key in result:
+                result[key][~has] = np.nan
+        return result
+
+    # ==== regression ====
+
+    def regression_sums(self, mask=None, yref=None):
+
+        """
+        Per-pixel sums of regression_terms over the observations where mask is True.
+        yref: per-pixel value subtracted from the observations first (for precision); see wlr_fit.
+        """
+
+        y = self.value if yref is None else self.value - yref[self.pixel]
+        terms = regression_terms(self.date, y, self.uncertainty)
+        return {key: self.segment_sum(terms[key], mask) for key in SUM_TERMS}
+
+    def wlr_fit(self, mask=None, min_count=3, min_time_span=365):
+
+        """
+        Weighted linear regression (as wlr_corefun) of the observations where mask is True, for all pixels.
+        See wlr_from_sums for the output; the intercept is in the units of value.
+        """
+
+        first = self.segment_first(mask)
+        last = self.segment_last(mask)
+        yref = np.where(first >= 0, self.value[first], 0.0)
+        span = np.where(first >= 0, self.date[last] - self.date[first], 0.0)
+        fit = wlr_from_sums(self.regression_sums(mask, yref=yref), span, min_count=min_count, min_time_span=min_time_span)
+        return shift_fit(fit, 0.0, yref)
+
+    def wlr_windows(self, windows, mask=None, min_count=3, min_time_span=365):
+
+        """
+        wlr_fit of the observations in each time window (start, end) in days, inclusive; None = open-ended.
+        Prefix sums of the regression terms are built once, so that each window only needs the sums
+        between two positions per pixel. Returns a list of dicts (see wlr_from_sums), one per window.
+        """
+
+        keep = np.ones(self.nobs, dtype=bool) if mask is None else mask
+        # dates and values are taken relative to the first observation of each pixel, for precision
+        first = self.offsets[:-1][self.pixel]
+        terms = regression_terms(self.date - self.date[first], self.value - self.value[first], self.uncertainty)
+        prefix = {key: np.concatenate([[0], self.segment_cumsum(terms[key] * keep)]) for key in SUM_TERMS}
+        prev = np.concatenate([self.previous_index(keep), [-1]])
+        nxt = np.concatenate([self.next_index(keep), [self.nobs]])
+        start = self.offsets[:-1]
+        earliest = self.date.min() if self.nobs else 0
+        latest = self.date.max() if self.nobs else 0
+        lo = self.search_dates([earliest if w[0] is None else w[0] for w in windows], side='left')
+        hi = self.search_dates([latest if w[1] is None else w[1] for w in windows], side='right')
+        has_data = self.counts > 0
+        x0 = np.zeros(self.npix)
+        y0 = np.zeros(self.npix)
+        x0[has_data] = self.date[start[has_data]]
+        y0[has_data] = self.value[start[has_data]]
+        results = []
+        for k in range(len(windows)):
+            # prefix[i + 1] is the sum from the first observation of the pixel to i; the window is [lo, hi)
+            sums = {key: np.where(hi[k] > start, prefix[key][hi[k]], 0) - np.where(lo[k] > start, prefix[key][lo[k]], 0)
+                    for key in SUM_TERMS}
+            i0 = nxt[lo[k]]
+            i1 = prev[hi[k] - 1]
+            has = (i0 < hi[k]) & (i1 >= lo[k])
+            span = np.where(has, self.date[np.clip(i1, 0, None)] - self.date[np.clip(i0, None, self.nobs - 1)], 0.0)
+            fit = wlr_from_sums(sums, span, min_count=min_count, min_time_span=min_time_span)
+            results.append(shift_fit(fit, x0, y0))
+        return results
+
+    def irls_fit(self, mask=None, method='huber', iterations=10, tuning=None, min_count=3, min_time_span=365):
+
+        """
+        Robust version of wlr_fit: iteratively reweighted least squares with Huber or Tukey (bisquare) weights,
+        for all pixels at once. Each of the (fixed number of) iterations is one weighted fit from per-pixel sums:
+        the residuals are divided by the uncertainty and by a robust scale (1.4826 x their median absolute value
+        in each pixel), and the weights 1 / uncertainty ** 2 are multiplied by the robust weights of the result.
+        method: 'huber' or 'tukey'; tuning: the tuning constant (default: ROBUST_TUNING[method]).
+        Returns the dict of wlr_fit (slope_err is the formal error with the final weights; residual is the sum of
+        squared residuals of all the observations), plus the per-pixel summary of the final robust weights:
+        weight_mean, weight_min, and downweighted (number of observations with a weight < 0.5).
+        """
+
+        if method not in ROBUST_TUNING:
+            raise ValueError('method must be "huber" or "tukey".')
+        if tuning is None:
+            tuning = ROBUST_TUNING[method]
+        keep = np.ones(self.nobs, dtype=bool) if mask is None else mask
+        first = self.segment_first(keep)
+        last = self.segment_last(keep)
+        span = np.where(first >= 0, self.date[last] - self.date[first], 0.0)
+        # dates and values relative to the first observation of each pixel, for precision
+        x0 = np.where(first >= 0, self.date[first], 0.0)
+        y0 = np.where(first >= 0, self.value[first], 0.0)
+        x = self.date - x0[self.pixel]
+        y = self.value - y0[self.pixel]
+        weight = keep.astype(float)
+        for k in range(iterations + 1):
+            terms = regression_terms(x, y, self.uncertainty, weight=weight)
+            sums = {key: self.segment_sum(terms[key], keep) for key in SUM_TERMS}
+            fit = wlr_from_sums(sums, span, min_count=min_count, min_time_span=min_time_span)
+            if k == iterations:
+                break
+            residual = (y - fit['intercept'][self.pixel] - fit['slope'][self.pixel] / 365.25 * x) / self.uncertainty
+            scale = 1.4826 * self.segment_median(np.abs(residual), keep & ~np.isnan(residual))
+            u = residual / np.maximum(scale[self.pixel], 1e-6)
+            if method == 'huber':
+                robust_weight = np.minimum(1, tuning / np.maximum(np.abs(u), 1e-12))
+            else:
+                robust_weight = np.where(np.abs(u) < tuning, (1 - (u / tuning) ** 2) ** 2, 0.0)
+            weight = np.where(keep & ~np.isnan(u), robust_weight, keep.astype(float))
+        # unweighted sum of squared residuals of all the observations, as wlr_corefun
+        residual = y - fit['intercept'][self.pixel] - fit['slope'][self.pixel] / 365.25 * x
+        fit['residual'] = np.where(np.isnan(fit['slope']), np.nan, self.segment_sum(np.nan_to_num(residual) ** 2, keep))
+        fit = shift_fit(fit, x0, y0)
+        fitted = ~np.isnan(fit['slope'])
+        fit['weight_mean'] = np.where(fitted, self.segment_sum(weight, keep) / np.maximum(fit['count'], 1), np.nan)
+        fit['weight_min'] = np.where(fitted, self.segment_min(weight, keep), np.nan)
+        fit['downweighted'] = np.where(fitted, self.segment_count(keep & (weight < 0.5)), np.nan)
+        return fit
+
+    def resample_slopes(self, mask=None, method='bootstrap', replicates=200, percentiles=(2.5, 97.5), seed=None,
+                        min_count=3, min_time_span=365, max_elements=2 ** 24):
+
+        """
+        Empirical uncertainty of the wlr_fit slope (m/yr) by resampling the observations where mask is True.
+        method:
+            jackknife: the slopes with each observation left out; std = sqrt((n - 1) / n * sum((slope_i - mean) ** 2))
+            bootstrap: slopes of replicates drawn with replacement; std and percentiles of the replicate slopes
+        Pixels with the same number of observations share the random index matrix of the replicates and are
+        done together as (pixels, replicates, observations) arrays, in chunks of at most max_elements elements.
+        Only the pixels with a wlr_fit slope (min_count, min_time_span) are done.
+        Returns {'std': array of npix} (and {'p<percentile>': array of npix} for the bootstrap), NaN elsewhere.
+        """
+
+        if method not in ['jackknife', 'bootstrap']:
+            raise ValueError('method must be "jackknife" or "bootstrap".')
+        keep = np.ones(self.nobs, dtype=bool) if mask is None else mask
+        stack = self.subset(keep)
+        fitted = ~np.isnan(stack.wlr_fit(min_count=min_count, min_time_span=min_time_span)['slope'])
+        result = {'std': np.full(self.npix, np.nan)}
+        if method == 'bootstrap':
+            for q in percentiles:
+                result['p{:g}'.format(q)] = np.full(self.npix, np.nan)
+        rng = np.random.default_rng(seed)
+        for count in np.unique(stack.counts[fitted]):
+            pixels = np.flatnonzero(fitted & (stack.counts == count))
+            if method == 'jackknife':
+                index = np.array([np.delete(np.arange(count), i) for i in range(count)])
+            else:
+                index = rng.integers(0, count, size=(replicates, count))
+            step = max(1, max_elements // index.size)
+            for k in range(0, pixels.size, step):
+                chunk = pixels[k:k + step]
+                idx = stack.offsets[chunk][:, None] + np.arange(count)
+                # dates and values relative to the first observation, for precision
+                x = stack.date[idx] - stack.date[idx[:, :1]]
+                y = stack.value[idx] - stack.value[idx[:, :1]]
+                w = 1 / stack.uncertainty[idx] ** 2
+                slopes = batch_slopes(x[:, index], y[:, index], w[:, index]) * 365.25
+                if method == 'jackknife':
+                    deviation = slopes - np.nanmean(slopes, axis=1, keepdims=True)
+                    result['std'][chunk] = np.sqrt((count - 1) / count * np.nansum(deviation ** 2, axis=1))
+                else:
+                    result['std'][chunk] = np.nanstd(slopes, axis=1, ddof=1)
+                    for q in percentiles:
+                        result['p{:g}'.format(q)][chunk] = np.nanpercentile(slopes, q, axis=1)
+        return result
+
+    def breakpoint_search(self, mask=None, min_segment=3, min_segment_span=0):
+
+        """
+        Two-segment piecewise-linear fit of the observations where mask is True, for every pixel: an independent
+        weighted linear regression (as wlr_corefun) before and after a breakpoint, which is searched exhaustively
+        between every two consecutive observation dates. Prefix sums of the regression terms make each candidate
+        O(1), and all candidates of all pixels are evaluated at once. The breakpoint minimizing the total chi-squared
+        is chosen, among those that leave at least min_segment observations spanning more than min_segment_span days
+        on each side.
+        Returns a dict of per-pixel arrays (NaN where no breakpoint is possible):
+            date: breakpoint date (days; midway between the two observations), date_err: half of the gap between them,
+            pre_slope, pre_slope_err, post_slope, post_slope_err: dh/dt (m/yr) of each segment,
+            step, step_err: elevation change across the breakpoint (post-break line minus pre-break line at date),
+            dbic: BIC of a single line minus BIC of the two segments (> 0 favors a breakpoint).
+        """
+
+        stack = self if mask is None else self.subset(mask)
+        start = stack.offsets[:-1][stack.pixel]
+        end = stack.offsets[1:][stack.pixel] - 1
+        # dates and values relative to the first observation of each pixel, for precision
+        x = stack.date - stack.date[start]
+        terms = regression_terms(x, stack.value - stack.value[start], stack.uncertainty)
+        cumulative = {key: stack.segment_cumsum(terms[key]) for key in SUM_TERMS}
+        # candidate i: the breakpoint is between observations i - 1 and i of the same pixel
+        k = np.arange(stack.nobs) - start
+        prev = np.maximum(np.arange(stack.nobs) - 1, 0)
+        pre = {key: np.where(k > 0, cumulative[key][prev], 0) for key in SUM_TERMS}
+        post = {key: cumulative[key][end] - pre[key] for key in SUM_TERMS}
+        pre_span = np.where(k > 0, x[prev], 0)
+        post_span = x[end] - x
+        candidate = ((k >= min_segment) & (end - np.arange(stack.nobs) + 1 >= min_segment) & (x > x[prev]) &
+                     (pre_span > min_segment_span) & (post_span > min_segment_span))
+        pre_fit = wlr_from_sums(pre, pre_span, min_count=min_segment, min_time_span=min_segment_span)
+        post_fit = wlr_from_sums(post, post_span, min_count=min_segment, min_time_span=min_segment_span)
+        chi2 = wlr_chi2(pre) + wlr_chi2(post)
+        candidate &= ~np.isnan(chi2) & ~np.isnan(pre_fit['slope']) & ~np.isnan(post_fit['slope'])
+        best = stack.segment_argmin(np.where(candidate, chi2, np.inf), candidate)
+        found = best >= 0
+        i = best[found]
+
+        result = {key: np.full(self.npix, np.nan) for key in ['date', 'date_err', 'pre_slope', 'pre_slope_err', 'post_slope',
+                                                             'post_slope_err', 'step', 'step_err', 'dbic']}
+        xb = (x[i - 1] + x[i]) / 2
+        result['date'][found] = stack.date[i - 1] + (stack.date[i] - stack.date[i - 1]) / 2
+        result['date_err'][found] = (stack.date[i] - stack.date[i - 1]) / 2
+        for name, fit in [('pre', pre_fit), ('post', post_fit)]:
+            result[name + '_slope'][found] = fit['slope'][i]
+            result[name + '_slope_err'][found] = fit['slope_err'][i]
+        pre_value, pre_err = linear_predict({key: pre_fit[key][i] for key in pre_fit}, xb)
+        post_value, post_err = linear_predict({key: post_fit[key][i] for key in post_fit}, xb)
+        result['step'][found] = post_value - pre_value
+        result['step_err'][found] = np.sqrt(pre_err ** 2 + post_err ** 2)
+        # single line vs. two segments (2 vs. 5 parameters, including the breakpoint)
+        total = {key: cumulative[key][end[i]] for key in SUM_TERMS}
+        n = total['n']
+        result['dbic'][found] = (wlr_chi2(total) + 2 * np.log(n)) - (chi2[i] + 5 * np.log(n))
+        return result
+
+    # ==== output ====
+
+    def to_grid(self, per_pixel, fill=np.nan):
+
+        """ Reshape one value per pixel to the reference geometry, with fill where the value is NaN. """
+
+        grid = np.asarray(per_pixel, dtype=float).reshape(self.shape).copy()
+        grid[np.isnan(grid)] = fill
+        return grid
+
+    def take(self, values, idx, fill=np.nan):
+
+        """ values[idx] for each pixel, with fill where idx is -1. """
+
+        out = np.full(self.npix, fill, dtype=float)
+        out[idx >= 0] = values[idx[idx >= 0]]
+        return out
+
+
+class StreamingSums:
+
+    """
+    The sums of regression_terms (and a few counters) per pixel, accumulated observation by observation, e.g.
+    DEM by DEM in DemPile.pileup_streaming, so that the weighted linear regression can be done without keeping
+    the observations. Memory is O(pixels).
+
+    xref: a date (days) subtracted from all dates, for precision (e.g. the mean date of the DEMs).
+    The first value of each pixel is subtracted from its values for the same reason.
+    count_all: number of observations given to add; the sums and first / last (dates) count only the kept ones.
+    """
+
+    def __init__(self, npix, xref=0.0):
+        self.npix = npix
+        self.xref = xref
+        self.sums = {key: np.zeros(npix) for key in SUM_TERMS}
+        self.yref = np.full(npix, np.nan)
+        self.count_all = np.zeros(npix, dtype=np.int64)
+        self.first = np.full(npix, np.inf)
+        self.last = np.full(npix, -np.inf)
+
+    def add(self, pixel, date, value, uncertainty, kept=None):
+
+        """ Add observations (flat pixel index, date, value, uncertainty), of which those where kept is True are used. """
+
+        if kept is None:
+            kept = np.ones(pixel.size, dtype=bool)
+        self.count_all += np.bincount(pixel, minlength=self.npix)
+        pixel, date, value, uncertainty = pixel[kept], date[kept], value[kept], uncertainty[kept]
+        new = np.isnan(self.yref[pixel])
+        self.yref[pixel[new]] = value[new]
+        terms = regression_terms(date - self.xref, value - self.yref[pixel], uncertainty)
+        for key in SUM_TERMS:
+            self.sums[key] += np.bincount(pixel, weights=terms[key], minlength=self.npix)
+        np.minimum.at(self.first, pixel, date)
+        np.maximum.at(self.last, pixel, date)
+
+    def fit(self, min_count=3, min_time_span=365):
+
+        """ wlr_from_sums of the kept observations; see wlr_from_sums for the output. """
+
+        span = np.where(self.sums['n'] > 0, self.last - self.first, 0.0)
+        fit = wlr_from_sums(self.sums, span, min_count=min_count, min_time_span=min_time_span)
+        return shift_fit(fit, self.xref, np.nan_to_num(self.yref))
+
+
+class RunningMedianGate:
+
+    """
+    A streaming replacement of EVMD: an observation is kept if it is within threshold of the median of the
+    window observations around it in time (itself, window // 2 before and window // 2 after; at the start and
+    the end of a series, the first or last window observations). Observations must be pushed in time order
+    per pixel. Only the last window observations of each pixel are kept in memory, so an observation is decided
+    when window // 2 later observations have arrived, or at flush. Pixels with fewer than min_samples observations
+    in total have all their observations rejected, like EVMD_DBSCAN (min_samples <= window, the odd window size used).
+    push and flush return the decided observations as (pixel, date, value, uncertainty, kept), ready for StreamingSums.add.
+    """
+
+    def __init__(self, npix, window=5, threshold=6, min_samples=4):
+        self.half = window // 2
+        self.window = 2 * self.half + 1
+        if min_samples > self.window:
+            # a pixel is decided as soon as window observations are seen, so more could not be required
+            raise ValueError('min_samples ({}) cannot be larger than the window ({}).'.format(min_samples, self.window))
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.date = np.full((self.window, npix), np.nan)
+        self.value = np.full((self.window, npix), np.nan)
+        self.uncertainty = np.full((self.window, npix), np.nan)
+        self.seen = np.zeros(npix, dtype=np.int64)
+
+    def _decide(self, pixel, slot):
+        median = np.nanmedian(self.value[:, pixel], axis=0)
+        value = self.value[slot, pixel]
+        kept = np.abs(value - median) <= self.threshold
+        return pixel, self.date[slot, pixel], value, self.uncertainty[slot, pixel], kept
+
+    @staticmethod
+    def _concatenate(decided):
+        if not decided:
+            empty = np.array([])
+            return empty.astype(np.int64), empty, empty, empty, empty.astype(bool)
+        return tuple(np.concatenate(i) for i in zip(*decided))
+
+    def push(self, pixel, date, value, uncertainty):
+
+        """ Add one observation to each of the pixels (e.g. a DEM). """
+
+        j = self.seen[pixel]
+        slot = j % self.window
+        self.date[slot, pixel] = date
+        self.value[slot, pixel] = value
+        self.uncertainty[slot, pixel] = uncertainty
+        self.seen[pixel] += 1
+        decided = []
+        # the window has just been filled: the first half + 1 observations are decided with it
+        filled = pixel[j == self.window - 1]
+        if filled.size:
+            for k in range(self.half + 1):
+                decided.append(self._decide(filled, k))
+        # afterwards: the middle observation of the window
+        later = j >= self.window
+        if later.any():
+            decided.append(self._decide(pixel[later], (j[later] - self.half) % self.window))
+        return self._concatenate(decided)
+
+    def flush(self):
+
+        """ Decide the remaining observations at the end of the series. """
+
+        n = self.seen
+        decided = []
+        full = np.flatnonzero(n >= self.window)
+        for k in range(self.half):
+            decided.append(self._decide(full, (n[full] - self.half + k) % self.window))
+        short = np.flatnonzero((n > 0) & (n < self.window))
+        for k in range(self.window - 1):
+            pixel = short[n[short] > k]
+            result = self._decide(pixel, k)
+            decided.append(result[:4] + (result[4] & (n[pixel] >= self.min_samples),))
+        self.seen = np.zeros_like(n)
+        self.date[:] = self.value[:] = self.uncertainty[:] = np.nan
+        return self._concatenate(decided)
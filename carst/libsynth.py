@@ -0,0 +1,286 @@
+# Func: synthetic_dem_stack, synthetic_image_pair, flow_field, write_geotiff
+# used for generating synthetic test data with a known answer (e.g., for the scripts in benchmarks/)
+# Oct 19 2026
+
+import os
+import numpy as np
+from datetime import datetime, timedelta
+from carst.libraster import gdal, osr
+
+
+def write_geotiff(fpath, array, geotransform, srs, nodata=None):
+
+    """
+    Write a 2-D array as a single-band Float32 GeoTiff.
+    geotransform: GDAL geotransform (ulx, xres, 0, uly, 0, -yres).
+    srs: EPSG code (int) or WKT string.
+    """
+
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(fpath, array.shape[1], array.shape[0], 1, gdal.GDT_Float32)
+    out_ds.SetGeoTransform(geotransform)
+    if isinstance(srs, str):
+        out_ds.SetProjection(srs)
+    else:
+        sr = osr.SpatialReference()
+        sr.ImportFromEPSG(int(srs))
+        out_ds.SetProjection(sr.ExportToWkt())
+    out_band = out_ds.GetRasterBand(1)
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+    out_band.WriteArray(array.astype(np.float32))
+    out_band.FlushCache()
+    out_ds = out_band = None
+
+
+def _strip_footprint(rng, shape, fraction):
+
+    """
+    A satellite-strip-like footprint: a band of random orientation covering about "fraction" of the grid.
+    """
+
+    if fraction >= 1:
+        return np.ones(shape, dtype=bool)
+    yy, xx = np.mgrid[0:shape[0], 0:shape[1]]
+    theta = rng.uniform(0, np.pi)
+    p = xx * np.cos(theta) + yy * np.sin(theta)
+    q = rng.uniform(0, 1 - fraction)
+    lo, hi = np.quantile(p, [q, q + fraction])
+    return (p >= lo) & (p <= hi)
+
+
+def _holes(rng, shape, fraction, radius):
+
+    """
+    Random round gaps (e.g., shadows or failed matching) covering about "fraction" of the grid.
+    """
+
+    mask = np.zeros(shape, dtype=bool)
+    n = int(round(fraction * shape[0] * shape[1] / (np.pi * radius ** 2)))
+    if n == 0:
+        return mask
+    yy, xx = np.ogrid[-radius:radius + 1, -radius:radius + 1]
+    disk = xx ** 2 + yy ** 2 <= radius ** 2
+    for cy, cx in zip(rng.integers(0, shape[0], n), rng.integers(0, shape[1], n)):
+        y0, x0 = cy - radius, cx - radius
+        ys = slice(max(y0, 0), min(y0 + disk.shape[0], shape[0]))
+        xs = slice(max(x0, 0), min(x0 + disk.shape[1], shape[1]))
+        mask[ys, xs] |= disk[ys.start - y0:ys.stop - y0, xs.start - x0:xs.stop - x0]
+    return mask
+
+
+def synthetic_dem_stack(outdir, shape=(200, 200), n_dems=20, spacing=10.0, oversample=1, epsg=32640,
+                        origin=(500000.0, 8800000.0), refdate='2015-01-01', start='2010-01-01', end='2020-01-01',
+                        dhdt_range=(-5.0, 1.0), uncertainty_range=(0.3, 2.0), footprint_fraction=0.7,
+                        gap_fraction=0.02, gap_radius=3, outlier_fraction=0.02, outlier_range=(20.0, 80.0),
+                        evmd_threshold=6, nodata=-9999.0, seed=0):
+
+    """
+    Generate a collection of synthetic DEMs with a known per-pixel dh/dt, and write them to outdir as
+    GeoTiffs, together with the reference geometry, a deminput.csv and a defaults.ini for bin/dhdt.py.
+
+    The surface at refdate is a smooth ramp with some bumps (200 - 700 m), and dh/dt varies linearly
+    with elevation from dhdt_range[0] (lowest) to dhdt_range[1] (highest), in m/yr, like a glacier.
+    Each DEM is:
+        the surface at its date + Gaussian noise (sigma = its uncertainty)
+        + outliers (outlier_fraction of the pixels, offset by +/- outlier_range, to be removed by EVMD),
+    and it only covers a random strip (footprint_fraction of the grid) with random gaps (gap_fraction).
+
+    shape: size of the reference geometry (rows, cols); spacing: its pixel size in meters.
+    oversample: the DEMs are generated on a grid oversample times finer than the reference geometry
+                (>1 exercises the resampling in DemPile.pileup).
+    Dates are random between start and end; uncertainties are random in uncertainty_range.
+
+    Returns a dict of the paths ('ini', 'csv', 'refgeo', 'truth_dhdt', 'truth_z0', 'dems', 'dhdt_prefix')
+    and the per-DEM 'dates' and 'uncertainties'.
+    """
+
+    rng = np.random.default_rng(seed)
+    outdir = os.path.abspath(outdir)
+    os.makedirs(outdir, exist_ok=True)
+    refdate_dt = datetime.strptime(refdate, '%Y-%m-%d')
+    start_dt = datetime.strptime(start, '%Y-%m-%d')
+    end_dt = datetime.strptime(end, '%Y-%m-%d')
+
+    def surface(rows, cols, res):
+        # cell-center coordinates, normalized to [0, 1] over the reference geometry
+        y = (np.arange(rows) + 0.5) * res / (shape[0] * spacing)
+        x = (np.arange(cols) + 0.5) * res / (shape[1] * spacing)
+        yy, xx = np.meshgrid(y, x, indexing='ij')
+        z0 = 200 + 450 * (1 - yy) + 25 * np.sin(4 * np.pi * xx) * np.cos(3 * np.pi * yy) + 20 * xx
+        ramp = (z0 - 180) / 520
+        dhdt = dhdt_range[0] + (dhdt_range[1] - dhdt_range[0]) * np.clip(ramp, 0, 1)
+        return z0, dhdt
+
+    # ==== Reference geometry and the ground truth ====
+    gt = (origin[0], spacing, 0.0, origin[1], 0.0, -spacing)
+    refgeo_path = os.path.join(outdir, 'refgeo.tif')
+    write_geotiff(refgeo_path, np.ones(shape), gt, epsg, nodata=nodata)
+    z0, dhdt = surface(shape[0], shape[1], spacing)
+    truth_z0_path = os.path.join(outdir, 'truth_z0.tif')
+    truth_dhdt_path = os.path.join(outdir, 'truth_dhdt.tif')
+    write_geotiff(truth_z0_path, z0, gt, epsg, nodata=nodata)
+    write_geotiff(truth_dhdt_path, dhdt, gt, epsg, nodata=nodata)
+
+    # ==== DEMs ====
+    res = spacing / oversample
+    dem_shape = (shape[0] * oversample, shape[1] * oversample)
+    dem_gt = (origin[0], res, 0.0, origin[1], 0.0, -res)
+    z0_fine, dhdt_fine = surface(dem_shape[0], dem_shape[1], res)
+    span = (end_dt - start_dt).days
+    dates = sorted([start_dt + timedelta(days=int(i)) for i in rng.integers(0, span + 1, n_dems)])
+    uncertainties = rng.uniform(*uncertainty_range, n_dems)
+    dem_paths = []
+    for i, (date, uncertainty) in enumerate(zip(dates, uncertainties)):
+        years = (date - refdate_dt).days / 365.25
+        z = z0_fine + dhdt_fine * years + rng.normal(0, uncertainty, dem_shape)
+        outliers = rng.random(dem_shape) < outlier_fraction
+        z[outliers] += rng.choice([-1, 1], outliers.sum()) * rng.uniform(*outlier_range, outliers.sum())
+        valid = _strip_footprint(rng, dem_shape, footprint_fraction) & ~_holes(rng, dem_shape, gap_fraction, gap_radius * oversample)
+        z[~valid] = nodata
+        dem_path = os.path.join(outdir, 'synth_{}_{:03d}_dem.tif'.format(date.strftime('%Y%m%d'), i))
+        write_geotiff(dem_path, z, dem_gt, epsg, nodata=nodata)
+        dem_paths.append(dem_path)
+
+    # ==== deminput.csv and defaults.ini ====
+    csv_path = os.path.join(outdir, 'deminput.csv')
+    with open(csv_path, 'w') as f:
+        f.write('filename,date,uncertainty\n')
+        for dem_path, date, uncertainty in zip(dem_paths, dates, uncertainties):
+            f.write('{},{},{:.5f}\n'.format(dem_path, date.strftime('%Y-%m-%d'), uncertainty))
+    dhdt_prefix = os.path.join(outdir, 'synth')
+    ini_path = os.path.join(outdir, 'defaults.ini')
+    with open(ini_path, 'w') as f:
+        f.write('[demlist]\ncsvfile = {}\n\n'.format(csv_path))
+        f.write('[refgeometry]\ngtiff = {}\n\n'.format(refgeo_path))
+        f.write('[settings]\nrefdate = {}\nmax_uncertainty = {}\nmin_time_span = 365\n\n'.format(refdate, uncertainty_range[1] + 1))
+        f.write('[regression]\nevmd_threshold = {}\n\n'.format(evmd_threshold))
+        f.write('[result]\npicklefile = {}\ndhdt_prefix = {}\n'.format(os.path.join(outdir, 'synth_TSpickle.p'), dhdt_prefix))
+
+    return {'ini': ini_path, 'csv': csv_path, 'refgeo': refgeo_path, 'truth_dhdt': truth_dhdt_path,
+            'truth_z0': truth_z0_path, 'dems': dem_paths, 'dhdt_prefix': dhdt_prefix,
+            'dates': dates, 'uncertainties': uncertainties}
+
+
+def flow_field(kind, shape, max_displacement=5.0, ice_fraction=0.5):
+
+    """
+    Analytic displacement field (in pixels) over a horizontal ice band in the middle of the image.
+    kind: 'channel' (parabolic glacier-like flow along x, zero at the band margins),
+          'shear' (simple shear: dx grows linearly across the band), or
+          'rotation' (rigid rotation of the band about the image center).
+    max_displacement: largest displacement in the band.
+    Returns dx, dy (displacement along columns and rows) and the ice mask. Outside the band (bedrock) dx = dy = 0.
+    """
+
+    rows, cols = shape
+    yy, xx = np.mgrid[0:rows, 0:cols].astype(float)
+    y0, y1 = rows * (1 - ice_fraction) / 2, rows * (1 + ice_fraction) / 2
+    ice = (yy >= y0) & (yy <= y1)
+    yc, xc = (rows - 1) / 2, (cols - 1) / 2
+    if kind == 'channel':
+        dx = max_displacement * (1 - ((yy - yc) / ((y1 - y0) / 2)) ** 2)
+        dy = np.zeros(shape)
+    elif kind == 'shear':
+        dx = max_displacement * (yy - y0) / (y1 - y0)
+        dy = np.zeros(shape)
+    elif kind == 'rotation':
+        omega = max_displacement / np.hypot((y1 - y0) / 2, cols / 2)
+        dx = -omega * (yy - yc)
+        dy = omega * (xx - xc)
+    else:
+        raise ValueError('kind must be "channel", "shear", or "rotation".')
+    dx[~ice] = 0
+    dy[~ice] = 0
+    return dx, dy, ice
+
+
+def synthetic_image_pair(outdir, shape=(600, 800), flow='channel', max_displacement=5.0, spacing=15.0,
+                         epsg=32633, origin=(400000.0, 8900000.0), image1_date='2018-04-01', image2_date='2018-04-17',
+                         image=None, noise=0.05, nodata_fraction=0.01, nodata_radius=6, refwindow=32, skip=8,
+                         backend='auto', seed=0):
+
+    """
+    Generate an image pair with a known displacement field for feature tracking, and write it to outdir
+    with a bedrock shapefile and a defaults.ini for bin/featuretrack.py.
+
+    Image 1 is a textured random image (multi-scale smoothed noise), or the first band of a real image
+    (image = path, cropped to shape; its geotransform and SRS are used). Image 2 is image 1 warped by
+    flow_field(flow, ...), i.e., a feature at p in image 1 is at p + (dx, dy) in image 2.
+    Both images get independent Gaussian noise (noise x the image std) and random nodata (0) holes.
+    The bedrock polygons cover the motionless strips above and below the ice band.
+
+    Returns a dict of the paths ('ini', 'image1', 'image2', 'bedrock', 'truth_dx', 'truth_dy') and the
+    displacement field ('dx', 'dy', in pixels).
+    """
+
+    from scipy.ndimage import gaussian_filter, map_coordinates
+
+    rng = np.random.default_rng(seed)
+    outdir = os.path.abspath(outdir)
+    os.makedirs(outdir, exist_ok=True)
+
+    # ==== Image 1 ====
+    if image is None:
+        texture = sum([gaussian_filter(rng.normal(size=shape), sigma) * sigma for sigma in (1, 2, 4, 8)])
+        texture = 6000 + 2000 * (texture - texture.mean()) / texture.std()
+        gt = (origin[0], spacing, 0.0, origin[1], 0.0, -spacing)
+        srs = epsg
+    else:
+        from carst.libraster import SingleRaster
+        raster = SingleRaster(image)
+        texture = raster.ReadAsArray()[:shape[0], :shape[1]].astype(float)
+        shape = texture.shape
+        gt = raster.GetGeoTransform()
+        srs = raster.GetProjection()
+
+    # ==== Image 2 and the truth ====
+    dx, dy, ice = flow_field(flow, shape, max_displacement=max_displacement)
+    yy, xx = np.mgrid[0:shape[0], 0:shape[1]].astype(float)
+    warped = map_coordinates(texture, [yy - dy, xx - dx], order=3, mode='reflect')
+    images = []
+    for img in (texture, warped):
+        img = img + rng.normal(0, noise * texture.std(), shape)
+        img = np.clip(img, 1, None)
+        img[_holes(rng, shape, nodata_fraction, nodata_radius)] = 0
+        images.append(img)
+
+    def write(name, array, nodata=None):
+        fpath = os.path.join(outdir, name)
+        write_geotiff(fpath, array, gt, srs, nodata=nodata)
+        return fpath
+
+    image1_path = write('image1.tif', images[0], nodata=0)
+    image2_path = write('image2.tif', images[1], nodata=0)
+    truth_dx_path = write('truth_dx.tif', dx)
+    truth_dy_path = write('truth_dy.tif', dy)
+
+    # ==== Bedrock shapefile (the motionless strips, shrunk by a margin) ====
+    import geopandas as gpd
+    from shapely.geometry import box
+    ice_rows = np.where(ice.any(axis=1))[0]
+    margin = refwindow // 2 + 2
+    strips = [(margin, ice_rows[0] - margin), (ice_rows[-1] + margin, shape[0] - margin)]
+    x0, x1 = gt[0] + margin * gt[1], gt[0] + (shape[1] - margin) * gt[1]
+    polygons = [box(x0, gt[3] + r1 * gt[5], x1, gt[3] + r0 * gt[5]) for r0, r1 in strips if r1 > r0]
+    bedrock_path = os.path.join(outdir, 'bedrock.shp')
+    crs = srs if isinstance(srs, str) else 'EPSG:{}'.format(srs)
+    gpd.GeoDataFrame({'id': list(range(len(polygons)))}, geometry=polygons, crs=crs).to_file(bedrock_path)
+
+    # ==== defaults.ini ====
+    search = int(np.ceil(max_displacement)) + 4
+    ini_path = os.path.join(outdir, 'defaults.ini')
+    with open(ini_path, 'w') as f:
+        f.write('[imagepair]\nimage1 = {}\nimage2 = {}\nimage1_date = {}\nimage2_date = {}\n\n'.format(
+                image1_path, image2_path, image1_date, image2_date))
+        f.write('[pxsettings]\nrefwindow_x = {0}\nrefwindow_y = {0}\nsearchwindow_x = {1}\nsearchwindow_y = {1}\n'
+                'skip_across = {2}\nskip_down = {2}\noversampling = 16\nthreads = {3}\ngaussian_hp = 1\n'
+                'gaussian_hp_sigma = 3\nbackend = {4}\n\n'.format(refwindow, search, skip, os.cpu_count() or 1, backend))
+        f.write('[outputcontrol]\ndatepair_prefix = 1\noutput_folder = {}\n\n'.format(outdir))
+        f.write('[rawoutput]\nif_generate_ampofftxt = 0\nif_generate_xyztext = 0\nlabel_ampcor = ampoff\nlabel_geotiff = velo-raw\n\n')
+        f.write('[velocorrection]\nbedrock = {}\nrefvelo_outlier_sigma = 3\nlabel_bedrock_histogram = bedrock\n'
+                'label_geotiff = velo-corrected\nlabel_logfile = velo_correction.txt\n\n'.format(bedrock_path))
+        f.write('[noiseremoval]\nsnr = 5\ngaussian_lp_mask_sigma = 5\nmin_clump_size = 101\n')
+
+    return {'ini': ini_path, 'image1': image1_path, 'image2': image2_path, 'bedrock': bedrock_path,
+            'truth_dx': truth_dx_path, 'truth_dy': truth_dy_path, 'dx': dx, 'dy': dy}
@@ -5,15 +5,100 @@
 # Class: AmpcoroffFile
 # manipulating the ampcor outpuf (and translating it into a geotiff)
 # by Whyjay Zheng, Jul 10 2018
+# last edit: Oct 19 2026 (per-stage performance instrumentation)
+# last edit: Oct 19 2026 (vectorized points_in_polygon)
+# last edit: Oct 19 2026 (binned KDE for OutlierDetection2D)
+# last edit: Oct 19 2026 (lattice placement in FillwithNAN)
 
 import numpy as np
 from carst.libraster import SingleRaster
-from scipy.interpolate import griddata
-from scipy.stats import gaussian_kde
+from carst.liblazy import lazy_import
+from carst.libperf import stage
 import pickle
-import matplotlib.pyplot as plt
-import geopandas as gpd
-from shapely.geometry import Point
+
+# matplotlib is imported when it is first used (see carst.liblazy).
+plt = lazy_import('matplotlib.pyplot')
+
+def kde_at_points(x, y, method='auto', max_exact=20000, gridsize=1024):
+
+	"""
+	Gaussian kernel density of the 2-D points (x, y) evaluated at the points themselves,
+	i.e., scipy.stats.gaussian_kde(np.vstack([x, y]))(np.vstack([x, y])) (Scott's rule bandwidth).
+	method: 'exact' uses gaussian_kde, which is O(n^2).
+	        'binned' bins the points (in coordinates where the kernel is circular) onto a fine grid
+	        (linear binning, ~8 cells per kernel sigma),
+	        convolves the counts with the kernel by FFT, and reads the density at the points by
+	        bilinear interpolation, which is near-linear in n (the grid is at most gridsize per axis).
+	        The grid only covers the bulk of the points (0.1 - 99.9 percentiles on each axis), so far outliers
+	        do not make it coarse; the density at the remaining points is summed from the binned counts
+	        and the off-grid points directly. If the bulk still needs a spacing coarser than sigma / 4,
+	        'exact' is used.
+	        'auto' uses 'exact' for up to max_exact points and 'binned' otherwise.
+	"""
+
+	from scipy.stats import gaussian_kde
+	x = np.asarray(x, dtype=float)
+	y = np.asarray(y, dtype=float)
+	xy = np.vstack([x, y])
+	if method == 'auto':
+		method = 'exact' if x.size <= max_exact else 'binned'
+	if method == 'exact':
+		return gaussian_kde(xy)(xy)
+	elif method != 'binned':
+		raise ValueError('method must be "auto", "exact", or "binned".')
+
+	from scipy.signal import fftconvolve
+	from scipy.ndimage import map_coordinates
+	n = x.size
+	cov = np.cov(xy) * n ** (-2 / 6)          # Scott's factor n ** (-1 / (d + 4)), squared, d = 2
+	norm = 2 * np.pi * np.sqrt(np.linalg.det(cov)) * n
+	# ==== whitened coordinates, in which the kernel is a unit circular Gaussian
+	# (a strongly correlated kernel is thin across its long axis, which would need a very fine x-y grid)
+	uv = np.linalg.solve(np.linalg.cholesky(cov), xy)
+	# ==== grid: the bulk of the data (0.1 - 99.9 percentiles) + 4 kernel sigma on each side, ~sigma / 8 spacing.
+	# A few far outliers do not coarsen the grid; the points outside the bulk are evaluated separately (see below).
+	core_lo, core_hi = np.percentile(uv, [0.1, 99.9], axis=1)
+	lo = core_lo - 4
+	hi = core_hi + 4
+	step = np.maximum(1 / 8, (hi - lo) / (gridsize - 1))
+	if np.any(step > 1 / 4):
+		# even the bulk of the data is too wide for gridsize nodes at an accurate spacing
+		return gaussian_kde(xy)(xy)
+	shape = (np.ceil((hi - lo) / step).astype(int) + 2)
+	# ==== linear binning (each point is split among its 4 neighbouring grid nodes) of the points on the grid
+	f = (uv - lo[:, None]) / step[:, None]
+	on_grid = np.all((f >= 0) & (f <= shape[:, None] - 2), axis=0)
+	i0 = np.floor(f[:, on_grid]).astype(int)
+	w1 = f[:, on_grid] - i0
+	w0 = 1 - w1
+	counts = np.zeros(shape)
+	for di, wi in ((0, w0[0]), (1, w1[0])):
+		for dj, wj in ((0, w0[1]), (1, w1[1])):
+			np.add.at(counts, (i0[0] + di, i0[1] + dj), wi * wj)
+	# ==== kernel on the grid (+- 4 sigma), then FFT convolution
+	half = np.ceil(4 / step).astype(int)
+	ku = np.arange(-half[0], half[0] + 1) * step[0]
+	kv = np.arange(-half[1], half[1] + 1) * step[1]
+	kernel = np.exp(-0.5 * (ku[:, None] ** 2 + kv[None, :] ** 2))
+	density = fftconvolve(counts, kernel, mode='same')
+	# ==== points in the bulk: every point within 4 sigma of them is on the grid
+	z = np.empty(n)
+	core = np.all((uv >= core_lo[:, None]) & (uv <= core_hi[:, None]), axis=0)
+	z[core] = map_coordinates(density, f[:, core], order=1, mode='nearest')
+	# ==== the other points (at most ~0.4% of them): kernel sum over the binned counts near each point,
+	# plus the exact kernel sum over the points that are not on the grid
+	off_uv = uv[:, ~on_grid]
+	for k in np.flatnonzero(~core):
+		c = np.round(f[:, k]).astype(int)
+		r0, r1 = np.maximum(c - half, 0), np.minimum(c + half + 1, shape)
+		zk = 0.0
+		if np.all(r1 > r0):
+			gu = lo[0] + np.arange(r0[0], r1[0]) * step[0] - uv[0, k]
+			gv = lo[1] + np.arange(r0[1], r1[1]) * step[1] - uv[1, k]
+			zk += np.sum(counts[r0[0]:r1[0], r0[1]:r1[1]] * np.exp(-0.5 * (gu[:, None] ** 2 + gv[None, :] ** 2)))
+		zk += np.sum(np.exp(-0.5 * np.sum((off_uv - uv[:, k:k + 1]) ** 2, axis=0)))
+		z[k] = zk
+	return z / norm
 
 class DuoZArray:
 
@@ -25,41 +110,68 @@ class DuoZArray:
 		self.z2 = z2
 		self.ini = ini
 		self.signal_idx = None
+		self.kde_z = None
+
+	def OutlierDetection2D(self, thres_sigma=3.0, plot=True, kde_method='auto', plot_max_points=100000):
+
+		"""
+		Points whose kernel density is lower than max density / exp(thres_sigma^2 / 2) are outliers
+		(i.e., beyond thres_sigma for a normal distribution). The density is from kde_at_points(method=kde_method).
+		plot: save the scatter plots (see PlotOutliers2D), drawn from at most plot_max_points points.
+		"""
 
-	def OutlierDetection2D(self, thres_sigma=3.0, plot=True):
 		x = self.z1
 		y = self.z2
-		xy = np.vstack([x, y])
-		z = gaussian_kde(xy)(xy)
+		z = kde_at_points(x, y, method=kde_method)
 
 		thres_multiplier = np.e ** (thres_sigma ** 2 / 2)   # normal dist., +- sigma number 
 		thres = max(z) / thres_multiplier
 		idx = z >= thres
 		self.signal_idx = idx
+		self.kde_z = z
 
 		if plot:
-			pt_style = {'s': 5, 'edgecolor': None}
-			ax_center = [x[idx].mean(), y[idx].mean()]
-			ax_halfwidth = max([max(x) - x[idx].mean(), 
-				                x[idx].mean() - min(x),
-				                max(y) - y[idx].mean(),
-				                y[idx].mean() - min(y)]) + 1
-			plt.subplot(121)
-			plt.scatter(x, y, c=z, **pt_style)
-			plt.scatter(x[~idx], y[~idx], c='xkcd:red', **pt_style)
-			plt.axis('scaled')
-			plt.xlim([ax_center[0] - ax_halfwidth, ax_center[0] + ax_halfwidth])
-			plt.ylim([ax_center[1] - ax_halfwidth, ax_center[1] + ax_halfwidth])
-			plt.ylabel('Offset-Y (pixels)')
-			plt.xlabel('Offset-X (pixels)')
-			plt.subplot(122)
-			plt.scatter(x, y, c=z, **pt_style)
-			plt.scatter(x[~idx], y[~idx], c='xkcd:red', **pt_style)
-			plt.axis('scaled')
-			plt.xlim([min(x[idx]) - 1, max(x[idx]) + 1])
-			plt.ylim([min(y[idx]) - 1, max(y[idx]) + 1])
-			plt.savefig(self.ini.velocorrection['label_bedrock_histogram'] + '_vx-vs-vy.png', format='png', dpi=200)
-			plt.clf()
+			self.PlotOutliers2D(max_points=plot_max_points)
+
+	def PlotOutliers2D(self, max_points=100000, seed=0):
+
+		"""
+		Scatter plots of the result of OutlierDetection2D (outliers in red).
+		Only a random subsample of max_points points is drawn (None: all points);
+		the axis limits are still from all the points.
+		"""
+
+		x = np.asarray(self.z1)
+		y = np.asarray(self.z2)
+		idx = self.signal_idx
+		z = self.kde_z
+		sub = np.arange(x.size)
+		if max_points is not None and x.size > max_points:
+			sub = np.sort(np.random.default_rng(seed).choice(x.size, max_points, replace=False))
+		xs, ys, zs, idxs = x[sub], y[sub], z[sub], idx[sub]
+
+		pt_style = {'s': 5, 'edgecolor': None}
+		ax_center = [x[idx].mean(), y[idx].mean()]
+		ax_halfwidth = max([max(x) - x[idx].mean(), 
+			                x[idx].mean() - min(x),
+			                max(y) - y[idx].mean(),
+			                y[idx].mean() - min(y)]) + 1
+		plt.subplot(121)
+		plt.scatter(xs, ys, c=zs, **pt_style)
+		plt.scatter(xs[~idxs], ys[~idxs], c='xkcd:red', **pt_style)
+		plt.axis('scaled')
+		plt.xlim([ax_center[0] - ax_halfwidth, ax_center[0] + ax_halfwidth])
+		plt.ylim([ax_center[1] - ax_halfwidth, ax_center[1] + ax_halfwidth])
+		plt.ylabel('Offset-Y (pixels)')
+		plt.xlabel('Offset-X (pixels)')
+		plt.subplot(122)
+		plt.scatter(xs, ys, c=zs, **pt_style)
+		plt.scatter(xs[~idxs], ys[~idxs], c='xkcd:red', **pt_style)
+		plt.axis('scaled')
+		plt.xlim([min(x[idx]) - 1, max(x[idx]) + 1])
+		plt.ylim([min(y[idx]) - 1, max(y[idx]) + 1])
+		plt.savefig(self.ini.velocorrection['label_bedrock_histogram'] + '_vx-vs-vy.png', format='png', dpi=200)
+		plt.clf()
 
 	def HistWithOutliers(self, which=None):
 		if which == 'x':
@@ -410,6 +522,8 @@ class AmpcoroffFile:
 		self.xyv_snr      = None
 		self.xyv_err_x    = None
 		self.xyv_err_y    = None
+		self.grid         = None     # (rows, cols, 8) lattice of the ampcor points (see FillwithNAN)
+		self.lattice      = False
 
 
 	def Load(self):
@@ -447,33 +561,37 @@ class AmpcoroffFile:
 	def FillwithNAN(self):
 		"""
 		Fill hole with nan value.
+		The ampcor points are placed on their lattice: x line numbers are min(x) + k * skip_across, and
+		y line numbers are min(y) + k * skip_down (or, if ampcor was split into chunks that do not share
+		a lattice along y, the sorted unique y line numbers). The (row, col) of each point is computed
+		arithmetically and the 8 columns are scattered into self.grid, a (rows, cols, 8) array that
+		is NaN where ampcor gives no result. self.data is a (rows * cols, 8) view of self.grid
+		(row-major, i.e., sorted by y and then by x).
 		"""
-		x_linenum = np.arange(min(self.data[:, 0]), max(self.data[:, 0]) + self.ini.pxsettings['skip_across'], self.ini.pxsettings['skip_across'])
-		y_linenum = np.unique(self.data[:, 2])
-		xx_linenum, yy_linenum = np.meshgrid(x_linenum, y_linenum)
-		complete_xymap = np.vstack((xx_linenum.flatten(), yy_linenum.flatten())).T
-		raw_xymap = self.data[:, [0, 2]]
-
-		# ---- collapse x & y linenumber to a 1-d array. 
-		#### NOTE THIS WILL GO WRONG IF YOU HAVE A SUPER HUGE ARRAY!
-
-		cxy = complete_xymap[:, 0] * 1000000 + complete_xymap[:, 1]
-		rxy = raw_xymap[:, 0] * 1000000 + raw_xymap[:, 1]
-		# ----
-
-		idx = np.where(np.isin(cxy, rxy))
-		idx = idx[0]
-		newdata = np.empty((complete_xymap.shape[0],8))
-		newdata[:] = np.nan
-		newdata[:,[0,2]] = complete_xymap
-		newdata[idx,1] = self.data[:, 1]
-		newdata[idx,3] = self.data[:, 3]
-		newdata[idx,4] = self.data[:, 4]
-		newdata[idx,5] = self.data[:, 5]
-		newdata[idx,6] = self.data[:, 6]
-		newdata[idx,7] = self.data[:, 7]
-
-		self.data = newdata
+		x = self.data[:, 0]
+		y = self.data[:, 2]
+		skip_x = self.ini.pxsettings['skip_across']
+		skip_y = self.ini.pxsettings['skip_down']
+		x0 = x.min()
+		y0 = y.min()
+		col = np.rint((x - x0) / skip_x).astype(int)
+		row = np.rint((y - y0) / skip_y).astype(int)
+		if np.all(y0 + row * skip_y == y):
+			y_linenum = y0 + np.arange(row.max() + 1) * skip_y
+			self.lattice = True
+		else:
+			y_linenum, row = np.unique(y, return_inverse=True)
+			self.lattice = False
+		x_linenum = x0 + np.arange(col.max() + 1) * skip_x
+
+		grid = np.full((y_linenum.size, x_linenum.size, 8), np.nan)
+		grid[:, :, 0] = x_linenum[None, :]
+		grid[:, :, 2] = y_linenum[:, None]
+		grid[row, col, 1:2] = self.data[:, 1:2]
+		grid[row, col, 3:] = self.data[:, 3:]
+
+		self.grid = grid
+		self.data = grid.reshape(-1, 8)
 
 	def Ampcoroff2Velo(self, ref_raster=None, datedelta=None, velo_or_pixel='velo'):
 
@@ -529,16 +647,21 @@ class AmpcoroffFile:
 			self.err_y  = self.data[:,[0,2,6]]
 
 
-	def Velo2XYV(self, xyvfileprefix=None, spatialres=None, generate_xyztext=False):
+	def Velo2XYV(self, xyvfileprefix=None, spatialres=None, generate_xyztext=False, use_lattice=True):
 
 		"""
 		spatialres: the spatial resolution of the XYV file.
 		xyvfileprefix: the prefix for output xyv file.
+		use_lattice: if the output grid is the lattice of the ampcor points (self.grid from FillwithNAN,
+		             which is the case for the default spatialres with skip_across == skip_down and square pixels),
+		             the values are taken from the lattice directly instead of griddata.
+		             Unlike griddata, this does not widen the nodata holes by one triangle.
 
 		the final output is
 		self.xyv_...  -> after griddata, the data have been warped into a grid with a fixed spatial resolution.
 		"""
 
+		from scipy.interpolate import griddata
 		if xyvfileprefix is None:
 			xyvfileprefix = self.ini.rawoutput['label_geotiff']
 		if spatialres is None:
@@ -549,12 +672,29 @@ class AmpcoroffFile:
 		y = np.arange(max(self.velo_x[:, 1]), min(self.velo_x[:, 1]), -spatialres)
 		xx, yy = np.meshgrid(x, y)
 
-		vx = griddata(self.velo_x[:, [0,1]], self.velo_x[:, 2], (xx, yy), method='linear')
-		vy = griddata(self.velo_y[:, [0,1]], self.velo_y[:, 2], (xx, yy), method='linear')
-		mag = np.sqrt(vx ** 2 + vy ** 2)
-		snr  = griddata(self.snr[:, [0,1]],   self.snr[:, 2],   (xx, yy), method='linear')
-		errx = griddata(self.err_x[:, [0,1]], self.err_x[:, 2], (xx, yy), method='linear')
-		erry = griddata(self.err_y[:, [0,1]], self.err_y[:, 2], (xx, yy), method='linear')
+		on_lattice = False
+		if use_lattice and self.lattice and self.grid is not None and self.grid.shape[0] > 1 and self.grid.shape[1] > 1:
+			lattice_dx = self.grid[0, 1, 0] - self.grid[0, 0, 0]
+			lattice_dy = self.grid[0, 0, 2] - self.grid[1, 0, 2]
+			on_lattice = np.isclose(spatialres, lattice_dx, rtol=1e-9) and np.isclose(spatialres, lattice_dy, rtol=1e-9)
+
+		with stage('gridding', items=xx.size):
+			if on_lattice:
+				# the rows of self.grid go from north to south, the same as y
+				lattice = lambda a: a[:, 2].reshape(self.grid.shape[:2])[:y.size, :x.size]
+				vx = lattice(self.velo_x)
+				vy = lattice(self.velo_y)
+				mag = np.sqrt(vx ** 2 + vy ** 2)
+				snr  = lattice(self.snr)
+				errx = lattice(self.err_x)
+				erry = lattice(self.err_y)
+			else:
+				vx = griddata(self.velo_x[:, [0,1]], self.velo_x[:, 2], (xx, yy), method='linear')
+				vy = griddata(self.velo_y[:, [0,1]], self.velo_y[:, 2], (xx, yy), method='linear')
+				mag = np.sqrt(vx ** 2 + vy ** 2)
+				snr  = griddata(self.snr[:, [0,1]],   self.snr[:, 2],   (xx, yy), method='linear')
+				errx = griddata(self.err_x[:, [0,1]], self.err_x[:, 2], (xx, yy), method='linear')
+				erry = griddata(self.err_y[:, [0,1]], self.err_y[:, 2], (xx, yy), method='linear')
 
 		self.xyv_velo_x   = np.stack([xx.flatten(), yy.flatten(), vx.flatten()]).T
 		self.xyv_velo_y   = np.stack([xx.flatten(), yy.flatten(), vy.flatten()]).T
@@ -642,26 +782,24 @@ def points_in_polygon(points_geometry, shp_filename):
 	# shp_filename: shapefile name 
 	# Both datasets should have the SAME CRS!
 
-	# return: np mask array showing where the targeted points are.
+	# return: np mask array (bool) showing where the targeted points are.
 
-	# import logging
-	# logging.basicConfig(level=logging.WARNING)
-	# from shapely.geometry import mapping
+	# All points are tested at once against an STR-tree of the polygons (shapely >= 2),
+	# instead of building a Point object for every point and testing the polygons one by one.
+	# Same as Point.within: points on a polygon boundary are not included.
 
+	import geopandas as gpd
+	import shapely
 
 	shapefile = gpd.read_file(shp_filename)
-	poly_geometries = [shapefile.loc[i]['geometry'] for i in range(len(shapefile))]
-	pt_geometries = [Point(xy) for xy in zip(points_geometry[:, 0], points_geometry[:, 1])]
-	pt_gs = gpd.GeoSeries(pt_geometries)
-
-	idx = None
-	for single_poly in poly_geometries:
-		if idx is None:
-			idx = pt_gs.within(single_poly)
-		else:
-			tmp = pt_gs.within(single_poly)
-			idx = np.logical_or(idx, tmp)
-
+	poly_geometries = [i for i in shapefile.geometry if i is not None and not i.is_empty]
+	idx = np.zeros(points_geometry.shape[0], dtype=bool)
+	if not poly_geometries:
+		return idx
+	points = shapely.points(np.asarray(points_geometry, dtype=float))
+	tree = shapely.STRtree(poly_geometries)
+	point_idx, _ = tree.query(points, predicate='within')
+	idx[point_idx] = True
 	return idx
 
 
@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+pytest.importorskip('rasterio')
+pytest.importorskip('shapely')
+
+from carst.libcache import BlockCache, set_cache
+from carst.libdhdt import DemPile
+from carst.libsynth import synthetic_dem_stack
+
+# A static file server with HTTP Range support and a fixed latency per request, run in its own process.
+# usage: python -c SERVER <directory> <latency in seconds>; the port is printed on the first line.
+SERVER = r'''
+import os, re, sys, time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+root, latency = sys.argv[1], float(sys.argv[2])
+
+class RangeHandler(SimpleHTTPRequestHandler):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=root, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        time.sleep(latency)
+        fpath = self.translate_path(self.path)
+        if not os.path.isfile(fpath):
+            self.send_error(404, 'File not found')
+            return None
+        size = os.path.getsize(fpath)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        start, end = 0, size - 1
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/tiff')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', '"{}-{}"'.format(size, int(os.path.getmtime(fpath))))
+        self.end_headers()
+        f = open(fpath, 'rb')
+        f.seek(start)
+        self.remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        outputfile.write(source.read(self.remaining))
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+print(server.server_address[1], flush=True)
+server.serve_forever()
+'''
+
+
+@pytest.fixture(scope='module')
+def remote_stack(tmp_path_factory):
+    outdir = tmp_path_factory.mktemp('stack')
+    synth = synthetic_dem_stack(str(outdir), shape=(24, 20), n_dems=6, seed=3)
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, str(outdir), '0.02'], stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(proc.stdout.readline())
+        base = 'http://127.0.0.1:{}/'.format(port)
+        # all DEMs are read through the server; one of them does not exist (HTTP 404)
+        with open(synth['csv'], 'w') as f:
+            f.write('filename,date,uncertainty\n')
+            for i, (dem_path, date, uncertainty) in enumerate(zip(synth['dems'], synth['dates'], synth['uncertainties'])):
+                f.write('{},{},{:.5f}\n'.format(base + os.path.basename(dem_path), date.strftime('%Y-%m-%d'), uncertainty))
+                if i == 2:
+                    f.write('{},{},{:.5f}\n'.format(base + 'missing_dem.tif', date.strftime('%Y-%m-%d'), uncertainty))
+        yield synth
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def pileup(ini, prefetch):
+    a = DemPile()
+    a.read_config(ini)
+    a.resample_param['retries'] = 2
+    a.resample_param['backoff'] = 0.01
+    a.init_ts()
+    a.pileup(prefetch=prefetch)
+    return a
+
+
+def assert_same_stack(a, b):
+    assert a.ts.shape == b.ts.shape
+    for ts_a, ts_b in zip(a.ts.ravel(), b.ts.ravel()):
+        assert np.array_equal(ts_a.get_date(), ts_b.get_date())
+        assert np.array_equal(ts_a.get_value(), ts_b.get_value())
+        assert np.array_equal(ts_a.get_demno(), ts_b.get_demno())
+
+
+def check_missing_dem_skipped(a):
+    missing = [i for i, dem in enumerate(a.dems) if dem.fpath.endswith('missing_dem.tif')]
+    assert len(missing) == 1
+    demno = np.concatenate([ts.get_demno() for ts in a.ts.ravel()])
+    assert missing[0] not in demno
+    assert len(np.unique(demno)) == len(a.dems) - 1
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_prefetch_equals_serial(remote_stack, tmp_path, capsys, cache):
+    if cache:
+        set_cache(BlockCache(str(tmp_path / 'cache')))
+    try:
+        serial = pileup(remote_stack['ini'], prefetch=0)
+        capsys.readouterr()
+        prefetched = pileup(remote_stack['ini'], prefetch=3)
+        output = capsys.readouterr().out
+    finally:
+        set_cache(None)
+    assert_same_stack(serial, prefetched)
+    # the 404 is retried (retries = 2), then reported and skipped without stopping the pileup
+    assert output.count('Retrying') == 2
+    check_missing_dem_skipped(prefetched)
+    check_missing_dem_skipped(serial)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+osr = pytest.importorskip('osgeo.osr')
+
+from carst.libraster import SingleRaster, unify_rasters
+
+
+def make_dem(fpath, epsg=32646, origin=(500000.0, 3000000.0), res=10.0, shape=(60, 80)):
+    ds = gdal.GetDriverByName('GTiff').Create(str(fpath), shape[1], shape[0], 1, gdal.GDT_Float64)
+    ds.SetGeoTransform((origin[0], res, 0, origin[1], 0, -res))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(-9999.0)
+    band.WriteArray(np.arange(shape[0] * shape[1], dtype=float).reshape(shape))
+    ds = None
+    return SingleRaster(str(fpath))
+
+
+def params(output_dir, **kwargs):
+    params = {'t_srs': "'EPSG:32646'", 'tr': '30 30', 'te': '500000 2999400 500600 2999910',
+              'of': 'GTiff', 'ot': 'Float32', 'output_dir': str(output_dir)}
+    params.update(kwargs)
+    return params
+
+
+def test_unify_warp_options(tmp_path):
+    dem = make_dem(tmp_path / 'dem.tif')
+    dem.Unify(params(tmp_path, wm='64', threads='2'))
+    assert dem.fpath == str(tmp_path / 'dem_warped.tif')
+    ds = gdal.Open(dem.fpath)
+    assert ds.GetDriver().ShortName == 'GTiff'                                     # of
+    assert ds.GetRasterBand(1).DataType == gdal.GDT_Float32                        # ot
+    assert ds.GetGeoTransform() == (500000.0, 30.0, 0.0, 2999910.0, 0.0, -30.0)    # te and tr
+    assert (ds.RasterXSize, ds.RasterYSize) == (20, 17)
+    srs = osr.SpatialReference(wkt=ds.GetProjection())
+    assert srs.GetAuthorityCode(None) == '32646'                                   # t_srs
+
+
+def test_unify_other_format_and_type(tmp_path):
+    dem = make_dem(tmp_path / 'dem.tif', epsg=32645, origin=(800000.0, 3000000.0))
+    dem.Unify(params(tmp_path, of='HFA', ot='Int16', tr='50 50', te='300000 2998000 301000 2999000'))
+    ds = gdal.Open(dem.fpath)
+    assert ds.GetDriver().ShortName == 'HFA'
+    assert ds.GetRasterBand(1).DataType == gdal.GDT_Int16
+    assert ds.GetGeoTransform() == (300000.0, 50.0, 0.0, 2999000.0, 0.0, -50.0)
+    assert (ds.RasterXSize, ds.RasterYSize) == (20, 20)
+
+
+def test_unify_rasters_reports_failures(tmp_path):
+    dems = [make_dem(tmp_path / 'dem{}.tif'.format(i)) for i in range(3)]
+    dems.append(SingleRaster(str(tmp_path / 'missing.tif')))
+    results = unify_rasters(dems, params(tmp_path), workers=2)
+    assert results[:3] == [None, None, None]
+    assert isinstance(results[3], Exception)
+    for i in range(3):
+        assert dems[i].fpath == str(tmp_path / 'dem{}_warped.tif'.format(i))